@@ -1,3 +1,5 @@
+import asyncio
+import aiohttp
 import requests
 import os
 from bs4 import BeautifulSoup
@@ -27,6 +29,31 @@ class WebpageDownloader:
                     tag[attr] = urljoin(base_url, tag[attr])
         return soup
 
+    def save_html(self, text, url, output_filename):
+        """Poprawia względne adresy w pobranej stronie i zapisuje ją do pliku"""
+        soup = BeautifulSoup(text, 'html.parser')
+        soup = self._fix_relative_urls(soup, url)
+
+        with open(output_filename, 'w', encoding='utf-8') as f:
+            f.write(str(soup))
+
+        abs_path = os.path.abspath(output_filename)
+        print(f"Strona pomyślnie zapisana do: {abs_path}")
+        return abs_path
+
+    async def fetch_webpage_async(self, http, url):
+        """Pobiera treść strony przez sesję aiohttp, zwraca (url, tekst) lub (url, None)"""
+        if not url.startswith(('http://', 'https://')):
+            url = 'https://' + url
+        print(f"Pobieram stronę z: {url}")
+        try:
+            async with http.get(url, headers=self.headers) as response:
+                response.raise_for_status()
+                return url, await response.text()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"Błąd pobierania strony: {str(e)}")
+            return url, None
+
     def save_webpage(self, url, output_filename=None):
         try:
             if not url.startswith(('http://', 'https://')):
@@ -39,15 +66,7 @@ class WebpageDownloader:
             response = requests.get(url, headers=self.headers, timeout=30)
             response.raise_for_status()
 
-            soup = BeautifulSoup(response.text, 'html.parser')
-            soup = self._fix_relative_urls(soup, url)
-
-            with open(output_filename, 'w', encoding='utf-8') as f:
-                f.write(str(soup))
-
-            abs_path = os.path.abspath(output_filename)
-            print(f"Strona pomyślnie zapisana do: {abs_path}")
-            return abs_path
+            return self.save_html(response.text, url, output_filename)
 
         except requests.exceptions.RequestException as e:
             print(f"Błąd pobierania strony: {str(e)}")
@@ -57,4 +76,4 @@ class WebpageDownloader:
             return None
         except Exception as e:
             print(f"Nieoczekiwany błąd: {str(e)}")
-            return None
\ No newline at end of file
+            return None
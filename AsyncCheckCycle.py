@@ -0,0 +1,195 @@
+"""Cykl sprawdzania w trybie CHECK_MODE=async.
+
+Wszystkie zapytania HTTP cyklu (pliki planów z PUW, strona Moodle, porównania
+grup w OpenRouter, webhooki Discord) idą przez jedną sesję aiohttp z limitem
+połączeń na host i wspólnym timeoutem, więc czas cyklu zbliża się do czasu
+najwolniejszego zapytania, a nie ich sumy. Parsowanie XLSX/HTML i zapisy do
+MongoDB działają w puli wątków CHECK_WORKERS, żeby nie blokować pętli zdarzeń.
+"""
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
+import sentry_sdk
+
+from ActivityDownloader import WebpageDownloader
+from DownloadCache import DownloadCache
+from LessonPlanDownloader import fetch_file_async, login_to_puw_async
+from MoodleCourses import (
+    MOODLE_WORKERS,
+    activities_fingerprint,
+    course_unchanged,
+    get_moodle_courses,
+    save_course_fingerprint,
+)
+from MoodleParserComponent import MoodleFileParser
+from RateLimiter import BudgetExceeded
+from metrics import track_stage
+
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "30"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "20"))
+HTTP_MAX_CONNECTIONS_PER_HOST = int(os.getenv("HTTP_MAX_CONNECTIONS_PER_HOST", "4"))
+CHECK_WORKERS = int(os.getenv("CHECK_WORKERS", "4"))
+
+
+def create_http_session():
+    """Sesja aiohttp współdzielona przez wszystkie zapytania jednego cyklu"""
+    connector = aiohttp.TCPConnector(
+        limit=HTTP_MAX_CONNECTIONS, limit_per_host=HTTP_MAX_CONNECTIONS_PER_HOST
+    )
+    return aiohttp.ClientSession(
+        connector=connector, timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT)
+    )
+
+
+async def prefetch_plan_files(http, download_cache, username, password, urls):
+    """Loguje się do PUW raz i pobiera równolegle wszystkie skoroszyty cyklu do download_cache"""
+    urls = sorted(set(urls))
+    if not urls:
+        return
+    print("Downloading files from PUW")
+    if await login_to_puw_async(http, username, password):
+        contents = await asyncio.gather(*(fetch_file_async(http, url) for url in urls))
+    else:
+        # Nieudane logowanie zapamiętujemy jak nieudane pobranie - próba w następnym cyklu
+        contents = [None] * len(urls)
+    for url, content in zip(urls, contents):
+        download_cache.put(url, content)
+
+
+async def check_moodle_course_async(http, executor, course, openrouter_api_key, mongo_uri):
+    """Jak main.check_moodle_course; nowe aktywności są formatowane równolegle"""
+    with sentry_sdk.start_transaction(op="check_cycle", name=f"moodle {course.key}"):
+        try:
+            downloader = WebpageDownloader()
+            url, text = await downloader.fetch_webpage_async(http, course.url)
+            if text is None:
+                return
+
+            loop = asyncio.get_running_loop()
+            saved_file = await loop.run_in_executor(
+                executor, downloader.save_html, text, url, course.html_filename
+            )
+            try:
+                parser = MoodleFileParser(
+                    saved_file,
+                    api_key=openrouter_api_key,
+                    mongodb_uri=mongo_uri,
+                    collection_name=course.collection_name,
+                )
+                try:
+                    with track_stage(f"moodle_{course.key}", "moodle_parse"):
+                        activities = await loop.run_in_executor(executor, parser.parse_activities)
+                        fingerprint = activities_fingerprint(activities)
+                        if await loop.run_in_executor(
+                            executor, course_unchanged, parser.db, course, fingerprint
+                        ):
+                            print(f"Kurs Moodle {course.key} bez zmian")
+                            return
+                        inserted, updated, removed = await loop.run_in_executor(
+                            executor, parser.diff_activities
+                        )
+                        if not (inserted or updated or removed):
+                            print("Wszystkie aktywności są aktualne w bazie")
+                        else:
+                            changed = inserted + updated
+                            contents = await asyncio.gather(
+                                *(
+                                    parser.format_with_openrouter_async(http, activity.content)
+                                    for activity in changed
+                                ),
+                                return_exceptions=True,
+                            )
+                            skipped = []
+                            for activity, content in zip(changed, contents):
+                                if isinstance(content, BudgetExceeded):
+                                    skipped.append(activity)
+                                elif isinstance(content, BaseException):
+                                    raise content
+                                else:
+                                    activity.content = content
+                            await loop.run_in_executor(
+                                executor,
+                                parser.apply_activity_sync,
+                                parser.without_skipped(inserted, skipped),
+                                parser.without_skipped(updated, skipped),
+                                removed,
+                            )
+                            if skipped:
+                                # Bez zapisu odcisku kursu kolejny cykl ponowi pominięte aktywności
+                                print(f"Pominięto {len(skipped)} aktywności do następnego cyklu - wyczerpany budżet OpenRouter")
+                                return
+                        await loop.run_in_executor(
+                            executor, save_course_fingerprint, parser.db, course, fingerprint
+                        )
+                finally:
+                    parser.mongo_client.close()
+            finally:
+                try:
+                    os.remove(saved_file)
+                    print(f"Usunięto plik tymczasowy: {saved_file}")
+                except Exception as e:
+                    print(f"Błąd podczas usuwania pliku {saved_file}: {str(e)}")
+
+        except Exception as e:
+            print(f"Błąd podczas przetwarzania aktywności Moodle ({course.key}): {str(e)}")
+
+
+async def check_moodle_activities_async(http, executor, openrouter_api_key, mongo_uri):
+    """Sprawdza strony kursów Moodle równolegle, najwyżej MOODLE_WORKERS naraz"""
+    courses = get_moodle_courses()
+    if not courses:
+        print("Błąd podczas przetwarzania aktywności Moodle: MOODLE_URL/MOODLE_URLS not set in environment variables")
+        return
+
+    print(f"\nSprawdzanie aktywności Moodle ({len(courses)} kursów)...")
+    semaphore = asyncio.Semaphore(MOODLE_WORKERS)
+
+    async def check_course(course):
+        async with semaphore:
+            await check_moodle_course_async(http, executor, course, openrouter_api_key, mongo_uri)
+
+    await asyncio.gather(*(check_course(course) for course in courses))
+
+
+async def run_check_cycle_async(
+    managers, username, password, openrouter_api_key, mongo_uri, check_moodle=True
+):
+    """Jeden cykl sprawdzania wszystkich planów i (z check_moodle) aktywności Moodle"""
+    managers = list(managers)
+    download_cache = DownloadCache(username, password)
+    executor = ThreadPoolExecutor(max_workers=CHECK_WORKERS, thread_name_prefix="check")
+    try:
+        async with create_http_session() as http:
+            moodle_task = None
+            if check_moodle:
+                moodle_task = asyncio.create_task(
+                    check_moodle_activities_async(http, executor, openrouter_api_key, mongo_uri)
+                )
+
+            active_managers = [manager for manager in managers if not manager.is_night_time()]
+            await prefetch_plan_files(
+                http,
+                download_cache,
+                username,
+                password,
+                [manager.lesson_plan.download_url for manager in active_managers],
+            )
+
+            results = await asyncio.gather(
+                *(
+                    manager.check_once_async(http, executor, download_cache)
+                    for manager in active_managers
+                ),
+                return_exceptions=True,
+            )
+            for manager, result in zip(active_managers, results):
+                if isinstance(result, Exception):
+                    print(f"Error in manager for {manager.plan_name}: {str(result)}")
+
+            if moodle_task is not None:
+                await moodle_task
+    finally:
+        executor.shutdown(wait=True)
+        download_cache.close()
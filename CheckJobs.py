@@ -0,0 +1,142 @@
+"""Etapy sprawdzania planów jako zadania kolejki (CHECK_MODE=queue).
+
+download (jeden skoroszyt PUW) -> process (jeden plan z tego skoroszytu)
+-> compare (porównanie grup w OpenRouter) lub notify (webhook Discord)
+-> refresh_cache. Każdy etap jest osobnym zadaniem JobQueue, więc nieudane
+porównanie albo webhook ponawia się bez ponownego pobierania i przetwarzania.
+Pobrany skoroszyt jest zapisany raz (JobQueue.put_blob), a zadania process
+wszystkich planów z tego pliku wskazują go przez blob_id.
+"""
+import threading
+
+from DownloadCache import DownloadCache
+from LessonPlanDownloader import download_from_puw
+from metrics import track_stage
+
+
+def update_message(manager):
+    return f"Plan zajęć został zaktualizowany dla: {manager.plan_name}"
+
+
+def schedule_check_jobs(job_queue, managers):
+    """Dodaje zadanie download dla każdego skoroszytu planów sprawdzanych w tym cyklu"""
+    plan_ids_by_url = {}
+    for plan_id, manager in managers.items():
+        if manager.is_night_time():
+            continue
+        plan_ids_by_url.setdefault(manager.lesson_plan.download_url, []).append(plan_id)
+
+    scheduled = 0
+    for url, plan_ids in plan_ids_by_url.items():
+        # Replika z dzierżawą innych planów tego skoroszytu dopisuje je do oczekującego zadania
+        job_id = job_queue.enqueue_merged(
+            "download",
+            plan_ids[0],
+            {"url": url, "plan_ids": plan_ids},
+            dedupe_key=f"download:{url}",
+            merge_field="plan_ids",
+        )
+        if job_id is not None:
+            scheduled += 1
+    print(
+        f"Zaplanowano {scheduled} zadań pobierania "
+        f"({len(plan_ids_by_url) - scheduled} dopisano do oczekujących, {len(plan_ids_by_url)} skoroszytów)"
+    )
+    return scheduled
+
+
+def create_job_handlers(managers, job_queue, username, password):
+    """Handlery etapów {typ: funkcja(job)} dla JobWorker; wyjątek oznacza ponowienie zadania"""
+    # Jeden plan przetwarzamy naraz, nawet przy kilku pracownikach process;
+    # managers może się zmieniać po przeładowaniu plans.json
+    plan_locks = {}
+    plan_locks_lock = threading.Lock()
+
+    def plan_lock(plan_id):
+        with plan_locks_lock:
+            return plan_locks.setdefault(plan_id, threading.Lock())
+
+    def download(job):
+        url = job["payload"]["url"]
+        with track_stage(job["plan_id"], "download"):
+            content = download_from_puw(username, password, url)
+        if content is None:
+            raise RuntimeError(f"Nie udało się pobrać pliku {url}")
+        blob_id = job_queue.put_blob(url, content)
+        for plan_id in job["payload"]["plan_ids"]:
+            if plan_id in managers:
+                job_queue.enqueue("process", plan_id, {"url": url, "blob_id": blob_id})
+
+    def process(job):
+        manager = managers[job["plan_id"]]
+        url = job["payload"]["url"]
+        content = job_queue.get_blob(job["payload"]["blob_id"])
+        if content is None:
+            # Następne zadanie download zapisze plik ponownie
+            print(f"Plik {url} dla planu {manager.plan_name} wygasł przed przetworzeniem - pomijam")
+            return
+        download_cache = DownloadCache(None, None)
+        download_cache.put(url, content)
+        with plan_lock(job["plan_id"]):
+            try:
+                new_checksum = manager.process_plan(download_cache)
+            finally:
+                manager.clean_new_files()
+                download_cache.close()
+        if new_checksum is None:
+            raise RuntimeError(f"Nie udało się przetworzyć planu {manager.plan_name}")
+        if not new_checksum:
+            return
+
+        if manager.should_compare():
+            job_queue.enqueue("compare", job["plan_id"], {"checksum": new_checksum})
+        elif manager.lesson_plan.plan_config.get("notify", False):
+            job_queue.enqueue("notify", job["plan_id"], {"message": update_message(manager)})
+        job_queue.enqueue("refresh_cache", job["plan_id"], dedupe_key=f"refresh_cache:{job['plan_id']}")
+
+    def compare(job):
+        manager = managers[job["plan_id"]]
+        print(f"Comparing plans for {manager.plan_name}...")
+        try:
+            # Porównujemy wersję, dla której utworzono zadanie, nawet jeśli zapisano już nowszą
+            comparison_result = manager.lesson_plan_comparator.compare_plans(
+                manager.get_comparison_collection_name(),
+                job["payload"].get("checksum"),
+                # Błąd zapytania dla grupy ponawia zadanie zamiast trafić do powiadomienia
+                raise_errors=True,
+            )
+        except Exception as e:
+            # Po ostatniej próbie wysyłamy przynajmniej zwykłe powiadomienie
+            if job_queue.is_last_attempt(job) and manager.lesson_plan.plan_config.get("notify", False):
+                print(f"Error during plan comparison: {e} - sending simple notification")
+                job_queue.enqueue("notify", job["plan_id"], {"message": update_message(manager)})
+            raise
+        if comparison_result:
+            # Webhook osobnym zadaniem - jego błąd nie powtarza porównania
+            job_queue.enqueue(
+                "notify",
+                job["plan_id"],
+                {
+                    "message": f"Zmiany w planie dla: {manager.plan_name}\n\n{comparison_result}",
+                    "force_send": True,
+                },
+            )
+
+    def notify(job):
+        manager = managers[job["plan_id"]]
+        sent = manager.send_discord_webhook(
+            job["payload"]["message"], force_send=job["payload"].get("force_send", False)
+        )
+        if sent is False:
+            raise RuntimeError(f"Nie udało się wysłać webhooka dla {manager.plan_name}")
+
+    def refresh_cache(job):
+        managers[job["plan_id"]].update_cached_plans()
+
+    return {
+        "download": download,
+        "process": process,
+        "compare": compare,
+        "notify": notify,
+        "refresh_cache": refresh_cache,
+    }
@@ -0,0 +1,59 @@
+import threading
+
+from LessonPlanDownloader import fetch_file, login_to_puw
+from metrics import CACHE_HITS
+
+
+class DownloadCache:
+    """Pamięć podręczna pobranych plików na jeden cykl sprawdzania, kluczowana download_url.
+
+    Plany wskazujące ten sam skoroszyt (różne sheet_name) albo sprawdzane
+    ponownie w tym samym cyklu pobierają go tylko raz, przez jedną sesję PUW.
+    Każdy plan zapisuje otrzymane bajty do własnego katalogu przebiegu.
+    """
+
+    def __init__(self, username, password):
+        self.username = username
+        self.password = password
+        self.session = None
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.url_locks = {}
+
+    def _url_lock(self, url):
+        with self.lock:
+            return self.url_locks.setdefault(url, threading.Lock())
+
+    def _get_session(self):
+        with self.lock:
+            if self.session is None:
+                print("Downloading files from PUW")
+                self.session = login_to_puw(self.username, self.password)
+            return self.session
+
+    def get(self, url):
+        """Zwraca zawartość pliku spod url (pobiera go przy pierwszym użyciu w cyklu)"""
+        with self._url_lock(url):
+            if url in self.entries:
+                CACHE_HITS.labels(cache="download").inc()
+                print(f"Using file downloaded earlier in this cycle: {url}")
+                return self.entries[url]
+
+            session = self._get_session()
+            content = fetch_file(session, url) if session is not None else None
+            # Nieudane pobranie też zapamiętujemy - kolejna próba w następnym cyklu
+            self.entries[url] = content
+            return content
+
+    def put(self, url, content):
+        """Zapisuje plik pobrany poza cache (np. równolegle w trybie CHECK_MODE=async)"""
+        with self._url_lock(url):
+            self.entries[url] = content
+
+    def close(self):
+        with self.lock:
+            if self.session is not None:
+                self.session.close()
+                self.session = None
+            self.entries.clear()
+            self.url_locks.clear()
@@ -0,0 +1,305 @@
+"""Trwała kolejka zadań w MongoDB (kolekcja jobs) dla CHECK_MODE=queue.
+
+Zadanie ma typ (etap: download, process, compare, notify, refresh_cache),
+plan i dane. Pracownik przejmuje zadanie atomowo (find_one_and_update) na
+JOB_LEASE_SECONDS, odnawianą w trakcie wykonywania; zadanie przejęte przez
+proces, który przestał działać, wraca do kolejki po wygaśnięciu dzierżawy.
+Zakończenie zadania zapisuje tylko pracownik, który nadal je trzyma. Błąd handlera ponawia tylko to zadanie,
+z wykładniczym odstępem, najwyżej max_attempts razy. Zakończone zadania są
+usuwane po JOB_RETENTION_SECONDS (indeks TTL).
+
+Duże dane (pobrany skoroszyt) zadania trzymają w job_blobs: jedna kopia na
+adres i sumę kontrolną, wspólna dla zadań wszystkich planów z tego pliku,
+usuwana po JOB_BLOB_TTL_SECONDS od ostatniego zapisu.
+"""
+import hashlib
+import os
+import socket
+import threading
+import traceback
+from datetime import datetime, timedelta
+
+import sentry_sdk
+from bson import Binary
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from metrics import JOBS_PROCESSED
+
+JOBS_COLLECTION = "jobs"
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "600"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+JOB_RETRY_SECONDS = int(os.getenv("JOB_RETRY_SECONDS", "30"))
+JOB_RETENTION_SECONDS = int(os.getenv("JOB_RETENTION_SECONDS", str(7 * 24 * 3600)))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "2"))
+JOB_BLOBS_COLLECTION = "job_blobs"
+JOB_BLOB_TTL_SECONDS = int(os.getenv("JOB_BLOB_TTL_SECONDS", str(24 * 3600)))
+
+STATUS_PENDING = "pending"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+# Zadanie przejęte przez innego pracownika po wygaśnięciu dzierżawy (tylko metryka)
+STATUS_LOST = "lost"
+
+
+def parse_concurrency(value):
+    """'process=2,compare=4' -> {"process": 2, "compare": 4}"""
+    concurrency = {}
+    for item in (value or "").split(","):
+        if "=" in item:
+            job_type, count = item.split("=", 1)
+            concurrency[job_type.strip()] = int(count)
+    return concurrency
+
+
+class JobQueue:
+    def __init__(self, db):
+        self.collection = db[JOBS_COLLECTION]
+        self.collection.create_index([("status", 1), ("type", 1), ("run_at", 1)])
+        self.collection.create_index("finished_at", expireAfterSeconds=JOB_RETENTION_SECONDS)
+        # Najwyżej jedno oczekujące zadanie o danym dedupe_key, także przy kilku replikach
+        self.collection.create_index(
+            "dedupe_key",
+            unique=True,
+            partialFilterExpression={"status": STATUS_PENDING, "dedupe_key": {"$type": "string"}},
+        )
+        self.blobs = db[JOB_BLOBS_COLLECTION]
+        self.blobs.create_index("expires_at", expireAfterSeconds=0)
+
+    def enqueue(self, job_type, plan_id, payload=None, dedupe_key=None, max_attempts=None, delay=0):
+        """Dodaje zadanie; z dedupe_key pomija je, jeśli takie samo czeka lub jest wykonywane"""
+        if dedupe_key and self.collection.find_one(
+            {"dedupe_key": dedupe_key, "status": {"$in": [STATUS_PENDING, STATUS_RUNNING]}},
+            projection={"_id": 1},
+        ):
+            return None
+        job = self._new_job(job_type, plan_id, payload, dedupe_key, max_attempts, delay)
+        try:
+            return self.collection.insert_one(job).inserted_id
+        except DuplicateKeyError:
+            # Inny proces dodał w międzyczasie takie samo zadanie
+            return None
+
+    def enqueue_merged(self, job_type, plan_id, payload, dedupe_key, merge_field):
+        """Dodaje zadanie albo dopisuje listę payload[merge_field] do oczekującego zadania o tym dedupe_key.
+
+        Zwraca id nowego zadania albo None, jeśli dopisano do istniejącego."""
+        job = self._new_job(job_type, plan_id, None, dedupe_key)
+        del job["payload"]
+        for key, value in payload.items():
+            if key != merge_field:
+                job[f"payload.{key}"] = value
+        update = {
+            "$setOnInsert": job,
+            "$addToSet": {f"payload.{merge_field}": {"$each": list(payload[merge_field])}},
+        }
+        query = {"dedupe_key": dedupe_key, "status": STATUS_PENDING}
+        try:
+            result = self.collection.update_one(query, update, upsert=True)
+        except DuplicateKeyError:
+            # Równoległy upsert innej repliki wstawił zadanie - teraz je znajdziemy
+            result = self.collection.update_one(query, update)
+        return result.upserted_id
+
+    def _new_job(self, job_type, plan_id, payload=None, dedupe_key=None, max_attempts=None, delay=0):
+        now = datetime.utcnow()
+        return {
+            "type": job_type,
+            "plan_id": plan_id,
+            "payload": payload or {},
+            "dedupe_key": dedupe_key,
+            "status": STATUS_PENDING,
+            "attempts": 0,
+            "max_attempts": max_attempts or JOB_MAX_ATTEMPTS,
+            "run_at": now + timedelta(seconds=delay),
+            "created_at": now,
+            "updated_at": now,
+        }
+
+    def put_blob(self, name, content):
+        """Zapisuje dane raz na (name, suma kontrolna) i zwraca id do umieszczenia w payload"""
+        checksum = hashlib.sha256(content).hexdigest()
+        blob_id = f"{name}:{checksum}"
+        now = datetime.utcnow()
+        # Ponowny zapis tej samej treści tylko przedłuża jej ważność
+        self.blobs.update_one(
+            {"_id": blob_id},
+            {
+                "$setOnInsert": {"content": Binary(content), "size": len(content), "created_at": now},
+                "$set": {"expires_at": now + timedelta(seconds=JOB_BLOB_TTL_SECONDS)},
+            },
+            upsert=True,
+        )
+        return blob_id
+
+    def get_blob(self, blob_id):
+        """Dane zapisane przez put_blob albo None, jeśli już wygasły"""
+        blob = self.blobs.find_one({"_id": blob_id}, projection={"content": 1})
+        return bytes(blob["content"]) if blob else None
+
+    def claim(self, job_types, worker_id):
+        """Przejmuje najstarsze gotowe zadanie jednego z typów (także z wygasłą dzierżawą)"""
+        now = datetime.utcnow()
+        return self.collection.find_one_and_update(
+            {
+                "type": {"$in": list(job_types)},
+                "$or": [
+                    {"status": STATUS_PENDING, "run_at": {"$lte": now}},
+                    {"status": STATUS_RUNNING, "locked_until": {"$lt": now}},
+                ],
+            },
+            {
+                "$set": {
+                    "status": STATUS_RUNNING,
+                    "worker": worker_id,
+                    "locked_until": now + timedelta(seconds=JOB_LEASE_SECONDS),
+                    "updated_at": now,
+                },
+                "$inc": {"attempts": 1},
+            },
+            sort=[("run_at", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    @staticmethod
+    def _owned(job):
+        # attempts rośnie przy każdym przejęciu, więc odróżnia też ponowne przejęcie przez tego samego pracownika
+        return {"_id": job["_id"], "worker": job["worker"], "attempts": job["attempts"], "status": STATUS_RUNNING}
+
+    def renew(self, job):
+        """Przedłuża dzierżawę zadania; False, gdy przejął je już inny pracownik"""
+        now = datetime.utcnow()
+        result = self.collection.update_one(
+            self._owned(job),
+            {"$set": {"locked_until": now + timedelta(seconds=JOB_LEASE_SECONDS), "updated_at": now}},
+        )
+        return result.matched_count == 1
+
+    def complete(self, job):
+        """Oznacza zadanie jako wykonane; False, gdy przejął je już inny pracownik"""
+        now = datetime.utcnow()
+        result = self.collection.update_one(
+            self._owned(job),
+            {
+                "$set": {"status": STATUS_DONE, "updated_at": now, "finished_at": now},
+                "$unset": {"locked_until": "", "payload": ""},
+            },
+        )
+        return result.matched_count == 1
+
+    def fail(self, job, error):
+        """Ponawia zadanie z wykładniczym odstępem albo oznacza je jako nieudane; zwraca nowy status"""
+        now = datetime.utcnow()
+        if job["attempts"] < job["max_attempts"]:
+            delay = JOB_RETRY_SECONDS * 2 ** (job["attempts"] - 1)
+            update = {"status": STATUS_PENDING, "run_at": now + timedelta(seconds=delay)}
+        else:
+            update = {"status": STATUS_FAILED, "finished_at": now}
+        update.update({"last_error": error, "updated_at": now})
+        result = self.collection.update_one(
+            self._owned(job), {"$set": update, "$unset": {"locked_until": ""}}
+        )
+        return update["status"] if result.matched_count == 1 else STATUS_LOST
+
+    def is_last_attempt(self, job):
+        return job["attempts"] >= job["max_attempts"]
+
+    def count_active(self, job_types=None):
+        query = {"status": {"$in": [STATUS_PENDING, STATUS_RUNNING]}}
+        if job_types:
+            query["type"] = {"$in": list(job_types)}
+        return self.collection.count_documents(query)
+
+
+class JobWorker(threading.Thread):
+    """Wątek wykonujący zadania wskazanych typów handlerami {typ: funkcja(job)}"""
+
+    def __init__(self, job_queue, handlers, job_types, name):
+        super().__init__(daemon=True, name=name)
+        self.job_queue = job_queue
+        self.handlers = handlers
+        self.job_types = job_types
+        # Nazwa hosta - w kontenerach kilku replik pid bywa ten sam
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{name}"
+        self.stop_event = threading.Event()
+
+    def _renew_lease(self, job, done):
+        """Odnawia dzierżawę zadania co 1/3 JOB_LEASE_SECONDS do ustawienia done"""
+        while not done.wait(JOB_LEASE_SECONDS / 3):
+            try:
+                if not self.job_queue.renew(job):
+                    print(f"Zadanie {job['type']} ({job.get('plan_id')}) przejął inny pracownik")
+                    return
+            except Exception as e:
+                print(f"Błąd podczas odnawiania dzierżawy zadania {job['type']}: {str(e)}")
+
+    def run_job(self, job):
+        done = threading.Event()
+        renewer = threading.Thread(
+            target=self._renew_lease, args=(job, done), daemon=True, name=f"{self.name}-lease"
+        )
+        renewer.start()
+        try:
+            self._run_handler(job)
+        finally:
+            done.set()
+            renewer.join()
+
+    def _run_handler(self, job):
+        with sentry_sdk.start_transaction(
+            op="check_cycle", name=f"job {job['type']} {job.get('plan_id')}"
+        ):
+            try:
+                self.handlers[job["type"]](job)
+            except Exception as e:
+                status = self.job_queue.fail(job, f"{type(e).__name__}: {e}")
+                print(
+                    f"Zadanie {job['type']} ({job.get('plan_id')}) nie powiodło się "
+                    f"(próba {job['attempts']}/{job['max_attempts']}, status: {status}): {e}"
+                )
+                traceback.print_exc()
+                JOBS_PROCESSED.labels(type=job["type"], status=status).inc()
+                return
+            if self.job_queue.complete(job):
+                JOBS_PROCESSED.labels(type=job["type"], status=STATUS_DONE).inc()
+            else:
+                # Wynik zapisze pracownik, który przejął zadanie po wygaśnięciu dzierżawy
+                print(f"Zadanie {job['type']} ({job.get('plan_id')}) wykonane, ale przejęte przez innego pracownika")
+                JOBS_PROCESSED.labels(type=job["type"], status=STATUS_LOST).inc()
+
+    def run_once(self):
+        """Wykonuje jedno gotowe zadanie; zwraca False, gdy żadnego nie było"""
+        job = self.job_queue.claim(self.job_types, self.worker_id)
+        if job is None:
+            return False
+        self.run_job(job)
+        return True
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                if self.run_once():
+                    continue
+            except Exception as e:
+                print(f"Błąd kolejki zadań w {self.name}: {str(e)}")
+            self.stop_event.wait(JOB_POLL_INTERVAL)
+
+    def stop(self):
+        self.stop_event.set()
+
+
+def start_job_workers(job_queue, handlers, concurrency):
+    """Uruchamia wątki pracowników: concurrency[typ] wątków dla każdego typu z handlers"""
+    workers = []
+    for job_type in handlers:
+        for index in range(concurrency.get(job_type, 1)):
+            worker = JobWorker(job_queue, handlers, [job_type], name=f"job-{job_type}-{index}")
+            worker.start()
+            workers.append(worker)
+    print(
+        "Uruchomiono pracowników kolejki: "
+        + ", ".join(f"{job_type} x{concurrency.get(job_type, 1)}" for job_type in handlers)
+    )
+    return workers
+
@@ -1,5 +1,14 @@
 from LessonPlanDownloader import LessonPlanDownloader
+from XlsxStreamReader import read_sheet_grid
+from SpreadsheetReader import get_reader
+from Timetable import get_plan_collection_name
+from TimetableExport import save_plan_exports
+from PlanHistory import PlanHistory
+from PlanEvents import publish_plan_event
+from metrics import CACHE_HITS, track_stage
 import os, time
+import hashlib
+import json
 from colorama import init, Style
 from difflib import SequenceMatcher
 
@@ -12,6 +21,12 @@ import pymongo
 from datetime import datetime
 
 
+# Silniki odczytu arkusza w unmerge_and_fill_data:
+# - "openpyxl" - pełne wczytanie skoroszytu i rozscalenie komórek
+# - "stream"   - strumieniowy odczyt tylko arkusza planu (XlsxStreamReader)
+XLSX_ENGINES = ("openpyxl", "stream")
+
+
 class LessonPlan(LessonPlanDownloader):
     def __init__(self, username, password, mongo_uri, plan_config, directory=""):
         super().__init__(username, password, directory, plan_config["download_url"])
@@ -31,6 +46,16 @@ class LessonPlan(LessonPlanDownloader):
         self.schedule_type = plan_config.get(
             "category", "st"
         )  # Default to standard schedule
+        self.xlsx_engine = plan_config.get(
+            "xlsx_engine", os.getenv("XLSX_ENGINE", "openpyxl")
+        )
+        if self.xlsx_engine not in XLSX_ENGINES:
+            raise ValueError(
+                f"Unknown xlsx_engine '{self.xlsx_engine}' for {plan_config['name']} "
+                f"(expected one of: {', '.join(XLSX_ENGINES)})"
+            )
+        # Silnik odczytu arkuszy w kolejnych etapach (openpyxl, calamine, stream)
+        self.reader = get_reader(plan_config.get("reader"))
 
         if self.save_to_mongodb:
             try:
@@ -47,6 +72,10 @@ class LessonPlan(LessonPlanDownloader):
             self.groups = plan_config["groups"]
 
         self.group_columns = {}
+        # Ostatnio ustalony układ kolumn grup: {"fingerprint": ..., "group_columns": ...}
+        self.group_layout = None
+        # Zdarzenie ostatnio zapisanej wersji (PlanWorker przekazuje je do procesu nadrzędnego)
+        self.published_event = None
 
     def get_schedule_headers(self, num_columns):
         """Return appropriate headers based on schedule type and actual number of columns"""
@@ -68,9 +97,23 @@ class LessonPlan(LessonPlanDownloader):
 
         return headers
 
-    def process_and_save_plan(self):
+    def cleanup_run(self):
+        super().cleanup_run()
+        self.converted_lesson_plan = None
+
+    def process_and_save_plan(self, download_cache=None):
         """Process and save the lesson plan, returns checksum if plan was processed"""
-        new_checksum = self.download_file()
+        # All files of this run live in a private temporary directory
+        self.published_event = None
+        self.start_run()
+        try:
+            return self._process_and_save_plan(download_cache)
+        finally:
+            self.cleanup_run()
+
+    def _process_and_save_plan(self, download_cache=None):
+        with track_stage(self.plan_config["name"], "download"):
+            new_checksum = self.download_file(download_cache)
         if not new_checksum:
             print("Failed to download file.")
             return None
@@ -79,7 +122,7 @@ class LessonPlan(LessonPlanDownloader):
 
         if self.save_to_mongodb:
             # Use plan-specific collection
-            collection_name = f"plans_{self.plan_config['name'].lower().replace(' ', '_').replace('-', '_')}"
+            collection_name = get_plan_collection_name(self.plan_config)
             collection = self.db[collection_name]
             # Check MongoDB for changes
             latest_plan = collection.find_one(
@@ -93,6 +136,7 @@ class LessonPlan(LessonPlanDownloader):
             )
 
             if latest_checksum and latest_checksum == new_checksum:
+                CACHE_HITS.labels(cache="plan_checksum").inc()
                 print(
                     f"Plan has not changed (MongoDB check in {collection_name}, checksum: {new_checksum})."
                 )
@@ -107,12 +151,16 @@ class LessonPlan(LessonPlanDownloader):
             print(f"Processing plan for {self.plan_config['name']}")
 
             try:
+                plan_name = self.plan_config["name"]
                 # Always process the downloaded file
-                self.unmerge_and_fill_data()
-                self.clean_excel_file()
+                with track_stage(plan_name, "unmerge"):
+                    self.unmerge_and_fill_data()
+                with track_stage(plan_name, "clean"):
+                    self.clean_excel_file()
 
                 # Process groups
-                self.find_group_columns_with_similarity()
+                with track_stage(plan_name, "column_discovery"):
+                    self.find_group_columns_with_similarity()
 
                 # Get all groups from instance
                 groups_to_process = self.groups.keys() if self.groups else []
@@ -133,6 +181,8 @@ class LessonPlan(LessonPlanDownloader):
                         else:
                             print(f"No data available for group: {group_name}")
                             failed_groups.append(group_name)
+                    except MemoryError:
+                        raise
                     except Exception as group_error:
                         print(
                             f"Error processing group {group_name}: {str(group_error)}"
@@ -152,6 +202,9 @@ class LessonPlan(LessonPlanDownloader):
 
                 return new_checksum
 
+            except MemoryError:
+                # Proces roboczy planu (PLAN_ISOLATION=process) jest po tym uruchamiany ponownie
+                raise
             except Exception as e:
                 print(f"Error processing plan: {str(e)}")
                 import traceback
@@ -171,6 +224,8 @@ class LessonPlan(LessonPlanDownloader):
         if not self.file_save_path:
             print("No file has been downloaded yet. Please run download_file() first.")
             return False
+        if self.xlsx_engine == "stream":
+            return self.unmerge_and_fill_data_streaming()
         wb = openpyxl.load_workbook(self.file_save_path)
         ws = wb[self.sheet_name]
 
@@ -195,6 +250,23 @@ class LessonPlan(LessonPlanDownloader):
         print(f"Unmerged file saved as: {self.converted_lesson_plan}{Style.RESET_ALL}")
         return True
 
+    def unmerge_and_fill_data_streaming(self):
+        """Reads only the timetable sheet with merged ranges filled and saves it without styles"""
+        grid = read_sheet_grid(self.file_save_path, self.sheet_name)
+
+        wb = openpyxl.Workbook(write_only=True)
+        ws = wb.create_sheet(title=self.sheet_name)
+        for row in grid:
+            ws.append(row)
+
+        dir_path = os.path.dirname(self.file_save_path)
+        file_name = os.path.basename(self.file_save_path)
+        self.converted_lesson_plan = os.path.join(dir_path, "unmerged_" + file_name)
+
+        wb.save(self.converted_lesson_plan)
+        print(f"Unmerged file saved as: {self.converted_lesson_plan}{Style.RESET_ALL}")
+        return True
+
     @staticmethod
     def clean_text(text):
         if isinstance(text, str):
@@ -213,37 +285,36 @@ class LessonPlan(LessonPlanDownloader):
         temp_file = file_name + "_temp" + file_extension
 
         try:
-            with pd.ExcelFile(self.converted_lesson_plan) as xls:
-                sheet_names = xls.sheet_names
-                wb = openpyxl.Workbook()
-                wb.remove(wb.active)
-                for sheet_name in sheet_names:
-                    # Read data into DataFrame
-                    df = pd.read_excel(xls, sheet_name=sheet_name)
-
-                    # Clean text data -
-                    # df = df.apply(self.clean_text)
-
-                    # Create new worksheet
-                    ws = wb.create_sheet(title=sheet_name)
-
-                    # Write headers
-                    for col_num, value in enumerate(df.columns.values, 1):
-                        ws.cell(row=1, column=col_num, value=value)
-
-                    # Write data
-                    for row_num, row in enumerate(df.values, 2):
-                        for col_num, value in enumerate(row, 1):
-                            cell = ws.cell(row=row_num, column=col_num, value=value)
-                            # Reset all formatting
-                            cell.font = openpyxl.styles.Font()
-                            cell.fill = openpyxl.styles.PatternFill()
-                            cell.border = openpyxl.styles.Border()
-                            cell.alignment = openpyxl.styles.Alignment(wrap_text=False)
-                            cell.number_format = "General"
-
-                # Save workbook
-                wb.save(temp_file)
+            sheet_names = self.reader.sheet_names(self.converted_lesson_plan)
+            wb = openpyxl.Workbook()
+            wb.remove(wb.active)
+            for sheet_name in sheet_names:
+                # Read data into DataFrame
+                df = self.reader.read_sheet(self.converted_lesson_plan, sheet_name)
+
+                # Clean text data -
+                # df = df.apply(self.clean_text)
+
+                # Create new worksheet
+                ws = wb.create_sheet(title=sheet_name)
+
+                # Write headers
+                for col_num, value in enumerate(df.columns.values, 1):
+                    ws.cell(row=1, column=col_num, value=value)
+
+                # Write data
+                for row_num, row in enumerate(df.values, 2):
+                    for col_num, value in enumerate(row, 1):
+                        cell = ws.cell(row=row_num, column=col_num, value=value)
+                        # Reset all formatting
+                        cell.font = openpyxl.styles.Font()
+                        cell.fill = openpyxl.styles.PatternFill()
+                        cell.border = openpyxl.styles.Border()
+                        cell.alignment = openpyxl.styles.Alignment(wrap_text=False)
+                        cell.number_format = "General"
+
+            # Save workbook
+            wb.save(temp_file)
 
             # Wait briefly for file operations to complete
             time.sleep(1)
@@ -276,7 +347,7 @@ class LessonPlan(LessonPlanDownloader):
             return False
 
         try:
-            df = pd.read_excel(self.converted_lesson_plan, sheet_name=self.sheet_name)
+            df = self.reader.read_sheet(self.converted_lesson_plan, self.sheet_name)
             for key, value in self.groups.items():
                 columns = df.columns[df.isin([value]).any()].tolist()
                 self.group_columns[key] = columns
@@ -337,7 +408,18 @@ class LessonPlan(LessonPlanDownloader):
             return not any("Column_" in col for col in columns)
 
         try:
-            df = pd.read_excel(self.converted_lesson_plan, sheet_name=self.sheet_name)
+            df = self.reader.read_sheet(self.converted_lesson_plan, self.sheet_name)
+
+            # Układ kolumn rzadko się zmienia - jeśli nagłówek arkusza jest taki sam
+            # jak poprzednio, używamy zapamiętanego przypisania kolumn do grup
+            layout_fingerprint = self.get_layout_fingerprint(df)
+            cached_group_columns = self.get_cached_group_columns(layout_fingerprint)
+            if cached_group_columns is not None:
+                CACHE_HITS.labels(cache="group_layout").inc()
+                print("Sheet layout unchanged, reusing cached group columns")
+                self.group_columns = cached_group_columns
+                return self.group_columns
+
             print("\nSearching for group columns...")
             print("Available columns:", df.columns.tolist())
 
@@ -370,6 +452,7 @@ class LessonPlan(LessonPlanDownloader):
                     key=lambda x: int(x.split(".")[-1]) if "." in x else 0
                 )
                 self.group_columns["cały kierunek"] = matching_columns
+                self.cache_group_columns(layout_fingerprint)
                 return self.group_columns
 
             # Standardowa logika dla zdefiniowanych grup
@@ -421,13 +504,72 @@ class LessonPlan(LessonPlanDownloader):
                     print(f"No columns found for {group_name}")
 
             self.group_columns = group_columns
+            self.cache_group_columns(layout_fingerprint)
             return self.group_columns
 
         except Exception as e:
             print(f"An error occurred while finding group columns: {str(e)}")
             return None
 
+    def get_layout_fingerprint(self, df):
+        """Fingerprint of the sheet header (rows above the first time slot) and the group config"""
+        header_rows = len(df)
+        if not df.empty:
+            time_rows = df.iloc[:, 0].astype(str).str.match(r"\s*\d{3,4}\s*-\s*\d{3,4}")
+            if time_rows.any():
+                header_rows = int(time_rows.values.argmax())
+
+        layout = {
+            "columns": [str(column) for column in df.columns],
+            "header": df.iloc[:header_rows].astype(str).values.tolist(),
+            "groups": self.groups,
+            "schedule_type": self.schedule_type,
+        }
+        layout_json = json.dumps(layout, ensure_ascii=False, sort_keys=True)
+        return hashlib.md5(layout_json.encode("utf-8"), usedforsecurity=False).hexdigest()
+
+    def get_cached_group_columns(self, fingerprint):
+        """Returns stored group columns for this layout fingerprint or None"""
+        if self.group_layout is None and self.save_to_mongodb:
+            try:
+                layout_doc = self.db["group_layouts"].find_one({"_id": self.plan_config["name"]})
+                if layout_doc:
+                    self.group_layout = {
+                        "fingerprint": layout_doc["fingerprint"],
+                        "group_columns": layout_doc["group_columns"],
+                    }
+            except Exception as e:
+                print(f"Error loading cached group layout: {str(e)}")
+
+        if self.group_layout and self.group_layout["fingerprint"] == fingerprint:
+            return {
+                group_name: list(columns)
+                for group_name, columns in self.group_layout["group_columns"].items()
+            }
+        return None
+
+    def cache_group_columns(self, fingerprint):
+        self.group_layout = {
+            "fingerprint": fingerprint,
+            "group_columns": {
+                group_name: list(columns) for group_name, columns in self.group_columns.items()
+            },
+        }
+        if self.save_to_mongodb:
+            try:
+                self.db["group_layouts"].replace_one(
+                    {"_id": self.plan_config["name"]},
+                    dict(self.group_layout, updated_at=datetime.now()),
+                    upsert=True,
+                )
+            except Exception as e:
+                print(f"Error saving group layout: {str(e)}")
+
     def get_lessons_for_group(self, group_name):
+        with track_stage(self.plan_config["name"], "group_extraction"):
+            return self._get_lessons_for_group(group_name)
+
+    def _get_lessons_for_group(self, group_name):
         if not self.converted_lesson_plan:
             print("No converted file found. Please run unmerge_and_fill_data() first.")
             return None
@@ -437,8 +579,8 @@ class LessonPlan(LessonPlanDownloader):
 
         try:
             print(f"\nReading Excel file for group: {group_name}")
-            df = pd.read_excel(
-                self.converted_lesson_plan, sheet_name=self.sheet_name, header=None
+            df = self.reader.read_sheet(
+                self.converted_lesson_plan, self.sheet_name, header=None
             )
 
             if group_name not in self.group_columns:
@@ -680,7 +822,8 @@ class LessonPlan(LessonPlanDownloader):
                     #print(f"\nProcessing group: {group_name}")
                     df = self.get_lessons_for_group(group_name)
                     if df is not None and not df.empty:
-                        html = self.generate_html_table(df)
+                        with track_stage(self.plan_config["name"], "html_render"):
+                            html = self.generate_html_table(df)
                         plans_data["groups"][group_name] = html
                         processed_groups.append(group_name)
                         #print(f"Successfully processed HTML for group: {group_name}")
@@ -696,7 +839,8 @@ class LessonPlan(LessonPlanDownloader):
             try:
                 df = self.get_lessons_for_group("cały kierunek")
                 if df is not None and not df.empty:
-                    html = self.generate_html_table(df)
+                    with track_stage(self.plan_config["name"], "html_render"):
+                        html = self.generate_html_table(df)
                     plans_data["groups"]["cały kierunek"] = html
                     processed_groups.append("cały kierunek")
                     #print("Successfully processed HTML for entire course")
@@ -708,7 +852,7 @@ class LessonPlan(LessonPlanDownloader):
             if self.save_to_mongodb:
                 try:
                     # Use plan-specific collection
-                    collection_name = f"plans_{self.plan_config['name'].lower().replace(' ','_').replace('-', '_')}"
+                    collection_name = get_plan_collection_name(self.plan_config)
                     collection = self.db[collection_name]
 
                     # Check if this checksum already exists
@@ -719,11 +863,30 @@ class LessonPlan(LessonPlanDownloader):
                         )
                         return
 
-                    # Insert the new plan with all groups
-                    result = collection.insert_one(plans_data)
+                    # Insert the new plan with all groups, previous version becomes a delta
+                    plan_history = PlanHistory(self.db, collection_name)
+                    with track_stage(self.plan_config["name"], "mongo_write"):
+                        result = plan_history.save_version(plans_data)
                     print(
                         f"Saved plans to MongoDB collection {collection_name} with id: {result.inserted_id}"
                     )
+
+                    # Eksporty tygodniowe (JSON, .ics) generujemy raz na wersję planu
+                    try:
+                        with track_stage(self.plan_config["name"], "export_render"):
+                            save_plan_exports(self.db, plans_data)
+                    except Exception as e:
+                        print(f"Error generating weekly exports: {str(e)}")
+
+                    # Powiadomienie klientów strumienia /api/events
+                    try:
+                        self.published_event = publish_plan_event(
+                            self.db,
+                            plans_data,
+                            plan_history.get_changed_groups(plans_data["version"]),
+                        )
+                    except Exception as e:
+                        print(f"Error publishing plan event: {str(e)}")
                     print(
                         f"Successfully processed groups: {', '.join(processed_groups)}"
                     )
@@ -1,6 +1,12 @@
 import os, requests
+import asyncio
+import aiohttp
 import os
 import hashlib
+import shutil
+import tempfile
+
+PUW_LOGIN_URL = "https://puw.wspa.pl/login/index.php"
 
 class LessonPlanDownloader:
     def __init__(self, username, password, directory="", download_url=None):
@@ -9,9 +15,26 @@ class LessonPlanDownloader:
         self.directory = directory
         self.file_save_path = None
         self.download_url = download_url
+        self.run_directory = None
         
     def get_file_save_path(self):
         return self.file_save_path
+
+    def start_run(self):
+        """Tworzy katalog tymczasowy na pliki bieżącego przebiegu (poprzedni jest usuwany)"""
+        self.cleanup_run()
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+        self.run_directory = tempfile.mkdtemp(prefix="lesson_plan_", dir=self.directory or None)
+        return self.run_directory
+
+    def cleanup_run(self):
+        """Usuwa katalog bieżącego przebiegu razem ze wszystkimi utworzonymi w nim plikami"""
+        if self.run_directory:
+            shutil.rmtree(self.run_directory, ignore_errors=True)
+            print(f"Usunięto katalog tymczasowy: {self.run_directory}")
+        self.run_directory = None
+        self.file_save_path = None
     
     def calculate_checksum(self, file_path):
         hash_md5 = hashlib.new('md5', usedforsecurity=False)
@@ -20,45 +43,105 @@ class LessonPlanDownloader:
                 hash_md5.update(chunk)
         return hash_md5.hexdigest()
     
-    def download_file(self):
-        url_login = "https://puw.wspa.pl/login/index.php"
+    def fetch_content(self, download_cache=None):
+        """Zawartość pliku planu (z download_cache, jeśli podano) lub None"""
         if not self.download_url:
             raise ValueError("Download URL not provided")
-        url_download = self.download_url
-        file_save_path = os.path.join(self.directory, "downloaded_file.xlsx")
-    
-        payload = {'password': self.password, 'username': self.username}
-        headers = {'anchor': ''}
-    
-        session = requests.Session()
-        print("Downloading file from PUW")
-        response_login = session.post(url_login, headers=headers, data=payload)
-        
-        if response_login.ok:
-            print("Login successful")
-    
-            try:
-                response_download = session.get(url_download)
-            except requests.exceptions.RequestException as e:
-                print("Error downloading the file")
+        if download_cache is not None:
+            return download_cache.get(self.download_url)
+        return download_from_puw(self.username, self.password, self.download_url)
+
+    def download_file(self, download_cache=None):
+        """Pobiera plan do katalogu przebiegu i zwraca jego sumę kontrolną.
+        Z download_cache plik jest pobierany raz na cykl dla wszystkich planów z tym samym URL."""
+        if not self.download_url:
+            raise ValueError("Download URL not provided")
+        file_save_path = os.path.join(
+            self.run_directory or self.directory, "downloaded_file.xlsx"
+        )
+
+        content = self.fetch_content(download_cache)
+        if content is None:
+            return None
+
+        # Każdy plan dostaje własną kopię pliku
+        with open(file_save_path, 'wb') as file:
+            file.write(content)
+        self.file_save_path = os.path.abspath(file_save_path)
+        print(f"File saved path = {self.file_save_path}")
+
+        # Calculate and return checksum
+        return hashlib.md5(content, usedforsecurity=False).hexdigest()
+
+
+def login_to_puw(username, password):
+    """Loguje się do PUW i zwraca sesję requests lub None"""
+    payload = {'password': password, 'username': username}
+    headers = {'anchor': ''}
+
+    session = requests.Session()
+    response_login = session.post(PUW_LOGIN_URL, headers=headers, data=payload)
+    if not response_login.ok:
+        print("Error logging in")
+        session.close()
+        return None
+    print("Login successful")
+    return session
+
+
+def fetch_file(session, url):
+    """Pobiera plik zalogowaną sesją, zwraca zawartość lub None"""
+    try:
+        response_download = session.get(url)
+    except requests.exceptions.RequestException:
+        print("Error downloading the file")
+        return None
+
+    if not response_download.ok:
+        print("Error downloading the file")
+        return None
+    print("File downloaded successfully")
+    return response_download.content
+
+
+def download_from_puw(username, password, url):
+    print("Downloading file from PUW")
+    session = login_to_puw(username, password)
+    if session is None:
+        return None
+    try:
+        return fetch_file(session, url)
+    finally:
+        session.close()
+
+
+async def login_to_puw_async(http, username, password):
+    """Loguje się do PUW współdzieloną sesją aiohttp (ciasteczka zostają w sesji), zwraca True/False"""
+    payload = {'password': password, 'username': username}
+    headers = {'anchor': ''}
+    try:
+        async with http.post(PUW_LOGIN_URL, headers=headers, data=payload) as response_login:
+            await response_login.read()
+            if not response_login.ok:
+                print("Error logging in")
                 return False
-    
-            if response_download.ok:
-                print("File downloaded successfully")
-    
-                with open(file_save_path, 'wb') as file:
-                    file.write(response_download.content)
-                self.file_save_path = os.path.abspath(file_save_path)
-                print(f"File saved path = {self.file_save_path}")
-                
-                # Calculate and return checksum
-                checksum = self.calculate_checksum(self.file_save_path)
-                return checksum
-            else:
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        print("Error logging in")
+        return False
+    print("Login successful")
+    return True
+
+
+async def fetch_file_async(http, url):
+    """Jak fetch_file, ale przez sesję aiohttp zalogowaną przez login_to_puw_async"""
+    try:
+        async with http.get(url) as response_download:
+            if not response_download.ok:
                 print("Error downloading the file")
-        else:
-            print("Error logging in")
-    
-        session.close()
+                return None
+            content = await response_download.read()
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        print("Error downloading the file")
         return None
-    
+    print("File downloaded successfully")
+    return content
@@ -0,0 +1,70 @@
+"""Strony kursów Moodle sprawdzane w każdym cyklu.
+
+MOODLE_URLS to lista adresów stron kursów rozdzielona przecinkami; aktywności
+każdego kursu trafiają do kolekcji Activities_<id kursu>. Pojedynczy
+MOODLE_URL (dotychczasowe ustawienie) zapisuje nadal do kolekcji Activities.
+Odcisk listy aktywności kursu (moodle_courses) pozwala pominąć porównanie
+z bazą, gdy strona kursu się nie zmieniła.
+"""
+import hashlib
+import os
+from dataclasses import dataclass
+from datetime import datetime
+from urllib.parse import parse_qs, urlparse
+
+COURSES_COLLECTION = "moodle_courses"
+MOODLE_WORKERS = int(os.getenv("MOODLE_WORKERS", "4"))
+
+
+@dataclass
+class MoodleCourse:
+    key: str
+    url: str
+    collection_name: str
+
+    @property
+    def html_filename(self):
+        # Osobny plik dla każdego kursu - strony są pobierane równolegle
+        return f"moodle_{self.key}.html"
+
+
+def get_course_key(url):
+    """Id kursu z adresu (course/view.php?id=123) albo skrót adresu"""
+    course_ids = parse_qs(urlparse(url).query).get("id")
+    if course_ids and course_ids[0].isdigit():
+        return course_ids[0]
+    return hashlib.md5(url.encode("utf-8"), usedforsecurity=False).hexdigest()[:12]
+
+
+def get_moodle_courses():
+    courses = []
+    legacy_url = os.getenv("MOODLE_URL")
+    if legacy_url:
+        courses.append(MoodleCourse(get_course_key(legacy_url), legacy_url, "Activities"))
+    for url in os.getenv("MOODLE_URLS", "").split(","):
+        url = url.strip()
+        if url and url != legacy_url:
+            key = get_course_key(url)
+            courses.append(MoodleCourse(key, url, f"Activities_{key}"))
+    return courses
+
+
+def activities_fingerprint(activities):
+    """Odcisk listy aktywności (sumy kontrolne w kolejności na stronie)"""
+    digest = hashlib.md5(usedforsecurity=False)
+    for activity in activities:
+        digest.update(activity.checksum.encode("ascii"))
+    return digest.hexdigest()
+
+
+def course_unchanged(db, course, fingerprint):
+    stored = db[COURSES_COLLECTION].find_one({"_id": course.key}, projection={"fingerprint": 1})
+    return stored is not None and stored.get("fingerprint") == fingerprint
+
+
+def save_course_fingerprint(db, course, fingerprint):
+    db[COURSES_COLLECTION].update_one(
+        {"_id": course.key},
+        {"$set": {"url": course.url, "fingerprint": fingerprint, "checked_at": datetime.utcnow()}},
+        upsert=True,
+    )
@@ -4,7 +4,8 @@ from typing import List, Dict
 import hashlib, requests, os
 from lxml import html, etree
 from datetime import datetime
-from pymongo import MongoClient
+from pymongo import DeleteMany, InsertOne, MongoClient, UpdateOne
+from RateLimiter import PRIORITY_FORMAT, BudgetExceeded, estimate_tokens, openrouter_limiter, usage_tokens
 
 @dataclass
 class MoodleActivity:
@@ -33,14 +34,15 @@ class MoodleActivity:
         return f"{self.type.upper()}: {self.title} (ID: {self.id})"
 
 class MoodleFileParser:
-    def __init__(self, html_file_path: str, api_key, mongodb_uri="mongodb://localhost:27017/"):
+    def __init__(self, html_file_path: str, api_key, mongodb_uri="mongodb://localhost:27017/", collection_name="Activities"):
         self.html_file_path = html_file_path
         self.supported_types = ['folder', 'resource', 'page', 'label']
         self.openrouter_api_key = api_key
         self.activities_hierarchy = []
         self.mongo_client = MongoClient(mongodb_uri)
         self.db = self.mongo_client[os.getenv("MONGO_DB", "Lesson")]
-        self.collection = self.db['Activities']
+        self.collection = self.db[collection_name]
+        self.collection.create_index('id')
         
     def load_file(self):
         try:
@@ -93,6 +95,35 @@ class MoodleFileParser:
             print(f"Błąd podczas wyodrębniania zawartości etykiety: {str(e)}")
             return None
 
+    OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
+
+    def build_format_request(self, text: str):
+        """Zwraca (nagłówki, treść) zapytania formatującego tekst do HTML"""
+        headers = {
+            "Authorization": f"Bearer {self.openrouter_api_key}",
+            "HTTP-Referer": "http://localhost:8000",
+            "Content-Type": "application/json"
+        }
+
+        data = {
+            "model": "openai/gpt-3.5-turbo-0613t",
+            "messages": [
+                {
+                    "role": "system",
+                    "content": "You are an HTML formatter. Format the given text into clean HTML with proper semantic tags, lists, paragraphs. Use <b> for emphasis, create proper <ol> and <ul> lists, and structure text into <p> paragraphs. Preserve all information and structure. Do not add any explanations, just return the formatted HTML."
+                },
+                {
+                    "role": "user",
+                    "content": f"Format this text into clean HTML:\n\n{text}"
+                }
+            ]
+        }
+        return headers, data
+
+    @staticmethod
+    def clean_formatted_text(formatted_text: str) -> str:
+        return formatted_text.strip().replace('```html', '').replace('```', '')
+
     def format_with_openrouter(self, text: str) -> str:
         if not text or not isinstance(text, str):
             return ""
@@ -101,44 +132,68 @@ class MoodleFileParser:
             return ""
 
         try:
-            headers = {
-                "Authorization": f"Bearer {self.openrouter_api_key}",
-                "HTTP-Referer": "http://localhost:8000",
-                "Content-Type": "application/json"
-            }
-
-            data = {
-                "model": "openai/gpt-3.5-turbo-0613t",
-                "messages": [
-                    {
-                        "role": "system",
-                        "content": "You are an HTML formatter. Format the given text into clean HTML with proper semantic tags, lists, paragraphs. Use <b> for emphasis, create proper <ol> and <ul> lists, and structure text into <p> paragraphs. Preserve all information and structure. Do not add any explanations, just return the formatted HTML."
-                    },
-                    {
-                        "role": "user",
-                        "content": f"Format this text into clean HTML:\n\n{text}"
-                    }
-                ]
-            }
+            headers, data = self.build_format_request(text)
+            estimated_tokens = estimate_tokens(data)
+            # Porównania planów mają pierwszeństwo w limicie OpenRouter
+            openrouter_limiter.acquire(estimated_tokens, PRIORITY_FORMAT)
 
             response = requests.post(
-                "https://openrouter.ai/api/v1/chat/completions",
+                self.OPENROUTER_URL,
                 headers=headers,
                 json=data
             )
 
             if response.status_code == 200:
-                formatted_text = response.json()['choices'][0]['message']['content'].strip()
-                formatted_text = formatted_text.replace('```html', '').replace('```', '')
-                return formatted_text
+                result = response.json()
+                openrouter_limiter.record_usage(estimated_tokens, usage_tokens(result))
+                return self.clean_formatted_text(result['choices'][0]['message']['content'])
             else:
+                if response.status_code == 429:
+                    openrouter_limiter.record_rate_limited(response.headers.get("Retry-After"))
                 print(f"Błąd API OpenRouter: {response.status_code}")
                 return text
 
+        except BudgetExceeded:
+            # Aktywność nie może trafić do bazy niesformatowana z aktualną sumą kontrolną
+            raise
+        except Exception as e:
+            print(f"Błąd formatowania OpenRouter: {str(e)}")
+            return text
+
+    async def format_with_openrouter_async(self, http, text: str) -> str:
+        """Jak format_with_openrouter, przez współdzieloną sesję aiohttp"""
+        if not text or not isinstance(text, str):
+            return ""
+
+        if not text.strip():
+            return ""
+
+        try:
+            headers, data = self.build_format_request(text)
+            estimated_tokens = estimate_tokens(data)
+            await openrouter_limiter.acquire_async(estimated_tokens, PRIORITY_FORMAT)
+            async with http.post(self.OPENROUTER_URL, headers=headers, json=data) as response:
+                if response.status != 200:
+                    if response.status == 429:
+                        openrouter_limiter.record_rate_limited(response.headers.get("Retry-After"))
+                    print(f"Błąd API OpenRouter: {response.status}")
+                    return text
+                result = await response.json()
+            openrouter_limiter.record_usage(estimated_tokens, usage_tokens(result))
+            return self.clean_formatted_text(result['choices'][0]['message']['content'])
+
+        except BudgetExceeded:
+            raise
         except Exception as e:
             print(f"Błąd formatowania OpenRouter: {str(e)}")
             return text
 
+    @staticmethod
+    def without_skipped(activities: List[MoodleActivity], skipped: List[MoodleActivity]) -> List[MoodleActivity]:
+        """Aktywności bez pominiętych przy formatowaniu - zostaną zapisane w kolejnym cyklu"""
+        skipped_ids = {id(activity) for activity in skipped}
+        return [activity for activity in activities if id(activity) not in skipped_ids]
+
     def _extract_activity_info(self, element, position: int) -> MoodleActivity:
         module_id = element.get('id', '').replace('module-', '')
         activity_type = ''
@@ -242,60 +297,84 @@ class MoodleFileParser:
         self.activities_hierarchy = activities
         return activities
 
+    def diff_activities(self):
+        """Zwraca (dodane, zmienione, _id do usunięcia) względem bazy, kluczem jest id modułu Moodle"""
+        stored = {}
+        removed = []
+        # Dokumenty z tym samym id (zapisy sprzed synchronizacji) - zostaje najnowszy
+        for doc in self.collection.find({}, {'id': 1, 'checksum': 1}).sort('sequence_number', -1):
+            if doc.get('id') in stored:
+                removed.append(doc['_id'])
+            else:
+                stored[doc.get('id')] = doc
+
+        inserted, updated = [], []
+        for activity in self.activities_hierarchy:
+            doc = stored.pop(activity.id, None)
+            if doc is None:
+                inserted.append(activity)
+            elif doc.get('checksum') != activity.checksum:
+                updated.append(activity)
+        # Aktywności, których nie ma już na stronie kursu
+        removed.extend(doc['_id'] for doc in stored.values())
+        return inserted, updated, removed
+
+    def apply_activity_sync(self, inserted: List[MoodleActivity], updated: List[MoodleActivity], removed):
+        """Zapisuje zmiany z diff_activities jednym uporządkowanym bulk_write"""
+        last_doc = self.collection.find_one(sort=[('sequence_number', -1)])
+        next_seq = (last_doc['sequence_number'] + 1) if last_doc else 1
+        timestamp = datetime.now().isoformat()
+
+        operations: list = []
+        if removed:
+            operations.append(DeleteMany({'_id': {'$in': removed}}))
+        for activity in inserted:
+            # Nowe aktywności dostają kolejny numer sekwencji, używany też jako position
+            activity.position = next_seq
+            activity_dict = activity.to_dict()
+            activity_dict.update({
+                'sequence_number': next_seq,
+                'created_at': timestamp
+            })
+            operations.append(InsertOne(activity_dict))
+            next_seq += 1
+        for activity in updated:
+            # Zmieniona aktywność zachowuje numer sekwencji i position
+            fields = activity.to_dict()
+            del fields['id'], fields['position']
+            fields['updated_at'] = timestamp
+            operations.append(UpdateOne({'id': activity.id}, {'$set': fields}))
+
+        if operations:
+            self.collection.bulk_write(operations, ordered=True)
+        print(
+            f"Zsynchronizowano aktywności: {len(inserted)} nowych, "
+            f"{len(updated)} zmienionych, {len(removed)} usuniętych"
+        )
+
     def save_to_mongodb(self):
         try:
-            # Najpierw zbierz wszystkie checksumy z aktualnych elementów
-            current_checksums = {activity.checksum for activity in self.activities_hierarchy}
-            
-            # Pobierz istniejące checksumy z bazy
-            existing_checksums = {
-                act['checksum'] 
-                for act in self.collection.find({}, {'checksum': 1})
-            }
-            
-            # Znajdź checksumy których nie ma w bazie
-            new_checksums = current_checksums - existing_checksums
-            
-            if not new_checksums:
-                print("Wszystkie aktywności już istnieją w bazie")
+            inserted, updated, removed = self.diff_activities()
+            if not (inserted or updated or removed):
+                print("Wszystkie aktywności są aktualne w bazie")
                 return True
-            
-            # Filtruj aktywności które trzeba dodać
-            activities_to_add = [
-                activity for activity in self.activities_hierarchy 
-                if activity.checksum in new_checksums
-            ]
-            
-            print(f"Znaleziono {len(activities_to_add)} nowych aktywności do dodania")
-            
-            # Znajdź najwyższy sequence_number i position
-            last_doc = self.collection.find_one(sort=[('sequence_number', -1)])
-            next_seq = (last_doc['sequence_number'] + 1) if last_doc else 1
-            next_pos = next_seq  # Używamy sequence_number jako position
-            
-            timestamp = datetime.now().isoformat()
-            
-            # Przetwarzaj tylko nowe aktywności
-            for activity in activities_to_add:
-                # Formatuj treść przez OpenRouter
-                activity.content = self.format_with_openrouter(activity.content)
-                
-                # Aktualizuj position na podstawie sequence_number
-                activity.position = next_pos
-                
-                activity_dict = activity.to_dict()
-                activity_dict.update({
-                    'sequence_number': next_seq,
-                    'created_at': timestamp
-                })
-                
-                next_seq += 1
-                next_pos = next_seq
-                self.collection.insert_one(activity_dict)
-                next_seq += 1
-                
-            print(f"Pomyślnie dodano {len(activities_to_add)} nowych aktywności")
-            return True
+
+            # Formatuj treść nowych i zmienionych aktywności przez OpenRouter
+            changed = inserted + updated
+            skipped = []
+            for index, activity in enumerate(changed):
+                try:
+                    activity.content = self.format_with_openrouter(activity.content)
+                except BudgetExceeded as e:
+                    skipped = changed[index:]
+                    print(f"Pominięto {len(skipped)} aktywności do następnego cyklu: {e}")
+                    break
+
+            self.apply_activity_sync(
+                self.without_skipped(inserted, skipped), self.without_skipped(updated, skipped), removed
+            )
+            # Bez zapisu odcisku kursu kolejny cykl ponowi pominięte aktywności
+            return not skipped
         except Exception as e:
             print(f"Błąd podczas zapisywania do MongoDB: {str(e)}")
             return False
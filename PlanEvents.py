@@ -0,0 +1,179 @@
+"""Zdarzenia o nowych wersjach planów dla strumienia SSE (/api/events).
+
+Po zapisaniu nowej wersji LessonPlan wywołuje publish_plan_event: zdarzenie
+trafia do kolekcji plan_events (z indeksem TTL) i do brokera w pamięci procesu.
+Procesy API uruchomione osobno (gunicorn) dostają zdarzenia przez
+MongoEventWatcher - change stream MongoDB, a gdy baza go nie obsługuje
+(pojedynczy serwer bez replica set), odpytywanie kolekcji co kilka sekund.
+Po każdym otwarciu change streamu watcher dogania zdarzenia zapisane od
+ostatniego odebranego, a po błędzie połączenia otwiera strumień ponownie.
+"""
+import os
+import queue
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+EVENTS_COLLECTION = "plan_events"
+PLAN_EVENTS_TTL = int(os.getenv("PLAN_EVENTS_TTL", "86400"))
+
+# Kolekcje zdarzeń, dla których indeks TTL został już utworzony w tym procesie
+_indexed_collections = set()
+_indexed_collections_lock = threading.Lock()
+
+
+def serialize_event(event_document):
+    return {
+        "id": str(event_document["_id"]),
+        "plan_name": event_document["plan_name"],
+        "version": event_document.get("version"),
+        "checksum": event_document.get("checksum"),
+        "timestamp": event_document.get("timestamp"),
+        "changed_groups": event_document.get("changed_groups", []),
+    }
+
+
+class EventBroker:
+    """Pub/sub w pamięci procesu: każdy subskrybent ma własną kolejkę"""
+
+    def __init__(self, max_queue_size=100):
+        self.max_queue_size = max_queue_size
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self):
+        subscription = queue.Queue(maxsize=self.max_queue_size)
+        with self._lock:
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def publish(self, event):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            try:
+                subscription.put_nowait(event)
+            except queue.Full:
+                # Klient nie odbiera zdarzeń - pomijamy, dogoni przez Last-Event-ID
+                pass
+
+
+plan_event_broker = EventBroker()
+
+
+def publish_plan_event(db, plan_document, changed_groups):
+    """Zapisuje zdarzenie o nowej wersji planu, rozsyła je w bieżącym procesie i zwraca"""
+    collection = db[EVENTS_COLLECTION]
+    with _indexed_collections_lock:
+        if collection.full_name not in _indexed_collections:
+            collection.create_index("created_at", expireAfterSeconds=PLAN_EVENTS_TTL)
+            _indexed_collections.add(collection.full_name)
+    event_document = {
+        "plan_name": plan_document["plan_name"],
+        "version": plan_document.get("version"),
+        "checksum": plan_document["checksum"],
+        "timestamp": plan_document["timestamp"],
+        "changed_groups": changed_groups,
+        "created_at": datetime.utcnow(),
+    }
+    collection.insert_one(event_document)
+    event = serialize_event(event_document)
+    plan_event_broker.publish(event)
+    print(
+        f"Opublikowano zdarzenie zmiany planu {plan_document['plan_name']} "
+        f"({len(changed_groups)} zmienionych grup)"
+    )
+    return event
+
+
+def get_events_after(db, event_id):
+    """Zdarzenia zapisane po zdarzeniu event_id (wznowienie strumienia po Last-Event-ID)"""
+    return [
+        serialize_event(event_document)
+        for event_document in db[EVENTS_COLLECTION]
+        .find({"_id": {"$gt": event_id}})
+        .sort("_id", 1)
+    ]
+
+
+class MongoEventWatcher(threading.Thread):
+    """Przekazuje zdarzenia z kolekcji plan_events do brokera w procesach API"""
+
+    # Kod błędu MongoDB: change stream wymaga replica set
+    CHANGE_STREAM_NOT_SUPPORTED = 40573
+
+    def __init__(self, db, broker, poll_interval=None):
+        super().__init__(daemon=True, name="plan-event-watcher")
+        self.db = db
+        self.broker = broker
+        self.poll_interval = poll_interval or float(os.getenv("PLAN_EVENTS_POLL_INTERVAL", "5"))
+        self.last_id = None
+        # Zdarzenie może przyjść i z odpytania, i ze strumienia otwartego chwilę wcześniej
+        self.recent_ids = deque(maxlen=1000)
+
+    def publish(self, event_document):
+        if event_document["_id"] in self.recent_ids:
+            return
+        self.recent_ids.append(event_document["_id"])
+        if self.last_id is None or event_document["_id"] > self.last_id:
+            self.last_id = event_document["_id"]
+        self.broker.publish(serialize_event(event_document))
+
+    def poll(self, collection):
+        """Publikuje zdarzenia zapisane po last_id"""
+        query = {"_id": {"$gt": self.last_id}} if self.last_id else {}
+        for event_document in collection.find(query).sort("_id", 1):
+            self.publish(event_document)
+
+    def watch(self, collection):
+        """Publikuje zdarzenia ze change streamu do jego zamknięcia lub błędu"""
+        with collection.watch([{"$match": {"operationType": "insert"}}]) as stream:
+            print("Zdarzenia planów: change stream MongoDB")
+            # Zdarzenia zapisane przed otwarciem strumienia lub podczas przerwy w połączeniu
+            self.poll(collection)
+            for change in stream:
+                self.publish(change["fullDocument"])
+
+    def run(self):
+        from pymongo.errors import OperationFailure
+
+        collection = self.db[EVENTS_COLLECTION]
+        use_change_stream = True
+        started = False
+        while True:
+            try:
+                if not started:
+                    # Nowi subskrybenci nie dostają starszych zdarzeń (te są dla Last-Event-ID)
+                    last_event = collection.find_one(sort=[("_id", -1)], projection={"_id": 1})
+                    self.last_id = last_event["_id"] if last_event else None
+                    started = True
+                if use_change_stream:
+                    self.watch(collection)
+                    continue
+                self.poll(collection)
+            except OperationFailure as e:
+                if use_change_stream and e.code == self.CHANGE_STREAM_NOT_SUPPORTED:
+                    # Pojedynczy serwer bez replica set - change stream nigdy nie zadziała
+                    print(f"Change stream niedostępny ({e}), odpytywanie plan_events co {self.poll_interval}s")
+                    use_change_stream = False
+                    continue
+                print(f"Błąd podczas odczytu zdarzeń planów: {e}")
+            except Exception as e:
+                # Np. zmiana primary albo zerwane połączenie - strumień otwieramy ponownie
+                print(f"Błąd podczas odczytu zdarzeń planów: {e}")
+            time.sleep(self.poll_interval)
+            if use_change_stream:
+                # Do ponownego otwarcia strumienia zdarzenia docierają jak przy odpytywaniu
+                try:
+                    self.poll(collection)
+                except Exception as e:
+                    print(f"Błąd podczas odczytu zdarzeń planów: {e}")
@@ -0,0 +1,334 @@
+"""Historia wersji planu w kolekcji plans_*.
+
+Najnowsza wersja jest zawsze zapisana w całości (pole "groups"), więc odczyty
+API i sprawdzanie sumy kontrolnej działają jak dotąd. Przy zapisie nowej wersji
+poprzednia jest zamieniana na deltę względem nowej (storage="delta"): tylko
+zmienione grupy, a w nich tylko zmienione linie HTML. Co PLAN_SNAPSHOT_INTERVAL
+wersji zostaje pełny snapshot, więc odtworzenie dowolnej wersji wymaga
+nałożenia najwyżej tylu delt.
+
+Kolekcja plan_timeline (indeks: kolekcja planu, czas zapisu) przechowuje dla
+każdej wersji jej _id i odciski HTML grup, więc wersję obowiązującą w danej
+chwili znajduje się bez przeglądania kolekcji plans_*.
+
+Migracja wersji zapisanych wcześniej, ich kompaktowanie i uzupełnienie osi
+czasu (prepare) zmieniają dokumenty, więc wykonuje je tylko proces
+sprawdzający: przed pierwszym sprawdzeniem planu i przy zapisie wersji.
+Metody odczytu (także w procesach API) niczego nie zapisują.
+"""
+import hashlib
+import os
+from datetime import datetime
+from difflib import SequenceMatcher
+
+STORAGE_FULL = "full"
+STORAGE_DELTA = "delta"
+TIMELINE_COLLECTION = "plan_timeline"
+
+
+def fingerprint_html(html):
+    return hashlib.md5(html.encode("utf-8"), usedforsecurity=False).hexdigest()
+
+
+def parse_plan_timestamp(timestamp):
+    return datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S")
+
+
+def diff_html(base_html, target_html):
+    """Operacje [i1, i2, linie] zamieniające linie base_html na linie target_html"""
+    base_lines = base_html.split("\n")
+    target_lines = target_html.split("\n")
+    matcher = SequenceMatcher(None, base_lines, target_lines, autojunk=False)
+    return [
+        [i1, i2, target_lines[j1:j2]]
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes()
+        if tag != "equal"
+    ]
+
+
+def patch_html(base_html, operations):
+    base_lines = base_html.split("\n")
+    lines = []
+    position = 0
+    for i1, i2, new_lines in operations:
+        lines.extend(base_lines[position:i1])
+        lines.extend(new_lines)
+        position = i2
+    lines.extend(base_lines[position:])
+    return "\n".join(lines)
+
+
+def build_delta(base_groups, target_groups):
+    """Delta odtwarzająca target_groups z base_groups (grupy jako lista - nazwy mogą zawierać kropki)"""
+    changed = []
+    for group_name, html in target_groups.items():
+        base_html = base_groups.get(group_name)
+        if base_html == html:
+            continue
+        if base_html is not None:
+            operations = diff_html(base_html, html)
+            changed_size = sum(len(line) for _, _, lines in operations for line in lines)
+            # Delta ma sens tylko, gdy jest wyraźnie mniejsza od pełnego HTML
+            if changed_size * 2 < len(html) and patch_html(base_html, operations) == html:
+                changed.append({"group": group_name, "lines": operations})
+                continue
+        changed.append({"group": group_name, "html": html})
+
+    removed = [group_name for group_name in base_groups if group_name not in target_groups]
+    return {"groups": changed, "removed": removed}
+
+
+def apply_delta(base_groups, delta):
+    groups = {
+        group_name: html
+        for group_name, html in base_groups.items()
+        if group_name not in delta["removed"]
+    }
+    for change in delta["groups"]:
+        if "html" in change:
+            groups[change["group"]] = change["html"]
+        else:
+            groups[change["group"]] = patch_html(base_groups[change["group"]], change["lines"])
+    return groups
+
+
+class PlanHistory:
+    def __init__(self, db, collection_name, snapshot_interval=None):
+        self.collection = db[collection_name]
+        self.collection_name = collection_name
+        self.timeline = db[TIMELINE_COLLECTION]
+        self.snapshot_interval = snapshot_interval or int(
+            os.getenv("PLAN_SNAPSHOT_INTERVAL", "10")
+        )
+        self._prepared = False
+
+    def prepare(self):
+        """Indeksy, numeracja i kompaktowanie wersji zapisanych przed wprowadzeniem historii
+        oraz uzupełnienie osi czasu (proces sprawdzający, raz na instancję)"""
+        if self._prepared:
+            return
+        self.collection.create_index([("version", -1)])
+        self.collection.create_index([("timestamp", -1)])
+        self.timeline.create_index([("collection", 1), ("saved_at", -1)])
+        self.migrate_legacy_versions()
+        self.backfill_timeline()
+        self._prepared = True
+
+    def is_snapshot(self, version):
+        return (version - 1) % self.snapshot_interval == 0
+
+    def migrate_legacy_versions(self):
+        legacy_documents = list(
+            self.collection.find(
+                {"version": {"$exists": False}}, projection={"_id": 1}
+            ).sort("timestamp", 1)
+        )
+        if not legacy_documents:
+            return
+
+        last_versioned = self.collection.find_one(
+            {"version": {"$exists": True}}, sort=[("version", -1)]
+        )
+        next_version = last_versioned["version"] + 1 if last_versioned else 1
+        for document in legacy_documents:
+            # Dokument ponumerowany w międzyczasie przez inny proces zostaje bez zmian
+            self.collection.update_one(
+                {"_id": document["_id"], "version": {"$exists": False}},
+                {"$set": {"version": next_version, "storage": STORAGE_FULL}},
+            )
+            next_version += 1
+        print(f"Nadano numery wersji {len(legacy_documents)} planom w {self.collection_name}")
+
+        if not last_versioned:
+            self.compact()
+
+    def compact(self):
+        """Zamienia pełne wersje (poza snapshotami i najnowszą) na delty względem następnej"""
+        newer_document = None
+        compacted = 0
+        for document in self._iter_materialized(self.collection.find().sort("version", -1)):
+            if (
+                newer_document is not None
+                and document.get("storage", STORAGE_FULL) == STORAGE_FULL
+                and not self.is_snapshot(document["version"])
+                and newer_document["version"] == document["version"] + 1
+            ):
+                self.store_as_delta(document, newer_document)
+                compacted += 1
+            newer_document = document
+        if compacted:
+            print(f"Zamieniono {compacted} wersji na delty w {self.collection_name}")
+
+    def store_as_delta(self, document, newer_document):
+        delta_document = {
+            key: value for key, value in document.items() if key != "groups"
+        }
+        delta_document.update(
+            {
+                "storage": STORAGE_DELTA,
+                "base_version": newer_document["version"],
+                "delta": build_delta(newer_document["groups"], document["groups"]),
+            }
+        )
+        self.collection.replace_one({"_id": document["_id"]}, delta_document)
+
+    def save_version(self, plan_document):
+        """Zapisuje nową wersję w całości, a poprzednią (jeśli nie jest snapshotem) zamienia na deltę"""
+        self.prepare()
+        previous_document = self.collection.find_one(sort=[("version", -1)])
+        plan_document["version"] = previous_document["version"] + 1 if previous_document else 1
+        plan_document["storage"] = STORAGE_FULL
+        result = self.collection.insert_one(plan_document)
+        self.add_to_timeline(plan_document)
+
+        if (
+            previous_document
+            and previous_document.get("storage", STORAGE_FULL) == STORAGE_FULL
+            and not self.is_snapshot(previous_document["version"])
+        ):
+            self.store_as_delta(previous_document, plan_document)
+        return result
+
+    def add_to_timeline(self, plan_document):
+        self.timeline.replace_one(
+            {"_id": plan_document["_id"]},
+            {
+                "_id": plan_document["_id"],
+                "collection": self.collection_name,
+                "plan_name": plan_document.get("plan_name"),
+                "version": plan_document["version"],
+                "checksum": plan_document.get("checksum"),
+                "timestamp": plan_document["timestamp"],
+                "saved_at": parse_plan_timestamp(plan_document["timestamp"]),
+                "groups": [
+                    {"group": group_name, "fingerprint": fingerprint_html(html)}
+                    for group_name, html in plan_document["groups"].items()
+                ],
+            },
+            upsert=True,
+        )
+
+    def backfill_timeline(self):
+        """Dodaje do osi czasu wersje zapisane przed jej wprowadzeniem"""
+        if self.timeline.count_documents({"collection": self.collection_name}) >= (
+            self.collection.count_documents({})
+        ):
+            return
+        known_ids = {
+            entry["_id"]
+            for entry in self.timeline.find(
+                {"collection": self.collection_name}, projection={"_id": 1}
+            )
+        }
+        added = 0
+        for document in self._iter_materialized(self.collection.find().sort("version", -1)):
+            if document["_id"] not in known_ids:
+                self.add_to_timeline(document)
+                added += 1
+        print(f"Dodano {added} wersji do osi czasu {self.collection_name}")
+
+    def get_changed_groups(self, version):
+        """Grupy dodane, zmienione lub usunięte w wersji `version` względem poprzedniej"""
+        entries = {
+            entry["version"]: {group["group"]: group["fingerprint"] for group in entry["groups"]}
+            for entry in self.timeline.find(
+                {"collection": self.collection_name, "version": {"$in": [version - 1, version]}}
+            )
+        }
+        current = entries.get(version, {})
+        previous = entries.get(version - 1, {})
+        return [
+            group_name
+            for group_name in list(current) + [name for name in previous if name not in current]
+            if current.get(group_name) != previous.get(group_name)
+        ]
+
+    def find_effective_version(self, at):
+        """Wpis osi czasu wersji obowiązującej w chwili `at` (ostatniej zapisanej nie później)"""
+        return self.timeline.find_one(
+            {"collection": self.collection_name, "saved_at": {"$lte": at}},
+            sort=[("saved_at", -1)],
+        )
+
+    def materialize(self, document):
+        """Pełna treść wersji: delty nakładane od najbliższej nowszej pełnej wersji"""
+        if document is None or document.get("storage", STORAGE_FULL) == STORAGE_FULL:
+            return document
+
+        version = document["version"]
+        full_document = self.collection.find_one(
+            {"version": {"$gt": version}, "storage": {"$ne": STORAGE_DELTA}},
+            sort=[("version", 1)],
+        )
+        if full_document is None:
+            raise ValueError(
+                f"Brak pełnej wersji nowszej niż {version} w {self.collection_name}"
+            )
+        chain = self.collection.find(
+            {"version": {"$gte": version, "$lt": full_document["version"]}},
+            projection={"version": 1, "delta": 1},
+        ).sort("version", -1)
+
+        groups = full_document["groups"]
+        for chain_document in chain:
+            groups = apply_delta(groups, chain_document["delta"])
+        return self._with_groups(document, groups)
+
+    @staticmethod
+    def _with_groups(document, groups):
+        materialized = {
+            key: value
+            for key, value in document.items()
+            if key not in ("delta", "base_version")
+        }
+        materialized["groups"] = groups
+        return materialized
+
+    def get_version(self, version):
+        return self.materialize(self.collection.find_one({"version": version}))
+
+    def get_by_id(self, document_id):
+        return self.materialize(self.collection.find_one({"_id": document_id}))
+
+    def get_latest_versions(self, count):
+        """Najnowsze `count` wersji w pełnej postaci, od najnowszej"""
+        return list(
+            self._iter_materialized(self.collection.find().sort("version", -1).limit(count))
+        )
+
+    def get_version_and_previous(self, checksum):
+        """Wersja o sumie kontrolnej `checksum` i wersja ją poprzedzająca (pełne) albo (None, None)"""
+        document = self.collection.find_one({"checksum": checksum}, projection={"version": 1})
+        if document is None:
+            return None, None
+        previous = self.collection.find_one(
+            {"version": {"$lt": document["version"]}}, projection={"version": 1}, sort=[("version", -1)]
+        )
+        if previous is None:
+            return None, None
+        return self.get_version(document["version"]), self.get_version(previous["version"])
+
+    def _iter_materialized(self, documents):
+        """Materializuje wersje posortowane malejąco, nakładając deltę na poprzednio zwróconą"""
+        newer_document = None
+        for document in documents:
+            if (
+                document.get("storage") == STORAGE_DELTA
+                and newer_document is not None
+                and document.get("base_version") == newer_document["version"]
+            ):
+                document = self._with_groups(
+                    document, apply_delta(newer_document["groups"], document["delta"])
+                )
+            else:
+                document = self.materialize(document)
+            yield document
+            newer_document = document
+
+    def list_versions(self):
+        """Metadane wszystkich wersji (bez treści), od najstarszej"""
+        return list(
+            self.collection.find(
+                projection={"groups": 0, "delta": 0}
+            ).sort("version", 1)
+        )
@@ -0,0 +1,181 @@
+"""Dzierżawy planów w MongoDB dla kilku replik procesu sprawdzającego (PLAN_LEASES=true).
+
+Każda replika co LEASE_HEARTBEAT_SECONDS zapisuje się w kolekcji
+checker_replicas i odnawia swoje dzierżawy w plan_leases. Plany dzielone są
+między żywe repliki haszowaniem rendezvous, więc przy stałym składzie każdy
+plan ma stałego właściciela, a po dodaniu repliki przenosi się tylko część
+planów. Replika sprawdza wyłącznie plany, których dzierżawę trzyma; dzierżawa
+repliki, która przestała działać, wygasa po LEASE_TTL_SECONDS i przejmuje ją
+replika wskazana przez haszowanie.
+"""
+import hashlib
+import os
+import socket
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from metrics import PLAN_LEASES_HELD
+
+LEASES_COLLECTION = "plan_leases"
+REPLICAS_COLLECTION = "checker_replicas"
+LEASE_TTL_SECONDS = int(os.getenv("LEASE_TTL_SECONDS", "120"))
+LEASE_HEARTBEAT_SECONDS = float(os.getenv("LEASE_HEARTBEAT_SECONDS", "30"))
+
+
+def rendezvous_owner(resource_id, replica_ids):
+    """Replika o najwyższej wadze dla zasobu (haszowanie rendezvous)"""
+    return max(
+        replica_ids,
+        key=lambda replica_id: hashlib.sha1(f"{resource_id}:{replica_id}".encode()).hexdigest(),
+    )
+
+
+class PlanLeases:
+    """Dzierżawy zasobów (id planów, "moodle") bieżącej repliki"""
+
+    def __init__(self, db, resource_ids, replica_id=None):
+        from pymongo.errors import DuplicateKeyError
+
+        self.DuplicateKeyError = DuplicateKeyError
+        self.leases = db[LEASES_COLLECTION]
+        self.replicas = db[REPLICAS_COLLECTION]
+        self.replicas.create_index("expires_at", expireAfterSeconds=0)
+        self.resource_ids = list(resource_ids)
+        self.replica_id = replica_id or os.getenv("REPLICA_ID") or f"{socket.gethostname()}:{os.getpid()}"
+        self.owned = set()
+        # Termin wygaśnięcia każdej trzymanej dzierżawy zapisany przy ostatnim odnowieniu
+        self.expires_at = {}
+        # Zasoby sprawdzane w tej chwili - nie oddajemy ich w trakcie sprawdzania
+        self.busy = set()
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def set_resources(self, resource_ids):
+        """Zmienia zbiór dzielonych zasobów (np. po przeładowaniu plans.json)"""
+        self.resource_ids = list(resource_ids)
+        self.heartbeat()
+
+    def live_replicas(self, now):
+        replica_ids = [
+            replica["_id"]
+            for replica in self.replicas.find({"expires_at": {"$gt": now}}, projection={"_id": 1})
+        ]
+        return replica_ids or [self.replica_id]
+
+    def acquire(self, resource_id, now):
+        """Przejmuje wolną lub wygasłą dzierżawę (albo odnawia własną); zwraca True, gdy się udało"""
+        try:
+            self.leases.update_one(
+                {
+                    "_id": resource_id,
+                    "$or": [{"owner": self.replica_id}, {"expires_at": {"$lt": now}}],
+                },
+                {
+                    "$set": {
+                        "owner": self.replica_id,
+                        "expires_at": now + timedelta(seconds=LEASE_TTL_SECONDS),
+                        "heartbeat_at": now,
+                    }
+                },
+                upsert=True,
+            )
+            return True
+        except self.DuplicateKeyError:
+            # Dzierżawa istnieje i należy do innej, żywej repliki
+            return False
+
+    def release(self, resource_id):
+        self.leases.delete_one({"_id": resource_id, "owner": self.replica_id})
+
+    def heartbeat(self):
+        """Rejestruje replikę, przejmuje przypisane jej zasoby i oddaje pozostałe"""
+        now = datetime.utcnow()
+        self.replicas.update_one(
+            {"_id": self.replica_id},
+            {"$set": {"expires_at": now + timedelta(seconds=LEASE_TTL_SECONDS), "heartbeat_at": now}},
+            upsert=True,
+        )
+        replica_ids = self.live_replicas(now)
+
+        with self.lock:
+            busy = set(self.busy)
+        owned = set()
+        expires_at = {}
+        for resource_id in self.resource_ids:
+            assigned = rendezvous_owner(resource_id, replica_ids) == self.replica_id
+            if assigned or (resource_id in busy and resource_id in self.owned):
+                if self.acquire(resource_id, now):
+                    owned.add(resource_id)
+                    expires_at[resource_id] = now + timedelta(seconds=LEASE_TTL_SECONDS)
+            elif resource_id in self.owned:
+                self.release(resource_id)
+
+        with self.lock:
+            gained, lost = owned - self.owned, self.owned - owned
+            self.owned = owned
+            self.expires_at = expires_at
+        if gained or lost:
+            print(
+                f"Dzierżawy repliki {self.replica_id} ({len(replica_ids)} replik): "
+                f"{', '.join(sorted(owned)) or 'brak'}"
+            )
+        PLAN_LEASES_HELD.set(len(owned))
+        return owned
+
+    def drop_expired(self):
+        """Usuwa z owned dzierżawy, których nie udało się odnowić przed wygaśnięciem"""
+        now = datetime.utcnow()
+        with self.lock:
+            expired = {resource_id for resource_id in self.owned if self.expires_at.get(resource_id, now) <= now}
+            if not expired:
+                return
+            self.owned -= expired
+            for resource_id in expired:
+                self.expires_at.pop(resource_id, None)
+            held_count = len(self.owned)
+        # Inna replika mogła już przejąć te zasoby - nie sprawdzamy ich do następnego odnowienia
+        print(f"Dzierżawy repliki {self.replica_id} wygasły bez odnowienia: {', '.join(sorted(expired))}")
+        PLAN_LEASES_HELD.set(held_count)
+
+    @contextmanager
+    def hold(self, resource_ids):
+        """Zwraca zasoby z resource_ids trzymane przez replikę i nie oddaje ich do końca bloku"""
+        self.drop_expired()
+        with self.lock:
+            held = [resource_id for resource_id in resource_ids if resource_id in self.owned]
+            self.busy.update(held)
+        try:
+            yield held
+        finally:
+            with self.lock:
+                self.busy.difference_update(held)
+
+    def _run(self):
+        while not self.stop_event.wait(LEASE_HEARTBEAT_SECONDS):
+            try:
+                self.heartbeat()
+            except Exception as e:
+                # Bez odnowienia dzierżawy wygasną i przejmie je inna replika
+                print(f"Błąd podczas odnawiania dzierżaw: {str(e)}")
+                self.drop_expired()
+
+    def start(self):
+        self.heartbeat()
+        self.thread = threading.Thread(target=self._run, daemon=True, name="plan-leases")
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """Zatrzymuje odnawianie i zwalnia dzierżawy, żeby inne repliki przejęły je od razu"""
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+        with self.lock:
+            owned, self.owned = self.owned, set()
+            self.expires_at = {}
+        for resource_id in owned:
+            self.release(resource_id)
+        self.replicas.delete_one({"_id": self.replica_id})
+        PLAN_LEASES_HELD.set(0)
@@ -0,0 +1,180 @@
+"""Przetwarzanie planu w osobnym procesie roboczym (PLAN_ISOLATION=process).
+
+Plik planu jest pobierany w procesie sprawdzającym (przez DownloadCache),
+a wczytanie skoroszytu, czyszczenie, wyodrębnienie grup i zapis do MongoDB
+wykonuje proces roboczy danego planu z limitem pamięci (RLIMIT_AS,
+PLAN_WORKER_MEMORY_MB) i czasu (PLAN_WORKER_TIMEOUT). Proces jest
+uruchamiany ponownie co PLAN_WORKER_MAX_TASKS przebiegów, a po przekroczeniu
+limitu lub po śmierci procesu (np. zabicie przez OOM killer) - od razu, więc uszkodzony lub ogromny skoroszyt blokuje tylko swój plan.
+"""
+import multiprocessing
+import os
+import sys
+import time
+
+from PlanEvents import plan_event_broker
+from metrics import PLAN_WORKER_FAILURES, track_stage
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+PLAN_WORKER_MEMORY_MB = int(os.getenv("PLAN_WORKER_MEMORY_MB", "2048"))
+PLAN_WORKER_TIMEOUT = float(os.getenv("PLAN_WORKER_TIMEOUT", "300"))
+PLAN_WORKER_MAX_TASKS = int(os.getenv("PLAN_WORKER_MAX_TASKS", "10"))
+
+# Co ile sekund sprawdzamy, czy proces roboczy żyje, czekając na wynik
+WORKER_POLL_SECONDS = 1.0
+
+# Obiekty LessonPlan procesu roboczego - pamięć układu kolumn grup przetrwa między przebiegami
+_worker_lesson_plans = {}
+
+
+def max_rss_kib():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource else 0
+    # macOS zwraca bajty, Linux kilobajty
+    return rss // 1024 if sys.platform == "darwin" else rss
+
+
+def limit_worker_memory(memory_limit_mb):
+    """Inicjalizator procesu roboczego: limit przestrzeni adresowej (0 - bez limitu)"""
+    if memory_limit_mb and resource is not None:
+        limit = memory_limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def run_plan_job(job):
+    """Przetwarza pobrany plik planu w procesie roboczym i zwraca wynik jako słownik"""
+    from DownloadCache import DownloadCache
+    from LessonPlan import LessonPlan
+
+    plan_config = job["plan_config"]
+    lesson_plan = _worker_lesson_plans.get(plan_config["name"])
+    if lesson_plan is None or lesson_plan.plan_config != plan_config:
+        lesson_plan = LessonPlan(
+            username=job["username"],
+            password=job["password"],
+            mongo_uri=job["mongo_uri"],
+            plan_config=plan_config,
+            directory=job["directory"],
+        )
+        _worker_lesson_plans[plan_config["name"]] = lesson_plan
+
+    # Plik pobrał proces nadrzędny - LessonPlan dostaje go z pamięci podręcznej
+    download_cache = DownloadCache(job["username"], job["password"])
+    download_cache.put(lesson_plan.download_url, job["content"])
+    start = time.perf_counter()
+    try:
+        checksum = lesson_plan.process_and_save_plan(download_cache)
+    finally:
+        download_cache.close()
+    return {
+        "checksum": checksum,
+        "event": lesson_plan.published_event,
+        "elapsed": time.perf_counter() - start,
+        "max_rss_kib": max_rss_kib(),
+    }
+
+
+class PlanWorker:
+    """Proces roboczy jednego planu, tworzony przy pierwszym użyciu"""
+
+    def __init__(self, plan_name, memory_limit_mb=None, timeout=None, max_tasks=None):
+        self.plan_name = plan_name
+        self.memory_limit_mb = PLAN_WORKER_MEMORY_MB if memory_limit_mb is None else memory_limit_mb
+        self.timeout = timeout or PLAN_WORKER_TIMEOUT
+        self.max_tasks = max_tasks or PLAN_WORKER_MAX_TASKS
+        self.pool = None
+        self.processes = []
+        self.tasks = 0
+
+    def _get_pool(self):
+        if self.pool is None:
+            # spawn: proces sprawdzający ma już wątki (Flask, MongoDB), fork nie jest bezpieczny
+            context = multiprocessing.get_context("spawn")
+            # Bez maxtasksperchild - proces wymieniamy sami co max_tasks przebiegów,
+            # więc każde zakończenie procesu puli oznacza jego śmierć
+            self.pool = context.Pool(
+                1,
+                initializer=limit_worker_memory,
+                initargs=(self.memory_limit_mb,),
+            )
+            self.processes = list(self.pool._pool)
+            self.tasks = 0
+        return self.pool
+
+    def _dead_process(self):
+        """Proces puli, który zakończył się w trakcie przebiegu, albo None"""
+        for process in self.processes:
+            if process.exitcode is not None:
+                return process
+        return None
+
+    def terminate(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+            self.processes = []
+
+    def _fail(self, reason, message):
+        print(f"{message} - proces roboczy planu {self.plan_name} zostanie uruchomiony ponownie")
+        PLAN_WORKER_FAILURES.labels(plan=self.plan_name, reason=reason).inc()
+        self.terminate()
+        return None
+
+    def run(self, lesson_plan, mongo_uri, download_cache=None):
+        """Jak LessonPlan.process_and_save_plan: suma kontrolna nowej wersji, False bez zmian, None przy błędzie"""
+        with track_stage(self.plan_name, "download"):
+            content = lesson_plan.fetch_content(download_cache)
+        if content is None:
+            print("Failed to download file.")
+            return None
+
+        job = {
+            "plan_config": lesson_plan.plan_config,
+            "username": lesson_plan.username,
+            "password": lesson_plan.password,
+            "mongo_uri": mongo_uri,
+            "directory": lesson_plan.directory,
+            "content": content,
+        }
+        async_result = self._get_pool().apply_async(run_plan_job, (job,))
+        # Pula po cichu zastępuje zabity proces, a jego zadanie nigdy się nie kończy -
+        # zamiast czekać cały timeout sprawdzamy, czy proces roboczy żyje
+        deadline = time.monotonic() + self.timeout
+        while not async_result.ready():
+            dead_process = self._dead_process()
+            if dead_process is not None:
+                return self._fail(
+                    "killed",
+                    f"Proces roboczy planu {self.plan_name} zakończył się z kodem {dead_process.exitcode}",
+                )
+            if time.monotonic() >= deadline:
+                return self._fail(
+                    "timeout", f"Przetwarzanie planu {self.plan_name} przekroczyło {self.timeout:g} s"
+                )
+            async_result.wait(min(WORKER_POLL_SECONDS, max(deadline - time.monotonic(), 0)))
+
+        try:
+            result = async_result.get()
+        except MemoryError:
+            return self._fail(
+                "memory",
+                f"Przetwarzanie planu {self.plan_name} przekroczyło limit {self.memory_limit_mb} MB",
+            )
+        except Exception as e:
+            return self._fail("error", f"Błąd procesu roboczego planu {self.plan_name}: {e}")
+
+        print(
+            f"Proces roboczy planu {self.plan_name}: {result['elapsed']:.1f} s, "
+            f"maks. RSS {result['max_rss_kib'] / 1024:.0f} MB"
+        )
+        self.tasks += 1
+        if self.tasks >= self.max_tasks:
+            self.terminate()
+        # Proces API w trybie embedded nie widzi brokera procesu roboczego
+        if result["event"]:
+            plan_event_broker.publish(result["event"])
+        return result["checksum"]
@@ -0,0 +1,115 @@
+"""Konfiguracja planów z plans.json w pamięci procesu, przeładowywana po zmianie pliku.
+
+PlansConfig zachowuje się jak słownik {plan_id: plan_config} (tylko do odczytu).
+reload_if_changed() sprawdza mtime pliku najwyżej raz na PLANS_RELOAD_INTERVAL
+sekund; nowa zawartość jest walidowana i podmieniana w całości, a słuchacze
+dostają zbiory dodanych, usuniętych i zmienionych planów. Błędny plik zostawia
+poprzednią konfigurację.
+"""
+import json
+import os
+import threading
+import time
+from collections.abc import Mapping
+
+PLANS_FILE = os.getenv("PLANS_FILE", "plans.json")
+PLANS_RELOAD_INTERVAL = float(os.getenv("PLANS_RELOAD_INTERVAL", "5"))
+
+REQUIRED_PLAN_FIELDS = ("name", "download_url", "sheet_name")
+
+
+def validate_plans(plans):
+    """Sprawdza strukturę plans.json; zgłasza ValueError z opisem pierwszego błędu"""
+    if not isinstance(plans, dict):
+        raise ValueError("plans.json must contain an object of plans")
+    names = {}
+    for plan_id, plan_config in plans.items():
+        if not isinstance(plan_config, dict):
+            raise ValueError(f"Plan {plan_id}: expected an object")
+        for field in REQUIRED_PLAN_FIELDS:
+            if not isinstance(plan_config.get(field), str) or not plan_config[field]:
+                raise ValueError(f"Plan {plan_id}: missing or empty '{field}'")
+        groups = plan_config.get("groups")
+        if groups is not None and not isinstance(groups, dict):
+            raise ValueError(f"Plan {plan_id}: 'groups' must be an object")
+        for flag in ("compare", "notify"):
+            if not isinstance(plan_config.get(flag, False), bool):
+                raise ValueError(f"Plan {plan_id}: '{flag}' must be true or false")
+        if plan_config["name"] in names:
+            raise ValueError(
+                f"Plans {names[plan_config['name']]} and {plan_id} have the same name"
+            )
+        names[plan_config["name"]] = plan_id
+    return plans
+
+
+class PlansConfig(Mapping):
+    def __init__(self, path=None, reload_interval=None):
+        self.path = path or PLANS_FILE
+        self.reload_interval = PLANS_RELOAD_INTERVAL if reload_interval is None else reload_interval
+        self.listeners = []
+        self._lock = threading.Lock()
+        self._next_check = 0.0
+        self._mtime, self._plans = self._load()
+        self.plan_ids_by_name = self._index_names(self._plans)
+
+    def _load(self):
+        mtime = os.stat(self.path).st_mtime_ns
+        with open(self.path, "r", encoding="utf-8") as f:
+            return mtime, validate_plans(json.load(f))
+
+    @staticmethod
+    def _index_names(plans):
+        return {plan_config["name"]: plan_id for plan_id, plan_config in plans.items()}
+
+    def __getitem__(self, plan_id):
+        return self._plans[plan_id]
+
+    def __iter__(self):
+        return iter(self._plans)
+
+    def __len__(self):
+        return len(self._plans)
+
+    def on_change(self, listener):
+        """Rejestruje listener(added, removed, changed) wywoływany po przeładowaniu"""
+        self.listeners.append(listener)
+
+    def reload_if_changed(self, force=False):
+        """Przeładowuje plik, jeśli zmienił się od ostatniego odczytu; zwraca True po zmianie planów"""
+        now = time.monotonic()
+        if not force and now < self._next_check:
+            return False
+        with self._lock:
+            if not force and now < self._next_check:
+                return False
+            self._next_check = now + self.reload_interval
+            try:
+                if os.stat(self.path).st_mtime_ns == self._mtime:
+                    return False
+                mtime, plans = self._load()
+            except (OSError, ValueError) as e:
+                # json.JSONDecodeError też jest ValueError
+                print(f"Nie przeładowano {self.path} - zostaje poprzednia konfiguracja: {e}")
+                return False
+
+            previous = self._plans
+            added = set(plans) - set(previous)
+            removed = set(previous) - set(plans)
+            changed = {plan_id for plan_id in set(plans) & set(previous) if plans[plan_id] != previous[plan_id]}
+            self._mtime = mtime
+            self._plans = plans
+            self.plan_ids_by_name = self._index_names(plans)
+
+        if not (added or removed or changed):
+            return False
+        print(
+            f"Przeładowano {self.path}: dodane {sorted(added)}, usunięte {sorted(removed)}, "
+            f"zmienione {sorted(changed)}"
+        )
+        for listener in self.listeners:
+            try:
+                listener(added, removed, changed)
+            except Exception as e:
+                print(f"Błąd podczas obsługi zmiany konfiguracji planów: {str(e)}")
+        return True
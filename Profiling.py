@@ -0,0 +1,216 @@
+"""Profilowanie cykli sprawdzania i zapytań API na żądanie.
+
+Kolejne PROFILE_CHECKS wywołań LessonPlanManager.check_once (i PROFILE_REQUESTS
+zapytań API w danym procesie) są próbkowane co PROFILE_INTERVAL_MS przez wątek
+odczytujący sys._current_frames(). Do PROFILE_DIR trafiają:
+- <czas>_<pid>_<etykieta>.folded - stosy w formacie "collapsed" (flamegraph.pl, speedscope),
+- <czas>_<pid>_<etykieta>.txt - czasy etapów track_stage i funkcje z największą liczbą próbek.
+
+Profilowanie można też zlecić przez POST /api/profile - liczba cykli trafia do
+kolekcji profiling_requests, odczytywanej przez proces sprawdzający raz na cykl.
+Gdy nic nie jest zlecone, koszt to jedno porównanie liczby na wywołanie.
+"""
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILING_COLLECTION = "profiling_requests"
+
+# Sesje w toku - metrics.track_stage dopisuje do nich czasy etapów (przez record_stage)
+active_sessions = []
+active_sessions_lock = threading.Lock()
+
+
+def format_frame(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class ProfileSession:
+    """Próbkowanie stosów wybranych wątków do czasu stop()"""
+
+    def __init__(self, label, thread_ids=None, thread_prefix=None, interval_ms=None):
+        self.label = re.sub(r"[^A-Za-z0-9_.-]+", "_", label).strip("_")
+        self.thread_ids = set(thread_ids or ())
+        self.thread_prefix = thread_prefix
+        self.interval = (interval_ms or PROFILE_INTERVAL_MS) / 1000
+        self.samples = Counter()
+        self.sample_count = 0
+        self.stages = defaultdict(list)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="profiler")
+        self.started_at = None
+        self.elapsed = 0.0
+
+    def _wanted_threads(self):
+        if not self.thread_prefix:
+            return self.thread_ids
+        return self.thread_ids | {
+            thread.ident
+            for thread in threading.enumerate()
+            if thread.name.startswith(self.thread_prefix)
+        }
+
+    def wants_thread(self, thread):
+        """Czy sesja profiluje wątek (bez wskazanych wątków - wszystkie)"""
+        if not self.thread_ids and not self.thread_prefix:
+            return True
+        return thread.ident in self.thread_ids or bool(
+            self.thread_prefix and thread.name.startswith(self.thread_prefix)
+        )
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            wanted = self._wanted_threads()
+            thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id or (wanted and thread_id not in wanted):
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(format_frame(frame))
+                    frame = frame.f_back
+                stack.append(thread_names.get(thread_id, str(thread_id)))
+                self.samples[";".join(reversed(stack))] += 1
+            self.sample_count += 1
+
+    def record_stage(self, plan, stage, duration):
+        self.stages[(plan, stage)].append(duration)
+
+    def start(self):
+        self.started_at = datetime.now()
+        self._start_time = time.perf_counter()
+        with active_sessions_lock:
+            active_sessions.append(self)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.elapsed = time.perf_counter() - self._start_time
+        with active_sessions_lock:
+            active_sessions.remove(self)
+        try:
+            return self.write()
+        except OSError as e:
+            print(f"Nie udało się zapisać profilu {self.label}: {e}")
+            return None
+
+    def format_report(self):
+        lines = [
+            f"{self.label}: {self.elapsed * 1000:.1f} ms, {self.sample_count} próbek "
+            f"co {self.interval * 1000:g} ms",
+            "",
+            f"{'plan':<48} {'stage':<20} {'count':>6} {'total [ms]':>11} {'mean [ms]':>10}",
+        ]
+        for (plan, stage), durations in sorted(
+            self.stages.items(), key=lambda item: sum(item[1]), reverse=True
+        ):
+            lines.append(
+                f"{plan:<48} {stage:<20} {len(durations):>6} "
+                f"{sum(durations) * 1000:>11.1f} {sum(durations) * 1000 / len(durations):>10.1f}"
+            )
+
+        own_samples = Counter()
+        for stack, count in self.samples.items():
+            own_samples[stack.rsplit(";", 1)[-1]] += count
+        total = sum(own_samples.values()) or 1
+        lines += ["", f"{'function':<80} {'samples':>8} {'%':>6}"]
+        for function, count in own_samples.most_common(20):
+            lines.append(f"{function:<80} {count:>8} {count * 100 / total:>6.1f}")
+        return "\n".join(lines) + "\n"
+
+    def write(self):
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        base_path = os.path.join(
+            PROFILE_DIR,
+            f"{self.started_at.strftime('%Y%m%d_%H%M%S_%f')}_{os.getpid()}_{self.label}",
+        )
+        with open(f"{base_path}.folded", "w", encoding="utf-8") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+        with open(f"{base_path}.txt", "w", encoding="utf-8") as f:
+            f.write(self.format_report())
+        print(f"Zapisano profil {self.label}: {base_path}.folded, {base_path}.txt")
+        return base_path
+
+
+def record_stage(plan, stage, duration):
+    """Dopisuje czas etapu do sesji profilujących bieżący wątek"""
+    # Bez sesji - tylko odczyt listy, bez blokady
+    if not active_sessions:
+        return
+    with active_sessions_lock:
+        sessions = list(active_sessions)
+    thread = threading.current_thread()
+    for session in sessions:
+        if session.wants_thread(thread):
+            session.record_stage(plan, stage, duration)
+
+
+class ProfilingControl:
+    """Liczniki zleconych profili w bieżącym procesie"""
+
+    def __init__(self):
+        self.remaining_checks = int(os.getenv("PROFILE_CHECKS", "0"))
+        self.remaining_requests = int(os.getenv("PROFILE_REQUESTS", "0"))
+        self._lock = threading.Lock()
+
+    def request(self, checks=0, requests=0):
+        with self._lock:
+            self.remaining_checks += checks
+            self.remaining_requests += requests
+
+    def _claim(self, attribute):
+        # Bez zleceń - tylko odczyt liczby, bez blokady
+        if getattr(self, attribute) <= 0:
+            return False
+        with self._lock:
+            if getattr(self, attribute) <= 0:
+                return False
+            setattr(self, attribute, getattr(self, attribute) - 1)
+            return True
+
+    def claim_check(self):
+        return self._claim("remaining_checks")
+
+    def claim_request(self):
+        return self._claim("remaining_requests")
+
+    def load_requests(self, db):
+        """Przejmuje zlecenia profilowania cykli zapisane przez POST /api/profile"""
+        try:
+            control = db[PROFILING_COLLECTION].find_one_and_delete({"_id": "checker"})
+        except Exception as e:
+            print(f"Błąd podczas odczytu zleceń profilowania: {str(e)}")
+            return
+        if control and control.get("checks"):
+            self.request(checks=control["checks"])
+            print(f"Zlecono profilowanie {control['checks']} kolejnych sprawdzeń planów")
+
+
+profiling = ProfilingControl()
+
+
+@contextmanager
+def profile_check(label, thread_prefix=None):
+    """Profiluje blok, jeśli zlecono profilowanie kolejnych sprawdzeń planów"""
+    if not profiling.claim_check():
+        yield
+        return
+    session = ProfileSession(
+        label, thread_ids=[threading.get_ident()], thread_prefix=thread_prefix
+    ).start()
+    try:
+        yield
+    finally:
+        session.stop()
@@ -0,0 +1,178 @@
+"""Wspólny limit zapytań do OpenRouter dla porównań planów i formatowania Moodle.
+
+Dwa kubełki żetonów: zapytania na minutę (OPENROUTER_REQUESTS_PER_MINUTE)
+i tokeny na minutę (OPENROUTER_TOKENS_PER_MINUTE, 0 - bez limitu). Przed
+zapytaniem rezerwowana jest szacunkowa liczba tokenów (długość promptu / 4
++ OPENROUTER_COMPLETION_TOKENS), a po odpowiedzi różnica względem usage
+z odpowiedzi jest rozliczana. OPENROUTER_CYCLE_BUDGET_TOKENS ogranicza
+tokeny na jeden cykl sprawdzania (0 - bez limitu); po jego wyczerpaniu
+acquire zgłasza BudgetExceeded. Oczekujące porównania (PRIORITY_COMPARE)
+mają pierwszeństwo przed formatowaniem (PRIORITY_FORMAT). Odpowiedź 429
+wstrzymuje wszystkie zapytania na czas z Retry-After.
+
+Limit obejmuje jeden proces sprawdzający (wszystkie jego wątki i pętlę
+zdarzeń trybu async).
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import Counter
+
+from metrics import OPENROUTER_BUDGET_EXCEEDED, OPENROUTER_WAIT
+
+OPENROUTER_REQUESTS_PER_MINUTE = float(os.getenv("OPENROUTER_REQUESTS_PER_MINUTE", "20"))
+OPENROUTER_TOKENS_PER_MINUTE = float(os.getenv("OPENROUTER_TOKENS_PER_MINUTE", "0"))
+OPENROUTER_CYCLE_BUDGET_TOKENS = int(os.getenv("OPENROUTER_CYCLE_BUDGET_TOKENS", "0"))
+OPENROUTER_COMPLETION_TOKENS = int(os.getenv("OPENROUTER_COMPLETION_TOKENS", "500"))
+
+PRIORITY_COMPARE = 0
+PRIORITY_FORMAT = 1
+PRIORITY_NAMES = {PRIORITY_COMPARE: "compare", PRIORITY_FORMAT: "format"}
+
+# Najdłuższa przerwa między kolejnymi próbami, żeby zauważyć zwolnione miejsce
+MAX_POLL_SECONDS = 0.5
+
+
+class BudgetExceeded(Exception):
+    pass
+
+
+def estimate_tokens(data):
+    """Szacunkowa liczba tokenów zapytania (prompt i odpowiedź)"""
+    prompt_chars = sum(len(message.get("content", "")) for message in data.get("messages", []))
+    return prompt_chars // 4 + OPENROUTER_COMPLETION_TOKENS
+
+
+def usage_tokens(result):
+    """total_tokens z odpowiedzi OpenRouter albo None"""
+    try:
+        return int(result["usage"]["total_tokens"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.available = per_minute
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        # Zapytanie większe niż cały kubełek czeka tylko na pełny kubełek
+        missing = min(amount, self.capacity) - self.available
+        return max(missing / self.rate, 0.0)
+
+
+class RateLimiter:
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None, cycle_budget=None):
+        requests_per_minute = requests_per_minute or OPENROUTER_REQUESTS_PER_MINUTE
+        tokens_per_minute = OPENROUTER_TOKENS_PER_MINUTE if tokens_per_minute is None else tokens_per_minute
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.cycle_budget = OPENROUTER_CYCLE_BUDGET_TOKENS if cycle_budget is None else cycle_budget
+        self.cycle_spent = 0
+        self.blocked_until = 0.0
+        self.waiting = Counter()
+        self.lock = threading.Lock()
+
+    def start_cycle(self):
+        """Zeruje budżet tokenów na początku cyklu sprawdzania"""
+        with self.lock:
+            if self.cycle_spent:
+                print(f"OpenRouter: {self.cycle_spent} tokenów w poprzednim cyklu")
+            self.cycle_spent = 0
+
+    def _try_acquire(self, tokens, priority):
+        """0 po przyznaniu miejsca, w przeciwnym razie czas do następnej próby"""
+        with self.lock:
+            if self.cycle_budget and self.cycle_spent + tokens > self.cycle_budget:
+                raise BudgetExceeded(
+                    f"OpenRouter budget of {self.cycle_budget} tokens per cycle exhausted"
+                )
+            now = time.monotonic()
+            if now < self.blocked_until:
+                return self.blocked_until - now
+            if any(count for waiting_priority, count in self.waiting.items() if waiting_priority < priority):
+                return MAX_POLL_SECONDS
+
+            self.requests.refill(now)
+            wait = self.requests.wait_time(1)
+            if self.tokens is not None:
+                self.tokens.refill(now)
+                wait = max(wait, self.tokens.wait_time(tokens))
+            if wait > 0:
+                return wait
+
+            self.requests.available -= 1
+            if self.tokens is not None:
+                self.tokens.available -= tokens
+            self.cycle_spent += tokens
+            return 0
+
+    def _enter(self, priority):
+        with self.lock:
+            self.waiting[priority] += 1
+        return time.perf_counter()
+
+    def _leave(self, priority, start, exceeded):
+        with self.lock:
+            self.waiting[priority] -= 1
+        label = PRIORITY_NAMES.get(priority, str(priority))
+        if exceeded:
+            OPENROUTER_BUDGET_EXCEEDED.labels(priority=label).inc()
+        else:
+            OPENROUTER_WAIT.labels(priority=label).observe(time.perf_counter() - start)
+
+    def acquire(self, tokens, priority=PRIORITY_FORMAT):
+        """Czeka na miejsce na zapytanie o szacunkowej liczbie tokenów (BudgetExceeded po wyczerpaniu budżetu)"""
+        start = self._enter(priority)
+        exceeded = False
+        try:
+            while (wait := self._try_acquire(tokens, priority)) > 0:
+                time.sleep(min(wait, MAX_POLL_SECONDS))
+        except BudgetExceeded:
+            exceeded = True
+            raise
+        finally:
+            self._leave(priority, start, exceeded)
+
+    async def acquire_async(self, tokens, priority=PRIORITY_FORMAT):
+        """Jak acquire, bez blokowania pętli zdarzeń"""
+        start = self._enter(priority)
+        exceeded = False
+        try:
+            while (wait := self._try_acquire(tokens, priority)) > 0:
+                await asyncio.sleep(min(wait, MAX_POLL_SECONDS))
+        except BudgetExceeded:
+            exceeded = True
+            raise
+        finally:
+            self._leave(priority, start, exceeded)
+
+    def record_usage(self, estimated, actual):
+        """Rozlicza różnicę między szacunkiem a usage z odpowiedzi"""
+        if actual is None:
+            return
+        with self.lock:
+            self.cycle_spent += actual - estimated
+            if self.tokens is not None:
+                self.tokens.available -= actual - estimated
+
+    def record_rate_limited(self, retry_after=None):
+        """Odpowiedź 429 - wstrzymuje wszystkie zapytania na Retry-After (domyślnie minutę)"""
+        try:
+            delay = float(retry_after) if retry_after else 60.0
+        except ValueError:
+            delay = 60.0
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + delay)
+        print(f"OpenRouter zwrócił 429 - wstrzymanie zapytań na {delay:g} s")
+
+
+openrouter_limiter = RateLimiter()
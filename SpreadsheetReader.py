@@ -0,0 +1,106 @@
+"""Wymienne silniki odczytu arkuszy dla LessonPlan.
+
+Każdy silnik zwraca te same DataFrame'y co pd.read_excel z silnikiem openpyxl
+(te same nazwy kolumn, typy i wartości puste), więc można go wybrać per plan
+w plans.json ("reader") lub globalnie przez SPREADSHEET_READER.
+Zgodność sprawdza benchmarks/reader_conformance.py.
+"""
+import os
+from abc import ABC, abstractmethod
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+from pandas.io.parsers import TextParser
+
+from XlsxStreamReader import XlsxStreamReader
+
+
+class SpreadsheetReader(ABC):
+    name: Optional[str] = None
+
+    @abstractmethod
+    def sheet_names(self, file_path):
+        """Nazwy arkuszy skoroszytu"""
+
+    @abstractmethod
+    def read_sheet(self, file_path, sheet_name, header=0):
+        """Arkusz jako DataFrame, jak pd.read_excel z silnikiem openpyxl"""
+
+
+class PandasExcelReader(SpreadsheetReader):
+    """Odczyt przez pd.read_excel z wybranym silnikiem pandas"""
+
+    def sheet_names(self, file_path):
+        with pd.ExcelFile(file_path, engine=self.name) as xls:
+            return xls.sheet_names
+
+    def read_sheet(self, file_path, sheet_name, header=0):
+        return pd.read_excel(file_path, sheet_name=sheet_name, header=header, engine=self.name)
+
+
+class OpenpyxlReader(PandasExcelReader):
+    name = "openpyxl"
+
+
+class CalamineReader(PandasExcelReader):
+    """Silnik calamine (Rust, pakiet python-calamine)"""
+
+    name = "calamine"
+
+
+class StreamReader(SpreadsheetReader):
+    """Odczyt przez XlsxStreamReader, wynik przetworzony tak jak w pd.read_excel"""
+
+    name = "stream"
+
+    def sheet_names(self, file_path):
+        return XlsxStreamReader(file_path).sheet_names()
+
+    def read_sheet(self, file_path, sheet_name, header=0):
+        grid = XlsxStreamReader(file_path, error_value=np.nan).read_sheet(
+            sheet_name, fill_merged=False
+        )
+        data = self._to_excel_rows(grid)
+        return TextParser(data, header=header, skip_blank_lines=False).read()
+
+    @staticmethod
+    def _to_excel_rows(grid):
+        # Te same konwersje co pandas dla openpyxl: puste komórki jako "",
+        # całkowite liczby zmiennoprzecinkowe jako int, obcięte puste końcówki
+        data = []
+        last_row_with_data = -1
+        for row_number, row in enumerate(grid):
+            converted_row = []
+            for value in row:
+                if value is None:
+                    value = ""
+                elif isinstance(value, float) and not np.isnan(value) and value.is_integer():
+                    value = int(value)
+                converted_row.append(value)
+            while converted_row and converted_row[-1] == "":
+                converted_row.pop()
+            if converted_row:
+                last_row_with_data = row_number
+            data.append(converted_row)
+
+        data = data[: last_row_with_data + 1]
+        if data:
+            max_width = max(len(data_row) for data_row in data)
+            data = [data_row + [""] * (max_width - len(data_row)) for data_row in data]
+        return data
+
+
+READERS = {
+    reader.name: reader for reader in (OpenpyxlReader(), CalamineReader(), StreamReader())
+}
+
+
+def get_reader(name=None):
+    """Zwraca silnik odczytu o podanej nazwie (domyślnie z SPREADSHEET_READER)"""
+    name = name or os.getenv("SPREADSHEET_READER", "openpyxl")
+    if name not in READERS:
+        raise ValueError(
+            f"Unknown spreadsheet reader '{name}' (expected one of: {', '.join(READERS)})"
+        )
+    return READERS[name]
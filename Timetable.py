@@ -0,0 +1,289 @@
+"""Plan zajęć w pamięci procesu.
+
+HTML grup zapisany w MongoDB jest parsowany raz na wersję planu (sumę kontrolną)
+do listy zajęć, z której API odpowiada bez ponownego pd.read_html.
+Grupy można wskazać nazwą z plans.json, jej slugiem lub numerem (kolejność w plans.json).
+"""
+import os
+import re
+import threading
+import unicodedata
+from collections import OrderedDict, namedtuple
+from datetime import timedelta
+
+from metrics import CACHE_HITS
+
+DAY_NAMES = [
+    "Poniedziałek",
+    "Wtorek",
+    "Środa",
+    "Czwartek",
+    "Piątek",
+    "Sobota",
+    "Niedziela",
+]
+TIME_RANGE = re.compile(r"(\d{3,4})\s*-\s*(\d{3,4})")
+
+Lesson = namedtuple("Lesson", ["day_index", "day", "start", "end", "subject"])
+
+
+def get_plan_collection_name(plan_config):
+    """Nazwa kolekcji MongoDB z wersjami danego planu"""
+    return f"plans_{plan_config['name'].lower().replace(' ', '_').replace('-', '_')}"
+
+
+def get_group_names(plan_config):
+    """Nazwy grup planu w kolejności plans.json ("cały kierunek", gdy plan nie ma grup)"""
+    return list(plan_config.get("groups") or {}) or ["cały kierunek"]
+
+
+def build_group_index(group_names):
+    """Indeks numer/nazwa/slug -> nazwa grupy"""
+    group_index = {}
+    for group_number, group_name in enumerate(group_names):
+        group_index[str(group_number)] = group_name
+        group_index[group_name] = group_name
+        group_index[slugify(group_name)] = group_name
+    return group_index
+
+
+def resolve_group(group_index, group_ref):
+    """Nazwa grupy dla nazwy, sluga lub numeru; None, gdy grupy nie ma w indeksie"""
+    group_ref = str(group_ref).strip()
+    return group_index.get(group_ref) or group_index.get(slugify(group_ref))
+
+
+def slugify(text):
+    """'Cyberbezpieczeństwo i informatyka śledcza grupa 1' -> 'cyberbezpieczenstwo-i-informatyka-sledcza-grupa-1'"""
+    text = text.replace("ł", "l").replace("Ł", "L")
+    text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii")
+    return re.sub(r"[^a-z0-9]+", "-", text.lower()).strip("-")
+
+
+def parse_time(digits):
+    """'815' -> (8, 15), '1005' -> (10, 5)"""
+    return int(digits[:-2]), int(digits[-2:])
+
+
+def parse_group_html(html_content):
+    """Zamienia tabelę HTML grupy (generate_html_table) na listę zajęć w kolejności wierszy"""
+    from bs4 import BeautifulSoup
+
+    table = BeautifulSoup(html_content, "html.parser").find("table")
+    if not table:
+        return []
+
+    rows = table.find_all("tr")
+    if not rows:
+        return []
+    headers = [" ".join(th.get_text(" ").split()) for th in rows[0].find_all("th")]
+
+    lessons = []
+    for row in rows[1:]:
+        cells = [" ".join(td.get_text().split()) for td in row.find_all("td")]
+        if not cells:
+            continue
+        time_range = TIME_RANGE.search(cells[0])
+        if not time_range:
+            continue
+        start, end = parse_time(time_range.group(1)), parse_time(time_range.group(2))
+        for header, subject in zip(headers[1:], cells[1:]):
+            if header in DAY_NAMES and subject:
+                lessons.append(
+                    Lesson(DAY_NAMES.index(header), header, start, end, subject)
+                )
+    return lessons
+
+
+def format_hour(time_tuple):
+    return f"{time_tuple[0]:02d}:{time_tuple[1]:02d}"
+
+
+def build_days(lessons, day_index=None):
+    """Dni z zajęciami w kolejności tygodnia (opcjonalnie tylko jeden dzień), zajęcia według godzin"""
+    days = []
+    for index, day_name in enumerate(DAY_NAMES):
+        if day_index is not None and index != day_index:
+            continue
+        day_lessons = sorted(
+            (lesson for lesson in lessons if lesson.day_index == index),
+            key=lambda lesson: lesson.start,
+        )
+        if day_lessons:
+            days.append(
+                {
+                    "day": day_name,
+                    "lessons": [
+                        {
+                            "start": format_hour(lesson.start),
+                            "end": format_hour(lesson.end),
+                            "subject": lesson.subject,
+                        }
+                        for lesson in day_lessons
+                    ],
+                }
+            )
+    return days
+
+
+def resolve_day(day_ref):
+    """Indeks dnia tygodnia dla nazwy ('Środa'), sluga ('sroda') lub numeru (0 = poniedziałek)"""
+    day_ref = str(day_ref).strip()
+    if day_ref.isdigit() and int(day_ref) < len(DAY_NAMES):
+        return int(day_ref)
+    day_slugs = [slugify(day_name) for day_name in DAY_NAMES]
+    if slugify(day_ref) in day_slugs:
+        return day_slugs.index(slugify(day_ref))
+    return None
+
+
+def find_current_and_next(lessons, now):
+    """Zwraca (aktualna lekcja, następna lekcja, liczba dni do następnej) w ciągu 7 dni"""
+    current_lesson = None
+    next_lesson = None
+    days_ahead = 0
+
+    for day_offset in range(7):
+        check_day = (now.weekday() + day_offset) % 7
+        check_date = now.date() + timedelta(days=day_offset)
+
+        for lesson in lessons:
+            if lesson.day_index != check_day:
+                continue
+            start_time = now.replace(
+                year=check_date.year,
+                month=check_date.month,
+                day=check_date.day,
+                hour=lesson.start[0],
+                minute=lesson.start[1],
+                second=0,
+                microsecond=0,
+            )
+            end_time = start_time.replace(hour=lesson.end[0], minute=lesson.end[1])
+
+            if day_offset == 0 and start_time <= now < end_time:
+                current_lesson = {
+                    "subject": lesson.subject,
+                    "start": start_time.strftime("%H:%M"),
+                    "end": end_time.strftime("%H:%M"),
+                    "time_left": int((end_time - now).total_seconds() // 60),
+                }
+            elif now < start_time and not next_lesson:
+                next_lesson = {
+                    "subject": lesson.subject,
+                    "start": start_time.strftime("%H:%M"),
+                    "end": end_time.strftime("%H:%M"),
+                    "time_to_start": int((start_time - now).total_seconds() // 60),
+                    "day": lesson.day,
+                }
+                days_ahead = day_offset
+                break
+
+        if next_lesson:
+            break
+
+    return current_lesson, next_lesson, days_ahead
+
+
+class Timetable:
+    """Jedna wersja planu: zajęcia wszystkich grup i indeks nazw grup"""
+
+    def __init__(self, plan_id, plan_config, plan_document):
+        self.plan_id = plan_id
+        self.plan_name = plan_config["name"]
+        self.checksum = plan_document.get("checksum")
+        self.timestamp = plan_document.get("timestamp")
+        self.groups = {
+            group_name: parse_group_html(html)
+            for group_name, html in plan_document.get("groups", {}).items()
+        }
+
+        # Numery grup według kolejności w plans.json, tak jak w /api/whatnow/<numer>
+        ordered_groups = list(plan_config.get("groups") or {}) or list(self.groups)
+        self.group_index = build_group_index(ordered_groups)
+        for group_name in self.groups:
+            self.group_index.setdefault(group_name, group_name)
+            self.group_index.setdefault(slugify(group_name), group_name)
+
+    def resolve_group(self, group_ref):
+        return resolve_group(self.group_index, group_ref)
+
+    def whatnow(self, group_name, now):
+        return find_current_and_next(self.groups.get(group_name, []), now)
+
+
+class TimetableStore:
+    """Najnowsze wersje planów w pamięci, przeliczane dopiero po zmianie sumy kontrolnej"""
+
+    def __init__(self, db, plans_config):
+        self.db = db
+        self.plans_config = plans_config
+        self._timetables = {}
+        self._lock = threading.Lock()
+
+    def _collection(self, plan_id):
+        return self.db[get_plan_collection_name(self.plans_config[plan_id])]
+
+    def forget(self, plan_id):
+        """Usuwa plan z pamięci (np. po zmianie jego konfiguracji)"""
+        with self._lock:
+            self._timetables.pop(plan_id, None)
+
+    def get_latest_version(self, plan_id):
+        """Suma kontrolna i _id najnowszej wersji planu (bez treści grup)"""
+        return self._collection(plan_id).find_one(
+            sort=[("timestamp", -1)], projection={"checksum": 1}
+        )
+
+    def get_document(self, plan_id, latest_version):
+        """Pełny dokument wersji planu (z HTML grup)"""
+        return self._collection(plan_id).find_one({"_id": latest_version["_id"]})
+
+    def get(self, plan_id, latest_version=None):
+        """Timetable najnowszej wersji planu albo None, gdy plan nie był jeszcze zapisany"""
+        latest_version = latest_version or self.get_latest_version(plan_id)
+        if not latest_version:
+            return None
+
+        timetable = self._timetables.get(plan_id)
+        if timetable and timetable.checksum == latest_version.get("checksum"):
+            CACHE_HITS.labels(cache="timetable").inc()
+            return timetable
+
+        with self._lock:
+            timetable = self._timetables.get(plan_id)
+            if timetable and timetable.checksum == latest_version.get("checksum"):
+                return timetable
+            plan_document = self.get_document(plan_id, latest_version)
+            if not plan_document:
+                return None
+            timetable = Timetable(plan_id, self.plans_config[plan_id], plan_document)
+            self._timetables[plan_id] = timetable
+            print(
+                f"Wczytano plan {timetable.plan_name} do pamięci (checksum: {timetable.checksum})"
+            )
+            return timetable
+
+
+class GroupLessonsCache:
+    """Zajęcia grup według odcisku HTML - ta sama treść grupy w wielu wersjach jest parsowana raz"""
+
+    def __init__(self, max_entries=None):
+        self.max_entries = max_entries or int(os.getenv("HISTORY_CACHE_SIZE", "256"))
+        self._lessons = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, fingerprint, load_html):
+        with self._lock:
+            lessons = self._lessons.get(fingerprint)
+            if lessons is not None:
+                self._lessons.move_to_end(fingerprint)
+                CACHE_HITS.labels(cache="history").inc()
+                return lessons
+
+        lessons = parse_group_html(load_html())
+        with self._lock:
+            self._lessons[fingerprint] = lessons
+            while len(self._lessons) > self.max_entries:
+                self._lessons.popitem(last=False)
+        return lessons
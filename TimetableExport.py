@@ -0,0 +1,207 @@
+"""Tygodniowy plan grupy jako JSON i kalendarz iCalendar (.ics).
+
+Eksporty są generowane raz na wersję planu przy zapisie w
+LessonPlan.convert_to_html_and_save_to_db i trzymane w kolekcji plan_exports
+(klucz: plan, suma kontrolna, grupa). API serwuje je z pamięci procesu,
+więc odpytywanie kalendarza nie powoduje parsowania HTML.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+import pytz
+
+from metrics import CACHE_HITS
+from Timetable import (
+    build_days,
+    build_group_index,
+    get_group_names,
+    parse_group_html,
+    resolve_group,
+    slugify,
+)
+
+EXPORTS_COLLECTION = "plan_exports"
+
+# Definicja strefy Europe/Warsaw dla kalendarzy, które nie znają TZID
+WARSAW_VTIMEZONE = [
+    "BEGIN:VTIMEZONE",
+    "TZID:Europe/Warsaw",
+    "BEGIN:STANDARD",
+    "DTSTART:19701025T030000",
+    "TZOFFSETFROM:+0200",
+    "TZOFFSETTO:+0100",
+    "TZNAME:CET",
+    "RRULE:FREQ=YEARLY;BYMONTH=10;BYDAY=-1SU",
+    "END:STANDARD",
+    "BEGIN:DAYLIGHT",
+    "DTSTART:19700329T020000",
+    "TZOFFSETFROM:+0100",
+    "TZOFFSETTO:+0200",
+    "TZNAME:CEST",
+    "RRULE:FREQ=YEARLY;BYMONTH=3;BYDAY=-1SU",
+    "END:DAYLIGHT",
+    "END:VTIMEZONE",
+]
+
+
+def get_export_id(plan_name, checksum, group_name):
+    return f"{plan_name}|{checksum}|{group_name}"
+
+
+def build_week(plan_document, group_name, lessons):
+    """Tydzień grupy: dni z zajęciami w kolejności tygodnia, zajęcia w kolejności godzin"""
+    return {
+        "plan": plan_document["plan_name"],
+        "group": group_name,
+        "slug": slugify(group_name),
+        "checksum": plan_document["checksum"],
+        "timestamp": plan_document["timestamp"],
+        "days": build_days(lessons),
+    }
+
+
+def escape_ics_text(text):
+    return (
+        text.replace("\\", "\\\\")
+        .replace(";", "\\;")
+        .replace(",", "\\,")
+        .replace("\n", "\\n")
+    )
+
+
+def fold_ics_line(line):
+    """Łamie linie dłuższe niż 75 bajtów (RFC 5545, 3.1)"""
+    encoded = line.encode("utf-8")
+    if len(encoded) <= 75:
+        return line
+    parts = []
+    current = ""
+    limit = 75
+    for char in line:
+        if len((current + char).encode("utf-8")) > limit:
+            parts.append(current)
+            current = ""
+            # Kolejne linie zaczynają się spacją
+            limit = 74
+        current += char
+    parts.append(current)
+    return "\r\n ".join(parts)
+
+
+def build_ics(plan_document, group_name, lessons):
+    """Kalendarz z cotygodniowymi wydarzeniami od tygodnia, w którym zapisano wersję planu"""
+    saved_at = datetime.strptime(plan_document["timestamp"], "%Y-%m-%d %H:%M:%S")
+    week_start = (saved_at - timedelta(days=saved_at.weekday())).date()
+    # DTSTAMP musi być w UTC, timestamp planu jest zapisywany w czasie lokalnym
+    dtstamp = (
+        pytz.timezone("Europe/Warsaw").localize(saved_at).astimezone(pytz.utc)
+    ).strftime("%Y%m%dT%H%M%SZ")
+
+    lines = [
+        "BEGIN:VCALENDAR",
+        "VERSION:2.0",
+        "PRODID:-//lesson-plan//Plan zajec//PL",
+        "CALSCALE:GREGORIAN",
+        "METHOD:PUBLISH",
+        f"X-WR-CALNAME:{escape_ics_text(plan_document['plan_name'])} - {escape_ics_text(group_name)}",
+        "X-WR-TIMEZONE:Europe/Warsaw",
+        *WARSAW_VTIMEZONE,
+    ]
+    for lesson in lessons:
+        lesson_date = week_start + timedelta(days=lesson.day_index)
+        uid_source = f"{plan_document['plan_name']}|{group_name}|{lesson.day_index}|{lesson.start}|{lesson.subject}"
+        uid = hashlib.md5(uid_source.encode("utf-8"), usedforsecurity=False).hexdigest()
+        lines.extend(
+            [
+                "BEGIN:VEVENT",
+                f"UID:{uid}@lesson-plan",
+                f"DTSTAMP:{dtstamp}",
+                f"DTSTART;TZID=Europe/Warsaw:{lesson_date:%Y%m%d}T{lesson.start[0]:02d}{lesson.start[1]:02d}00",
+                f"DTEND;TZID=Europe/Warsaw:{lesson_date:%Y%m%d}T{lesson.end[0]:02d}{lesson.end[1]:02d}00",
+                "RRULE:FREQ=WEEKLY",
+                f"SUMMARY:{escape_ics_text(lesson.subject)}",
+                "END:VEVENT",
+            ]
+        )
+    lines.append("END:VCALENDAR")
+    return "\r\n".join(fold_ics_line(line) for line in lines) + "\r\n"
+
+
+def build_group_export(plan_document, group_name):
+    lessons = parse_group_html(plan_document["groups"][group_name])
+    return {
+        "_id": get_export_id(plan_document["plan_name"], plan_document["checksum"], group_name),
+        "plan_name": plan_document["plan_name"],
+        "checksum": plan_document["checksum"],
+        "group": group_name,
+        "week": build_week(plan_document, group_name, lessons),
+        "ics": build_ics(plan_document, group_name, lessons),
+    }
+
+
+def save_plan_exports(db, plan_document):
+    """Generuje eksporty wszystkich grup nowej wersji planu i usuwa eksporty starszych wersji"""
+    exports = [
+        build_group_export(plan_document, group_name)
+        for group_name in plan_document["groups"]
+    ]
+    if not exports:
+        return 0
+    collection = db[EXPORTS_COLLECTION]
+    for export in exports:
+        collection.replace_one({"_id": export["_id"]}, export, upsert=True)
+    collection.delete_many(
+        {
+            "plan_name": plan_document["plan_name"],
+            "checksum": {"$ne": plan_document["checksum"]},
+        }
+    )
+    print(f"Zapisano eksporty tygodniowe dla {len(exports)} grup planu {plan_document['plan_name']}")
+    return len(exports)
+
+
+class ExportStore:
+    """Eksporty najnowszych wersji planów w pamięci procesu (LRU po kluczu z sumą kontrolną)"""
+
+    def __init__(self, db, plans_config, timetables, max_entries=None):
+        self.db = db
+        self.plans_config = plans_config
+        self.timetables = timetables
+        self.max_entries = max_entries or int(os.getenv("EXPORT_CACHE_SIZE", "256"))
+        self._exports = OrderedDict()
+        self._lock = threading.Lock()
+
+    def resolve_group(self, plan_id, group_ref):
+        return resolve_group(
+            build_group_index(get_group_names(self.plans_config[plan_id])), group_ref
+        )
+
+    def get(self, plan_id, latest_version, group_name):
+        """Eksport grupy dla wersji latest_version albo None, gdy grupy nie ma w planie"""
+        plan_name = self.plans_config[plan_id]["name"]
+        export_id = get_export_id(plan_name, latest_version.get("checksum"), group_name)
+
+        with self._lock:
+            export = self._exports.get(export_id)
+            if export:
+                self._exports.move_to_end(export_id)
+                CACHE_HITS.labels(cache="export").inc()
+                return export
+
+        export = self.db[EXPORTS_COLLECTION].find_one({"_id": export_id})
+        if not export:
+            # Wersje zapisane przed wprowadzeniem eksportów - generujemy raz i zapisujemy
+            plan_document = self.timetables.get_document(plan_id, latest_version)
+            if not plan_document or group_name not in plan_document.get("groups", {}):
+                return None
+            export = build_group_export(plan_document, group_name)
+            self.db[EXPORTS_COLLECTION].replace_one({"_id": export_id}, export, upsert=True)
+
+        with self._lock:
+            self._exports[export_id] = export
+            while len(self._exports) > self.max_entries:
+                self._exports.popitem(last=False)
+        return export
@@ -0,0 +1,244 @@
+"""Strumieniowy odczyt pojedynczego arkusza XLSX bez openpyxl.
+
+Plik XLSX to archiwum zip z XML-ami. Do odczytu planu potrzebne są tylko:
+xl/workbook.xml (nazwy arkuszy), xl/_rels/workbook.xml.rels (ścieżki arkuszy),
+xl/sharedStrings.xml (współdzielone teksty), xl/styles.xml (formaty dat)
+i XML samego arkusza z listą mergeCells. Wszystkie są parsowane przez iterparse,
+bez stylów, obrazów i pozostałych arkuszy.
+"""
+import posixpath
+import re
+import zipfile
+from datetime import datetime, timedelta
+from xml.etree.ElementTree import iterparse
+
+MAIN_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+REL_NS = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+PACKAGE_REL_NS = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+
+CELL_REFERENCE = re.compile(r"([A-Z]+)(\d+)")
+# Wbudowane formaty liczbowe Excela oznaczające daty/godziny
+BUILTIN_DATE_FORMATS = set(range(14, 23)) | {45, 46, 47}
+EXCEL_EPOCH = datetime(1899, 12, 30)
+
+
+def column_index(letters):
+    """Zamienia litery kolumny (A, B, ..., AA) na indeks liczony od 0"""
+    index = 0
+    for letter in letters:
+        index = index * 26 + (ord(letter) - 64)
+    return index - 1
+
+
+def parse_reference(reference):
+    """Zwraca (wiersz, kolumna) liczone od 0 dla adresu typu 'B12'"""
+    match = CELL_REFERENCE.fullmatch(reference)
+    if not match:
+        raise ValueError(f"Invalid cell reference: {reference}")
+    return int(match.group(2)) - 1, column_index(match.group(1))
+
+
+def is_date_format(format_code):
+    # Pomijamy teksty w cudzysłowach, sekcje [..] (kolory, locale) i znaki escapowane
+    code = re.sub(r'"[^"]*"|\[[^\]]*\]|\\.', "", format_code).lower()
+    return any(token in code for token in ("d", "m", "y", "h", "s"))
+
+
+# Wartość zwracana dla komórek z błędem (#N/A, #REF! ...) gdy nie podano innej
+KEEP_ERROR_TEXT = object()
+
+
+def from_excel_serial(value):
+    """Zamienia numer seryjny daty Excela na datetime (jak openpyxl.utils.datetime.from_excel)"""
+    day, fraction = divmod(value, 1)
+    time_of_day = timedelta(milliseconds=round(fraction * 86400 * 1000))
+    if 0 <= value < 1 and time_of_day.days == 0:
+        return (datetime.min + time_of_day).time()
+    if 0 < value < 60:
+        # Excel traktuje rok 1900 jako przestępny
+        day += 1
+    return EXCEL_EPOCH + timedelta(days=day) + time_of_day
+
+
+class XlsxStreamReader:
+    def __init__(self, file_path, error_value=KEEP_ERROR_TEXT):
+        self.file_path = file_path
+        self.error_value = error_value
+
+    def sheet_names(self):
+        with zipfile.ZipFile(self.file_path) as archive:
+            return [name for name, _ in self._read_sheets(archive)]
+
+    def read_sheet(self, sheet_name, fill_merged=True):
+        """Zwraca gęstą siatkę wartości arkusza (lista wierszy), domyślnie z wypełnionymi scaleniami"""
+        with zipfile.ZipFile(self.file_path) as archive:
+            sheet_path = dict(self._read_sheets(archive)).get(sheet_name)
+            if sheet_path is None:
+                raise KeyError(f"Worksheet {sheet_name} does not exist.")
+            shared_strings = self._read_shared_strings(archive)
+            date_styles = self._read_date_styles(archive)
+            cells, merged_ranges = self._read_cells(
+                archive, sheet_path, shared_strings, date_styles
+            )
+        return self._build_grid(cells, merged_ranges if fill_merged else [])
+
+    def _read_sheets(self, archive):
+        """Zwraca listę (nazwa arkusza, ścieżka XML w archiwum) w kolejności skoroszytu"""
+        relationships = {}
+        with archive.open("xl/_rels/workbook.xml.rels") as rels_file:
+            for _, element in iterparse(rels_file):
+                if element.tag == f"{PACKAGE_REL_NS}Relationship":
+                    target = element.get("Target")
+                    if target.startswith("/"):
+                        target = target.lstrip("/")
+                    else:
+                        target = posixpath.normpath(posixpath.join("xl", target))
+                    relationships[element.get("Id")] = target
+
+        sheets = []
+        with archive.open("xl/workbook.xml") as workbook_file:
+            for _, element in iterparse(workbook_file):
+                if element.tag == f"{MAIN_NS}sheet":
+                    sheets.append(
+                        (element.get("name"), relationships[element.get(f"{REL_NS}id")])
+                    )
+        return sheets
+
+    @staticmethod
+    def _read_shared_strings(archive):
+        if "xl/sharedStrings.xml" not in archive.namelist():
+            return []
+        shared_strings = []
+        with archive.open("xl/sharedStrings.xml") as strings_file:
+            for _, element in iterparse(strings_file):
+                if element.tag == f"{MAIN_NS}si":
+                    # Tekst sformatowany składa się z wielu <r><t>; <rPh> to fonetyka - pomijamy
+                    phonetic_texts = {
+                        t for rph in element.iter(f"{MAIN_NS}rPh") for t in rph.iter(f"{MAIN_NS}t")
+                    }
+                    text = "".join(
+                        t.text or ""
+                        for t in element.iter(f"{MAIN_NS}t")
+                        if t not in phonetic_texts
+                    )
+                    shared_strings.append(text)
+                    element.clear()
+        return shared_strings
+
+    @staticmethod
+    def _read_date_styles(archive):
+        """Zwraca zbiór indeksów stylów komórek (atrybut s), które są datami"""
+        if "xl/styles.xml" not in archive.namelist():
+            return set()
+        custom_formats = {}
+        cell_format_ids = []
+        with archive.open("xl/styles.xml") as styles_file:
+            in_cell_xfs = False
+            for event, element in iterparse(styles_file, events=("start", "end")):
+                if element.tag == f"{MAIN_NS}cellXfs":
+                    in_cell_xfs = event == "start"
+                elif event == "end" and element.tag == f"{MAIN_NS}numFmt":
+                    custom_formats[int(element.get("numFmtId"))] = element.get("formatCode", "")
+                elif event == "end" and in_cell_xfs and element.tag == f"{MAIN_NS}xf":
+                    cell_format_ids.append(int(element.get("numFmtId", 0)))
+
+        date_styles = set()
+        for style_index, format_id in enumerate(cell_format_ids):
+            if format_id in custom_formats:
+                if is_date_format(custom_formats[format_id]):
+                    date_styles.add(style_index)
+            elif format_id in BUILTIN_DATE_FORMATS:
+                date_styles.add(style_index)
+        return date_styles
+
+    def _convert_value(self, raw_value, cell_type, style, shared_strings, date_styles):
+        if cell_type == "s":
+            return shared_strings[int(raw_value)]
+        if cell_type in ("str", "inlineStr"):
+            return raw_value
+        if cell_type == "e":
+            return raw_value if self.error_value is KEEP_ERROR_TEXT else self.error_value
+        if cell_type == "b":
+            return raw_value == "1"
+        if cell_type == "d":
+            return datetime.fromisoformat(raw_value)
+        # Liczba - tak jak openpyxl: float gdy zapis ma część ułamkową lub wykładnik
+        if "." in raw_value or "E" in raw_value or "e" in raw_value:
+            number = float(raw_value)
+        else:
+            number = int(raw_value)
+        if style in date_styles:
+            return from_excel_serial(number)
+        return number
+
+    def _read_cells(self, archive, sheet_path, shared_strings, date_styles):
+        cells = {}
+        merged_ranges = []
+        row_index = -1
+        column = -1
+        with archive.open(sheet_path) as sheet_file:
+            for event, element in iterparse(sheet_file, events=("start", "end")):
+                tag = element.tag
+                if event == "start":
+                    if tag == f"{MAIN_NS}row":
+                        row_number = element.get("r")
+                        row_index = int(row_number) - 1 if row_number else row_index + 1
+                        column = -1
+                    continue
+
+                if tag == f"{MAIN_NS}c":
+                    reference = element.get("r")
+                    if reference:
+                        row_index, column = parse_reference(reference)
+                    else:
+                        column += 1
+                    cell_type = element.get("t", "n")
+                    if cell_type == "inlineStr":
+                        raw_value = "".join(
+                            t.text or "" for t in element.iter(f"{MAIN_NS}t")
+                        )
+                    else:
+                        value_element = element.find(f"{MAIN_NS}v")
+                        raw_value = value_element.text if value_element is not None else None
+                    if raw_value is not None and (raw_value != "" or cell_type != "n"):
+                        cells[(row_index, column)] = self._convert_value(
+                            raw_value,
+                            cell_type,
+                            int(element.get("s", 0)),
+                            shared_strings,
+                            date_styles,
+                        )
+                    element.clear()
+                elif tag == f"{MAIN_NS}row":
+                    element.clear()
+                elif tag == f"{MAIN_NS}mergeCell":
+                    first, _, last = element.get("ref").partition(":")
+                    min_row, min_col = parse_reference(first)
+                    max_row, max_col = parse_reference(last or first)
+                    merged_ranges.append((min_row, min_col, max_row, max_col))
+        return cells, merged_ranges
+
+    @staticmethod
+    def _build_grid(cells, merged_ranges):
+        max_row = max((row for row, _ in cells), default=-1)
+        max_col = max((col for _, col in cells), default=-1)
+        for _, _, range_max_row, range_max_col in merged_ranges:
+            max_row = max(max_row, range_max_row)
+            max_col = max(max_col, range_max_col)
+
+        grid = [[None] * (max_col + 1) for _ in range(max_row + 1)]
+        for (row, col), value in cells.items():
+            grid[row][col] = value
+
+        # Wartość lewej górnej komórki scalenia kopiujemy do całego zakresu
+        for min_row, min_col, range_max_row, range_max_col in merged_ranges:
+            merged_value = grid[min_row][min_col]
+            for row in range(min_row, range_max_row + 1):
+                grid_row = grid[row]
+                for col in range(min_col, range_max_col + 1):
+                    grid_row[col] = merged_value
+        return grid
+
+
+def read_sheet_grid(file_path, sheet_name):
+    return XlsxStreamReader(file_path).read_sheet(sheet_name)
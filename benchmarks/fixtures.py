@@ -0,0 +1,155 @@
+"""Arkusze testowe dla benchmarków.
+
+Syntetyczne arkusze odtwarzają układ plików WSPA (tytuł scalony w pierwszym
+wierszu, dni tygodnia scalone nad kolumnami grup, identyfikatory grup pod
+dniami, zajęcia scalone pionowo na kilka bloków godzinowych) dla układów
+st, nst i nst-online. Zanonimizowane prawdziwe arkusze można dodać do
+benchmarks/fixtures/ jako <nazwa>.xlsx z plikiem <nazwa>.json zawierającym
+{"plan_config": {...}} w formacie plans.json.
+"""
+import json
+import os
+import random
+from datetime import datetime
+
+import openpyxl
+
+FIXTURES_DIRECTORY = os.path.join(os.path.dirname(__file__), "fixtures")
+PLANS_FILE = os.path.join(os.path.dirname(os.path.dirname(__file__)), "plans.json")
+
+LAYOUT_DAYS = {
+    "st": ["PONIEDZIAŁEK", "WTOREK", "ŚRODA", "CZWARTEK", "PIĄTEK"],
+    "nst": ["PIĄTEK", "SOBOTA", "NIEDZIELA"],
+    "nst-online": ["SOBOTA", "NIEDZIELA"],
+}
+
+TIME_SLOTS = [
+    "725- 810",
+    "815- 900",
+    "905- 950",
+    "1000-1045",
+    "1050- 1135",
+    "1145- 1230",
+    "1235- 1320",
+    "1330- 1415",
+    "1420- 1505",
+    "1515- 1600",
+    "1605- 1650",
+    "1700- 1745",
+    "1750- 1835",
+    "1845- 1930",
+    "1935- 2020",
+    "2030- 2115",
+]
+
+# Plany z plans.json, których grupy użyte są w syntetycznych arkuszach
+SYNTHETIC_PLANS = {
+    "st": "informatyka2",
+    "nst": "informatyka7",
+    "nst-online": "informatyka16",
+}
+
+
+class Fixture:
+    def __init__(self, name, path, plan_config, plan_id=None):
+        self.name = name
+        self.path = path
+        self.plan_config = plan_config
+        self.plan_id = plan_id
+
+    def __repr__(self):
+        return f"Fixture({self.name}, {self.path})"
+
+
+def generate_workbook(path, layout, plan_config, seed=0, lesson_probability=0.35):
+    """Zapisuje syntetyczny plan o układzie `layout` dla grup z `plan_config`"""
+    rng = random.Random(seed)
+    days = LAYOUT_DAYS[layout]
+    group_identifiers = list((plan_config.get("groups") or {}).values()) or ["cały kierunek"]
+
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = plan_config["sheet_name"]
+    num_columns = 1 + len(days) * len(group_identifiers)
+
+    ws.cell(row=1, column=1, value=f"{plan_config['name']} - semestr zimowy")
+    ws.merge_cells(start_row=1, start_column=1, end_row=1, end_column=num_columns)
+
+    ws.cell(row=2, column=1, value="godz.")
+    ws.cell(row=3, column=1, value="godz.")
+    for day_index, day in enumerate(days):
+        first_column = 2 + day_index * len(group_identifiers)
+        ws.cell(row=2, column=first_column, value=day)
+        ws.merge_cells(
+            start_row=2,
+            start_column=first_column,
+            end_row=2,
+            end_column=first_column + len(group_identifiers) - 1,
+        )
+        for group_index, identifier in enumerate(group_identifiers):
+            ws.cell(row=3, column=first_column + group_index, value=identifier)
+
+    first_slot_row = 4
+    for slot_index, slot in enumerate(TIME_SLOTS):
+        ws.cell(row=first_slot_row + slot_index, column=1, value=slot)
+
+    last_slot_row = first_slot_row + len(TIME_SLOTS) - 1
+    for column in range(2, num_columns + 1):
+        row = first_slot_row
+        while row < last_slot_row:
+            if rng.random() < lesson_probability:
+                ws.cell(
+                    row=row,
+                    column=column,
+                    value=f"Przedmiot {rng.randint(1, 40)}\ndr Jan Kowalski\nsala {rng.randint(1, 300)}",
+                )
+                ws.merge_cells(start_row=row, start_column=column, end_row=row + 1, end_column=column)
+                row += 2
+            else:
+                row += 1
+
+    # Stopka z datą i liczbami - sprawdza konwersję typów przez silniki odczytu
+    footer_row = last_slot_row + 1
+    ws.cell(row=footer_row, column=1, value="aktualizacja")
+    ws.cell(row=footer_row, column=2, value=datetime(2024, 10, 1, 12, 30))
+    ws.cell(row=footer_row, column=3, value=30)
+    ws.cell(row=footer_row, column=4, value=2.5)
+
+    wb.save(path)
+    return path
+
+
+def load_fixtures(work_directory, include_synthetic=True):
+    """Zwraca listę arkuszy: syntetyczne (zapisane w work_directory) i z benchmarks/fixtures/"""
+    fixtures = []
+
+    if include_synthetic:
+        with open(PLANS_FILE, "r", encoding="utf-8") as f:
+            plans_config = json.load(f)
+        for layout, plan_id in SYNTHETIC_PLANS.items():
+            plan_config = plans_config[plan_id]
+            path = os.path.join(work_directory, f"synthetic_{layout}.xlsx")
+            generate_workbook(path, layout, plan_config)
+            fixtures.append(Fixture(f"synthetic-{layout}", path, plan_config, plan_id))
+
+    if os.path.isdir(FIXTURES_DIRECTORY):
+        for file_name in sorted(os.listdir(FIXTURES_DIRECTORY)):
+            if not file_name.endswith(".xlsx"):
+                continue
+            name = os.path.splitext(file_name)[0]
+            config_path = os.path.join(FIXTURES_DIRECTORY, f"{name}.json")
+            if not os.path.exists(config_path):
+                print(f"Skipping fixture {file_name} - missing {name}.json")
+                continue
+            with open(config_path, "r", encoding="utf-8") as f:
+                fixture_config = json.load(f)
+            fixtures.append(
+                Fixture(
+                    name,
+                    os.path.join(FIXTURES_DIRECTORY, file_name),
+                    fixture_config["plan_config"],
+                    fixture_config.get("plan_id"),
+                )
+            )
+
+    return fixtures
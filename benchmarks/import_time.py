@@ -0,0 +1,97 @@
+"""Czas importu punktów wejścia (jak python -X importtime).
+
+Każdy punkt wejścia importowany jest w świeżym procesie z -X importtime.
+Raport podaje medianowy czas importu, moduły o największym czasie
+własnym i ciężkie zależności, które zostały zaimportowane, choć
+punkt wejścia ich nie potrzebuje (np. pandas w procesie API).
+
+    python -m benchmarks.import_time --repeat 5
+    python -m benchmarks.import_time --entry wsgi --max-ms 400
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Punkt wejścia -> zależności, których nie powinien importować przy starcie
+ENTRY_POINTS = {
+    "wsgi": ("pandas", "openpyxl", "aiohttp", "requests", "lxml", "bs4", "pymongo"),
+    "main": ("pandas", "openpyxl", "aiohttp", "requests", "lxml", "bs4", "pymongo"),
+    "LessonPlan": (),
+    "AsyncCheckCycle": (),
+}
+
+
+def parse_importtime(stderr):
+    """Zwraca listę (moduł, czas własny [us], czas skumulowany [us], głębokość)"""
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip(" "))) // 2
+        modules.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return modules
+
+
+def entry_subtree(modules, entry):
+    """Moduły zaimportowane przez punkt wejścia (bez importów startowych interpretera)"""
+    end = next(index for index, module in enumerate(modules) if module[0] == entry and module[3] == 0)
+    start = end
+    while start > 0 and modules[start - 1][3] > 0:
+        start -= 1
+    return modules[start : end + 1]
+
+
+def measure_entry(entry):
+    environment = dict(os.environ, SENTRY_DSN="", PYTHONDONTWRITEBYTECODE="1")
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {entry}"],
+        cwd=ROOT_DIRECTORY,
+        env=environment,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {entry} failed:\n{result.stderr[-2000:]}")
+    return entry_subtree(parse_importtime(result.stderr), entry)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Czas importu punktów wejścia")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--entry", action="append", help="mierz tylko wskazane punkty wejścia")
+    parser.add_argument("--top", type=int, default=10, help="liczba najwolniejszych modułów w raporcie")
+    parser.add_argument("--max-ms", type=float, help="zakończ kodem 1, gdy import trwa dłużej")
+    args = parser.parse_args(argv)
+
+    failed = False
+    for entry in args.entry or ENTRY_POINTS:
+        samples = [measure_entry(entry) for _ in range(args.repeat)]
+        totals = [modules[-1][2] for modules in samples]
+        total_ms = statistics.median(totals) / 1000
+        modules = samples[-1]
+        print(f"\n=== import {entry}: {total_ms:.0f} ms ===")
+
+        # Moduły o największym czasie własnym (bez importów, które same wykonują)
+        slowest = sorted(modules[:-1], key=lambda module: module[1], reverse=True)
+        print(f"{'module':<40} {'self [ms]':>10} {'cumulative [ms]':>16}")
+        for name, self_us, cumulative, _ in slowest[: args.top]:
+            print(f"{name:<40} {self_us / 1000:>10.1f} {cumulative / 1000:>16.1f}")
+
+        imported = {name.split(".")[0] for name, _, _, _ in modules}
+        unexpected = [name for name in ENTRY_POINTS.get(entry, ()) if name in imported]
+        if unexpected:
+            print(f"Unexpected heavy imports: {', '.join(unexpected)}")
+            failed = True
+        if args.max_ms is not None and total_ms > args.max_ms:
+            print(f"Import of {entry} exceeds {args.max_ms:.0f} ms")
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,103 @@
+"""Sprawdza, że wszystkie silniki z SpreadsheetReader dają identyczne wyniki.
+
+Dla każdego arkusza z benchmarks/fixtures.py porównuje DataFrame'y
+(header=0 i header=None) odczytane z pliku źródłowego, rozscalonego
+i oczyszczonego, a następnie HTML grup z pełnego przetwarzania planu.
+Kończy się kodem 1, jeśli którykolwiek silnik różni się od openpyxl.
+
+    python -m benchmarks.reader_conformance
+"""
+import argparse
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+
+ROOT_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIRECTORY not in sys.path:
+    sys.path.insert(0, ROOT_DIRECTORY)
+
+import pandas as pd  # noqa: E402
+
+from benchmarks.fixtures import load_fixtures  # noqa: E402
+from benchmarks.run import StageRecorder, build_lesson_plan, run_pipeline, use_mongo  # noqa: E402
+from SpreadsheetReader import READERS  # noqa: E402
+
+REFERENCE_READER = "openpyxl"
+
+
+def compare_frames(file_path, sheet_name, readers):
+    differences = []
+    for header in (0, None):
+        expected = READERS[REFERENCE_READER].read_sheet(file_path, sheet_name, header=header)
+        for reader_name in readers:
+            actual = READERS[reader_name].read_sheet(file_path, sheet_name, header=header)
+            try:
+                pd.testing.assert_frame_equal(actual, expected)
+            except AssertionError as e:
+                differences.append(f"{reader_name} header={header}: {e}")
+    return differences
+
+
+def prepared_files(fixture, work_directory):
+    """Zwraca ścieżki pliku źródłowego, rozscalonego i oczyszczonego (silnik openpyxl)"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        lesson_plan = build_lesson_plan(fixture, work_directory, "openpyxl")
+        lesson_plan.directory = work_directory
+        lesson_plan.run_directory = tempfile.mkdtemp(dir=work_directory)
+        lesson_plan.download_file()
+        source = shutil.copy(lesson_plan.file_save_path, os.path.join(lesson_plan.run_directory, "source.xlsx"))
+        lesson_plan.unmerge_and_fill_data()
+        unmerged = shutil.copy(lesson_plan.converted_lesson_plan, os.path.join(lesson_plan.run_directory, "unmerged.xlsx"))
+        lesson_plan.clean_excel_file()
+    return {"source": source, "unmerged": unmerged, "cleaned": lesson_plan.converted_lesson_plan}
+
+
+def pipeline_output(fixture, work_directory, reader_name):
+    plan_config = dict(fixture.plan_config, reader=reader_name)
+    fixture_for_reader = type(fixture)(fixture.name, fixture.path, plan_config, fixture.plan_id)
+    with contextlib.redirect_stdout(io.StringIO()):
+        lesson_plan = build_lesson_plan(fixture_for_reader, work_directory, "openpyxl")
+        return run_pipeline(fixture_for_reader, lesson_plan, StageRecorder(trace_memory=False))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Zgodność silników odczytu arkuszy")
+    parser.add_argument("--reader", action="append", help="sprawdź tylko wskazane silniki")
+    parser.add_argument("--no-synthetic", action="store_true")
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault("SAVE_TO_FILE", "false")
+    use_mongo(None)
+    readers = [name for name in (args.reader or READERS) if name != REFERENCE_READER]
+
+    work_directory = tempfile.mkdtemp(prefix="lesson_plan_conformance_")
+    failures = []
+    try:
+        for fixture in load_fixtures(work_directory, include_synthetic=not args.no_synthetic):
+            sheet_name = fixture.plan_config["sheet_name"]
+            for stage, file_path in prepared_files(fixture, work_directory).items():
+                for difference in compare_frames(file_path, sheet_name, readers):
+                    failures.append(f"{fixture.name}/{stage}: {difference}")
+
+            expected_html = pipeline_output(fixture, work_directory, REFERENCE_READER)
+            for reader_name in readers:
+                if pipeline_output(fixture, work_directory, reader_name) != expected_html:
+                    failures.append(f"{fixture.name}/pipeline: {reader_name} HTML differs from {REFERENCE_READER}")
+            print(f"{fixture.name}: checked {', '.join(readers)} against {REFERENCE_READER}")
+    finally:
+        shutil.rmtree(work_directory, ignore_errors=True)
+
+    if failures:
+        print("\nReader conformance failures:")
+        for failure in failures:
+            print(f"- {failure}")
+        return 1
+    print("\nAll readers conform")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,307 @@
+"""Benchmark etapów przetwarzania planu lekcji.
+
+Uruchamia unmerge_and_fill_data, clean_excel_file,
+find_group_columns_with_similarity, get_lessons_for_group,
+generate_html_table oraz /api/whatnow (pojedyncza grupa i zbiorczo) na arkuszach z benchmarks/fixtures.py,
+bez sieci (pobieranie jest zastąpione kopiowaniem arkusza) i z mongomock
+zamiast MongoDB (lub lokalną bazą podaną przez --mongo-uri).
+
+Dla każdego etapu raportowany jest medianowy czas i szczytowe zużycie pamięci
+(tracemalloc). Z --baseline wyniki porównywane są z zapisanymi wcześniej
+(--save-baseline) i skrypt kończy się kodem 1 przy regresji.
+
+    python -m benchmarks.run --save-baseline benchmarks/baseline.json
+    python -m benchmarks.run --baseline benchmarks/baseline.json
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIRECTORY not in sys.path:
+    sys.path.insert(0, ROOT_DIRECTORY)
+
+from benchmarks.fixtures import load_fixtures  # noqa: E402
+
+# Plan, z którego korzysta /api/whatnow/<numer grupy>
+WHATNOW_PLAN_ID = "informatyka2"
+
+
+def use_mongo(mongo_uri):
+    """Podmienia MongoClient na mongomock, chyba że podano adres lokalnej bazy"""
+    if mongo_uri:
+        os.environ["MONGO_URI"] = mongo_uri
+        return
+    import mongomock
+    import pymongo
+
+    pymongo.MongoClient = mongomock.MongoClient
+
+
+class StageRecorder:
+    def __init__(self, trace_memory):
+        self.trace_memory = trace_memory
+        self.results = {}
+
+    def measure(self, fixture_name, stage, function, *args, **kwargs):
+        if self.trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            peak = 0
+            if self.trace_memory:
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            stage_results = self.results.setdefault(fixture_name, {}).setdefault(
+                stage, {"times": [], "peak_memory": 0}
+            )
+            stage_results["peak_memory"] = max(stage_results["peak_memory"], peak)
+            if not self.trace_memory:
+                stage_results["times"].append(elapsed)
+
+    def summary(self):
+        summary = {}
+        for fixture_name, stages in self.results.items():
+            summary[fixture_name] = {
+                stage: {
+                    "time": statistics.median(values["times"]) if values["times"] else 0.0,
+                    "peak_memory": values["peak_memory"],
+                }
+                for stage, values in stages.items()
+            }
+        return summary
+
+
+def build_lesson_plan(fixture, run_directory, xlsx_engine, reader=None):
+    from LessonPlan import LessonPlan
+
+    lesson_plan = LessonPlan(
+        username="benchmark",
+        password="benchmark",
+        mongo_uri=os.getenv("MONGO_URI", "mongodb://localhost:27017/"),
+        plan_config=dict(
+            fixture.plan_config,
+            xlsx_engine=xlsx_engine,
+            reader=reader or fixture.plan_config.get("reader"),
+        ),
+        directory=run_directory,
+    )
+
+    def download_file(download_cache=None):
+        # Zamiast logowania do PUW kopiujemy arkusz do katalogu przebiegu
+        file_save_path = os.path.join(lesson_plan.run_directory, "downloaded_file.xlsx")
+        shutil.copyfile(fixture.path, file_save_path)
+        lesson_plan.file_save_path = file_save_path
+        return lesson_plan.calculate_checksum(file_save_path)
+
+    lesson_plan.download_file = download_file
+    return lesson_plan
+
+
+def run_pipeline(fixture, lesson_plan, recorder):
+    """Wykonuje etapy potoku jeden po drugim, zwraca HTML grup"""
+    name = fixture.name
+    lesson_plan.start_run()
+    try:
+        lesson_plan.download_file()
+        recorder.measure(name, "unmerge_and_fill_data", lesson_plan.unmerge_and_fill_data)
+        recorder.measure(name, "clean_excel_file", lesson_plan.clean_excel_file)
+        # Najpierw wyszukiwanie od zera, potem z zapamiętanego układu kolumn
+        lesson_plan.group_columns = {}
+        lesson_plan.group_layout = None
+        lesson_plan.db["group_layouts"].delete_many({})
+        recorder.measure(
+            name,
+            "find_group_columns_with_similarity",
+            lesson_plan.find_group_columns_with_similarity,
+        )
+        recorder.measure(
+            name,
+            "find_group_columns_with_similarity[cached]",
+            lesson_plan.find_group_columns_with_similarity,
+        )
+
+        group_frames = recorder.measure(
+            name,
+            "get_lessons_for_group",
+            lambda: {
+                group_name: lesson_plan.get_lessons_for_group(group_name)
+                for group_name in lesson_plan.groups
+            },
+        )
+        return recorder.measure(
+            name,
+            "generate_html_table",
+            lambda: {
+                group_name: lesson_plan.generate_html_table(df)
+                for group_name, df in group_frames.items()
+                if df is not None and not df.empty
+            },
+        )
+    finally:
+        lesson_plan.cleanup_run()
+
+
+def run_whatnow(fixture, groups_html, recorder, requests_per_group):
+    import main
+    from Timetable import TimetableStore, get_plan_collection_name
+
+    db = main.get_db()
+    # Nowy magazyn planów, aby pierwsze zapytanie parsowało HTML grup
+    main.timetables = TimetableStore(db, main.plans_config)
+    collection = db[get_plan_collection_name(fixture.plan_config)]
+    collection.delete_many({})
+    collection.insert_one(
+        {
+            "timestamp": "2024-10-01 12:00:00",
+            "checksum": "benchmark",
+            "plan_name": fixture.plan_config["name"],
+            "category": fixture.plan_config.get("category", "st"),
+            "groups": groups_html,
+        }
+    )
+    test_client = main.app.test_client()
+
+    def query_all_groups():
+        for _ in range(requests_per_group):
+            for group_number in range(len(fixture.plan_config["groups"])):
+                response = test_client.get(f"/api/whatnow/{group_number}")
+                if response.status_code >= 500:
+                    raise RuntimeError(f"/api/whatnow/{group_number} failed: {response.status_code}")
+
+    def query_batch():
+        for _ in range(requests_per_group):
+            response = test_client.get(f"/api/whatnow?plans={WHATNOW_PLAN_ID}")
+            if response.status_code >= 500:
+                raise RuntimeError(f"/api/whatnow failed: {response.status_code}")
+
+    recorder.measure(fixture.name, "whatnow", query_all_groups)
+    recorder.measure(fixture.name, "whatnow_batch", query_batch)
+
+
+def run_benchmarks(fixtures, repeat, requests_per_group, xlsx_engine, reader):
+    work_directory = tempfile.mkdtemp(prefix="lesson_plan_bench_")
+    timing = StageRecorder(trace_memory=False)
+    memory = StageRecorder(trace_memory=True)
+    try:
+        for fixture in fixtures:
+            print(f"\n=== {fixture.name} ===")
+            lesson_plan = build_lesson_plan(fixture, work_directory, xlsx_engine, reader)
+            # Pierwszy przebieg mierzy pamięć, kolejne tylko czas
+            for recorder, runs in ((memory, 1), (timing, repeat)):
+                for _ in range(runs):
+                    groups_html = run_pipeline(fixture, lesson_plan, recorder)
+                    if fixture.plan_id == WHATNOW_PLAN_ID and groups_html:
+                        run_whatnow(fixture, groups_html, recorder, requests_per_group)
+    finally:
+        shutil.rmtree(work_directory, ignore_errors=True)
+
+    summary = timing.summary()
+    for fixture_name, stages in memory.summary().items():
+        for stage, values in stages.items():
+            summary[fixture_name][stage]["peak_memory"] = values["peak_memory"]
+    return summary
+
+
+def print_report(summary, output=sys.stdout):
+    print(f"\n{'fixture':<24} {'stage':<44} {'time [ms]':>10} {'peak [KiB]':>11}", file=output)
+    for fixture_name, stages in summary.items():
+        for stage, values in stages.items():
+            print(
+                f"{fixture_name:<24} {stage:<44} {values['time'] * 1000:>10.1f} "
+                f"{values['peak_memory'] / 1024:>11.0f}",
+                file=output,
+            )
+
+
+def find_regressions(summary, baseline, tolerance, min_time_delta):
+    regressions = []
+    for fixture_name, stages in summary.items():
+        for stage, values in stages.items():
+            reference = baseline.get(fixture_name, {}).get(stage)
+            if not reference:
+                continue
+            time_limit = max(
+                reference["time"] * (1 + tolerance), reference["time"] + min_time_delta
+            )
+            if values["time"] > time_limit:
+                regressions.append(
+                    f"{fixture_name}/{stage}: time {values['time'] * 1000:.1f} ms "
+                    f"> {reference['time'] * 1000:.1f} ms baseline"
+                )
+            if reference["peak_memory"] and values["peak_memory"] > reference["peak_memory"] * (1 + tolerance):
+                regressions.append(
+                    f"{fixture_name}/{stage}: peak memory {values['peak_memory'] / 1024:.0f} KiB "
+                    f"> {reference['peak_memory'] / 1024:.0f} KiB baseline"
+                )
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark etapów przetwarzania planu lekcji")
+    parser.add_argument("--repeat", type=int, default=3, help="liczba przebiegów mierzących czas")
+    parser.add_argument("--whatnow-requests", type=int, default=20, help="zapytań /api/whatnow na grupę")
+    parser.add_argument("--mongo-uri", default=None, help="lokalna baza zamiast mongomock")
+    parser.add_argument("--xlsx-engine", default="openpyxl", help="silnik odczytu arkusza (openpyxl, stream)")
+    parser.add_argument("--reader", default=None, help="silnik SpreadsheetReader (openpyxl, calamine, stream)")
+    parser.add_argument("--fixture", action="append", help="uruchom tylko wskazane arkusze")
+    parser.add_argument("--no-synthetic", action="store_true", help="pomiń syntetyczne arkusze")
+    parser.add_argument("--baseline", help="plik z wynikami referencyjnymi do porównania")
+    parser.add_argument("--save-baseline", help="zapisz wyniki jako referencyjne")
+    parser.add_argument("--tolerance", type=float, default=0.3, help="dopuszczalny względny wzrost")
+    parser.add_argument("--min-time-delta", type=float, default=0.005, help="dopuszczalny bezwzględny wzrost czasu [s]")
+    parser.add_argument("--output", help="zapisz raport również do pliku")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    os.environ.setdefault("SAVE_TO_FILE", "false")
+    os.environ.setdefault("SENTRY_DSN", "")
+    use_mongo(args.mongo_uri)
+
+    fixtures_directory = tempfile.mkdtemp(prefix="lesson_plan_fixtures_")
+    try:
+        fixtures = load_fixtures(fixtures_directory, include_synthetic=not args.no_synthetic)
+        if args.fixture:
+            fixtures = [fixture for fixture in fixtures if fixture.name in args.fixture]
+        summary = run_benchmarks(
+            fixtures, args.repeat, args.whatnow_requests, args.xlsx_engine, args.reader
+        )
+    finally:
+        shutil.rmtree(fixtures_directory, ignore_errors=True)
+
+    print_report(summary)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            print_report(summary, output=f)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+        print(f"\nBaseline saved to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = find_regressions(summary, baseline, args.tolerance, args.min_time_delta)
+        if regressions:
+            print("\nPerformance regressions:")
+            for regression in regressions:
+                print(f"- {regression}")
+            return 1
+        print("\nNo performance regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
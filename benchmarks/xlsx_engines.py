@@ -0,0 +1,112 @@
+"""Porównanie silników odczytu arkusza w unmerge_and_fill_data (openpyxl i stream).
+
+Każdy pomiar wykonywany jest w osobnym procesie, aby szczytowe RSS
+(ru_maxrss) dotyczyło tylko jednego silnika i jednego arkusza.
+
+    python -m benchmarks.xlsx_engines --repeat 5
+"""
+import argparse
+import multiprocessing
+import os
+import queue
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIRECTORY not in sys.path:
+    sys.path.insert(0, ROOT_DIRECTORY)
+
+from benchmarks.fixtures import load_fixtures  # noqa: E402
+
+ENGINES = ("openpyxl", "stream")
+MEASURE_TIMEOUT = 600
+
+
+def max_rss_kib():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS zwraca bajty, Linux kilobajty
+    return rss // 1024 if sys.platform == "darwin" else rss
+
+
+def measure_engine(fixture_path, plan_config, engine, results):
+    # Komunikaty LessonPlan zaśmiecałyby tabelę wyników
+    sys.stdout = open(os.devnull, "w")
+    os.environ["SAVE_TO_MONGODB"] = "false"
+    from LessonPlan import LessonPlan
+
+    lesson_plan = LessonPlan(
+        username="benchmark",
+        password="benchmark",
+        mongo_uri=None,
+        plan_config=dict(plan_config, xlsx_engine=engine),
+    )
+    lesson_plan.start_run()
+    try:
+        lesson_plan.file_save_path = os.path.join(lesson_plan.run_directory, "downloaded_file.xlsx")
+        shutil.copyfile(fixture_path, lesson_plan.file_save_path)
+        rss_before = max_rss_kib()
+        start = time.perf_counter()
+        lesson_plan.unmerge_and_fill_data()
+        results.put((time.perf_counter() - start, max_rss_kib() - rss_before))
+    finally:
+        lesson_plan.cleanup_run()
+
+
+def run_isolated(fixture, engine, timeout=MEASURE_TIMEOUT):
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(
+        target=measure_engine, args=(fixture.path, fixture.plan_config, engine, results)
+    )
+    process.start()
+    # Proces zabity np. przez OOM killer nie odda wyniku - nie czekamy na niego w nieskończoność
+    deadline = time.monotonic() + timeout
+    try:
+        while True:
+            try:
+                elapsed, rss_growth = results.get(timeout=1)
+                break
+            except queue.Empty:
+                if not process.is_alive() and results.empty():
+                    raise RuntimeError(f"proces pomiaru zakończył się z kodem {process.exitcode}")
+                if time.monotonic() >= deadline:
+                    raise RuntimeError(f"pomiar przekroczył {timeout} s")
+    finally:
+        if process.is_alive() and time.monotonic() >= deadline:
+            process.kill()
+        process.join()
+    return elapsed, rss_growth
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Porównanie silników odczytu XLSX")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--no-synthetic", action="store_true")
+    parser.add_argument("--timeout", type=float, default=MEASURE_TIMEOUT, help="limit jednego pomiaru [s]")
+    args = parser.parse_args(argv)
+
+    fixtures_directory = tempfile.mkdtemp(prefix="lesson_plan_fixtures_")
+    try:
+        fixtures = load_fixtures(fixtures_directory, include_synthetic=not args.no_synthetic)
+        print(f"\n{'fixture':<24} {'engine':<10} {'time [ms]':>10} {'peak RSS growth [KiB]':>22}")
+        for fixture in fixtures:
+            for engine in ENGINES:
+                try:
+                    samples = [run_isolated(fixture, engine, args.timeout) for _ in range(args.repeat)]
+                except RuntimeError as e:
+                    print(f"{fixture.name:<24} {engine:<10} {'błąd: ' + str(e)}")
+                    continue
+                elapsed = statistics.median(sample[0] for sample in samples)
+                rss_growth = max(sample[1] for sample in samples)
+                print(f"{fixture.name:<24} {engine:<10} {elapsed * 1000:>10.1f} {rss_growth:>22}")
+    finally:
+        shutil.rmtree(fixtures_directory, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
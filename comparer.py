@@ -1,8 +1,20 @@
 from colorama import init, Fore, Style
 init(autoreset=True)  
+import asyncio
+import aiohttp
 import requests
 from datetime import datetime
 from pymongo import MongoClient
+import sentry_sdk
+from metrics import track_stage
+from PlanHistory import PlanHistory
+from RateLimiter import (
+    PRIORITY_COMPARE,
+    BudgetExceeded,
+    estimate_tokens,
+    openrouter_limiter,
+    usage_tokens,
+)
 
 class LessonPlanComparator:
     def __init__(self, mongo_uri, openrouter_api_key, selected_model):
@@ -12,13 +24,20 @@ class LessonPlanComparator:
         self.openrouter_api_url = "https://openrouter.ai/api/v1/chat/completions"
         self.selected_model = selected_model
 
-    def get_last_two_plans(self, plan_name):
+    def get_last_two_plans(self, plan_name, checksum=None):
         collection_name = f"plans_{plan_name.lower().replace(' ', '_').replace('-', '_')}"
         print(f"\n{Fore.CYAN}Debugowanie get_last_two_plans:{Style.RESET_ALL}")
         print(f"- Szukam planów w kolekcji: {collection_name}")
+
+        if checksum is not None:
+            # Ponowione zadanie porównuje wersję, dla której je utworzono, nawet gdy jest już nowsza
+            newer_plan, older_plan = PlanHistory(self.db, collection_name).get_version_and_previous(checksum)
+            if newer_plan is None:
+                print(f"{Fore.YELLOW}Nie znaleziono wersji {checksum} i wersji poprzedniej w kolekcji {collection_name}.{Style.RESET_ALL}")
+            return newer_plan, older_plan
         
-        collection = self.db[collection_name]
-        plans = list(collection.find().sort("timestamp", -1).limit(2))
+        # Najnowsza wersja jest pełna, poprzednia to zwykle tylko delta względem niej
+        plans = PlanHistory(self.db, collection_name).get_latest_versions(2)
         
         print(f"- Znaleziono planów: {len(plans)}")
         if plans:
@@ -32,7 +51,7 @@ class LessonPlanComparator:
             return None, None
             
         # Upewnij się, że plans[0] to najnowszy plan, a plans[1] to poprzedni
-        return plans[0], plans[1]  # plans[0] jest najnowszy dzięki sort("timestamp", -1)
+        return plans[0], plans[1]  # plans[0] jest najnowszy dzięki sortowaniu po wersji
 
     def format_plan_for_group(self, plan, group):
         if group not in plan['groups']:
@@ -40,7 +59,8 @@ class LessonPlanComparator:
         html_content = plan['groups'][group]
         return f"Plan z dnia {plan['timestamp']} dla grupy {group}:\n{html_content}\n\n"
 
-    def compare_plans_for_group(self, plan1, plan2, group):
+    def build_compare_request(self, plan1, plan2, group):
+        """Zwraca (nagłówki, treść) zapytania do OpenRouter porównującego plany grupy"""
         formatted_plan1 = self.format_plan_for_group(plan1, group)
         formatted_plan2 = self.format_plan_for_group(plan2, group)
 
@@ -72,12 +92,56 @@ class LessonPlanComparator:
                 {"role": "user", "content": prompt}
             ]
         }
+        return headers, data
+
+    def compare_plans_for_group(self, plan1, plan2, group, raise_errors=False):
+        """Wynik porównania grupy; błąd zapytania zamienia na komunikat, chyba że raise_errors"""
+        headers, data = self.build_compare_request(plan1, plan2, group)
+        estimated_tokens = estimate_tokens(data)
 
         try:
+            openrouter_limiter.acquire(estimated_tokens, PRIORITY_COMPARE)
             response = requests.post(self.openrouter_api_url, headers=headers, json=data)
+            if response.status_code == 429:
+                openrouter_limiter.record_rate_limited(response.headers.get("Retry-After"))
             response.raise_for_status()
-            return response.json()['choices'][0]['message']['content'].strip()
+            result = response.json()
+            openrouter_limiter.record_usage(estimated_tokens, usage_tokens(result))
+            return result['choices'][0]['message']['content'].strip()
+        except BudgetExceeded as e:
+            print(f"{Fore.RED}Pominięto porównanie dla grupy {group}: {e}{Style.RESET_ALL}")
+            if raise_errors:
+                raise
+            return f"Nie porównano planów dla grupy {group} - wyczerpany budżet zapytań w tym cyklu."
         except requests.exceptions.RequestException as e:
+            print(f"{Fore.RED}Błąd API dla grupy {group}: {e}{Style.RESET_ALL}")
+            if raise_errors:
+                raise
+            return f"Nie udało się porównać planów dla grupy {group} z powodu błędu API."
+        except (KeyError, IndexError) as e:
+            print(f"Błąd w przetwarzaniu odpowiedzi API dla grupy {group}: {e}")
+            if raise_errors:
+                raise
+            return f"Wystąpił problem z przetwarzaniem odpowiedzi dla grupy {group}."
+
+    async def compare_plans_for_group_async(self, http, plan1, plan2, group):
+        """Jak compare_plans_for_group, przez współdzieloną sesję aiohttp"""
+        headers, data = self.build_compare_request(plan1, plan2, group)
+        estimated_tokens = estimate_tokens(data)
+
+        try:
+            await openrouter_limiter.acquire_async(estimated_tokens, PRIORITY_COMPARE)
+            async with http.post(self.openrouter_api_url, headers=headers, json=data) as response:
+                if response.status == 429:
+                    openrouter_limiter.record_rate_limited(response.headers.get("Retry-After"))
+                response.raise_for_status()
+                result = await response.json()
+            openrouter_limiter.record_usage(estimated_tokens, usage_tokens(result))
+            return result['choices'][0]['message']['content'].strip()
+        except BudgetExceeded as e:
+            print(f"{Fore.RED}Pominięto porównanie dla grupy {group}: {e}{Style.RESET_ALL}")
+            return f"Nie porównano planów dla grupy {group} - wyczerpany budżet zapytań w tym cyklu."
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
             print(f"{Fore.RED}Błąd API dla grupy {group}: {e}{Style.RESET_ALL}")
             return f"Nie udało się porównać planów dla grupy {group} z powodu błędu API."
         except (KeyError, IndexError) as e:
@@ -102,8 +166,10 @@ class LessonPlanComparator:
         print(f"Wyniki porównania dla {newer_plan['plan_name']} zapisane w bazie danych z ID: {result.inserted_id}")
         return result.inserted_id
 
-    def compare_plans(self, collection_name):
-        newer_plan, older_plan = self.get_last_two_plans(collection_name)
+    def compare_plans(self, collection_name, checksum=None, raise_errors=False):
+        """Porównuje dwie wersje planu; z raise_errors błąd dowolnej grupy przerywa porównanie wyjątkiem"""
+        with sentry_sdk.start_span(op="db.query", name=f"get_last_two_plans {collection_name}"):
+            newer_plan, older_plan = self.get_last_two_plans(collection_name, checksum)
         if not newer_plan or not older_plan:
             return f"Nie można porównać planów w kolekcji {collection_name} - brak wystarczającej liczby planów."
 
@@ -113,11 +179,43 @@ class LessonPlanComparator:
         all_groups = set(newer_plan['groups'].keys()) | set(older_plan['groups'].keys())
 
         comparison_results = {}
-        for group in all_groups:
-            print(f"Porównywanie planów dla grupy {group}...")
-            comparison_results[group] = self.compare_plans_for_group(newer_plan, older_plan, group)
+        with track_stage(newer_plan['plan_name'], "llm_compare"):
+            for group in all_groups:
+                print(f"Porównywanie planów dla grupy {group}...")
+                with sentry_sdk.start_span(op="llm.compare_group", name=group):
+                    comparison_results[group] = self.compare_plans_for_group(
+                        newer_plan, older_plan, group, raise_errors
+                    )
+
+        return self.report_comparison(newer_plan, older_plan, comparison_results)
+
+    async def compare_plans_async(self, http, collection_name):
+        """Jak compare_plans, ale grupy są porównywane równolegle przez sesję aiohttp"""
+        newer_plan, older_plan = await asyncio.to_thread(self.get_last_two_plans, collection_name)
+        if not newer_plan or not older_plan:
+            return f"Nie można porównać planów w kolekcji {collection_name} - brak wystarczającej liczby planów."
+
+        print(f"Używany model: {self.selected_model}")
+        print(f"Porównywanie planów z dat: Nowszy {newer_plan['timestamp']}, Starszy {older_plan['timestamp']}")
 
-        comparison_id = self.save_comparison_results(newer_plan, older_plan, comparison_results)
+        all_groups = sorted(set(newer_plan['groups'].keys()) | set(older_plan['groups'].keys()))
+        with track_stage(newer_plan['plan_name'], "llm_compare"):
+            results = await asyncio.gather(
+                *(
+                    self.compare_plans_for_group_async(http, newer_plan, older_plan, group)
+                    for group in all_groups
+                )
+            )
+        comparison_results = dict(zip(all_groups, results))
+
+        return await asyncio.to_thread(
+            self.report_comparison, newer_plan, older_plan, comparison_results
+        )
+
+    def report_comparison(self, newer_plan, older_plan, comparison_results):
+        """Zapisuje wyniki porównania w bazie i pliku, zwraca tekst z grupami, w których są różnice"""
+        with sentry_sdk.start_span(op="db.insert", name="save_comparison_results"):
+            comparison_id = self.save_comparison_results(newer_plan, older_plan, comparison_results)
 
         # Filtrowanie i formatowanie wyników
         filtered_output = f"Porównanie planów:\nNowszy z {newer_plan['timestamp']}\nStarszy z {older_plan['timestamp']}\nUżywany model: {self.selected_model}\nID porównania w bazie: {comparison_id}\n\n"
@@ -0,0 +1,23 @@
+import os
+
+# Konfiguracja gunicorna dla API (SERVER_MODE=wsgi lub osobny kontener z API).
+# Workery API to osobne procesy czytające plany z MongoDB - nie dzielą GIL
+# z przetwarzaniem planów w procesie sprawdzającym.
+bind = os.getenv("API_BIND", "0.0.0.0:80")
+workers = int(os.getenv("API_WORKERS", "4"))
+# gthread: strumień /api/events zajmuje jeden wątek, a nie cały proces; timeout
+# dotyczy wtedy tylko zawieszonego procesu, nie długości zapytania
+worker_class = os.getenv("API_WORKER_CLASS", "gthread")
+threads = int(os.getenv("API_THREADS", "32"))
+timeout = int(os.getenv("API_TIMEOUT", "30"))
+max_requests = int(os.getenv("API_MAX_REQUESTS", "1000"))
+max_requests_jitter = int(os.getenv("API_MAX_REQUESTS_JITTER", "100"))
+accesslog = "-"
+
+
+def child_exit(server, worker):
+    """Usuwa wartości bieżących wskaźników (np. połączeń SSE) zakończonego workera"""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)
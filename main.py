@@ -1,30 +1,91 @@
 import time
-from datetime import datetime, timedelta
-from LessonPlan import LessonPlan
-from comparer import LessonPlanComparator
-from ActivityDownloader import WebpageDownloader
-from MoodleParserComponent import MoodleFileParser
-import os, requests, json, hashlib
+from datetime import datetime
+from Timetable import (
+    GroupLessonsCache,
+    TimetableStore,
+    build_days,
+    build_group_index,
+    get_group_names,
+    get_plan_collection_name,
+    resolve_day,
+    resolve_group,
+    slugify,
+)
+from PlanHistory import PlanHistory
+from TimetableExport import ExportStore
+from PlanWorker import PlanWorker
+from PlansConfig import PlansConfig
+from MoodleCourses import (
+    MOODLE_WORKERS,
+    activities_fingerprint,
+    course_unchanged,
+    get_moodle_courses,
+    save_course_fingerprint,
+)
+from Profiling import PROFILING_COLLECTION, ProfileSession, profile_check, profiling
+from PlanEvents import MongoEventWatcher, get_events_after, plan_event_broker
+from metrics import (
+    API_ERRORS,
+    CACHE_HITS,
+    CHANGES_DETECTED,
+    SSE_CONNECTIONS,
+    render_metrics,
+    track_stage,
+)
+import os, json, hashlib
 from dotenv import load_dotenv
-from pymongo import MongoClient
+from bson import ObjectId
+from bson.errors import InvalidId
 import traceback
-from flask import Flask, jsonify, request, Response
+from flask import Flask, g, jsonify, request, Response
 import threading
+import queue
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+from contextlib import nullcontext
+import subprocess
+import sys
 import pytz
-import pandas as pd
-from bs4 import BeautifulSoup
 import sentry_sdk
+# Moduły sprawdzania planów (pandas, openpyxl, requests, aiohttp, lxml) są
+# importowane dopiero w main() i metodach LessonPlanManager, a MongoClient
+# tworzy get_db() przy pierwszym użyciu - procesy API startują bez nich
 load_dotenv()
-sentry_sdk.init(
-    dsn=os.getenv("SENTRY_DSN"),
-    # Set traces_sample_rate to 1.0 to capture 100%
-    # of transactions for tracing.
-    traces_sample_rate=1.0,
-    # Set profiles_sample_rate to 1.0 to profile 100%
-    # of sampled transactions.
-    # We recommend adjusting this value in production.
-    profiles_sample_rate=1.0,
-)
+
+# Próbkowanie Sentry: cykle sprawdzania są rzadkie i warto je śledzić w całości,
+# zapytania API są częste, więc domyślnie próbkujemy tylko ich niewielką część
+SENTRY_CHECK_TRACES_SAMPLE_RATE = float(os.getenv("SENTRY_CHECK_TRACES_SAMPLE_RATE", "1.0"))
+SENTRY_API_TRACES_SAMPLE_RATE = float(os.getenv("SENTRY_API_TRACES_SAMPLE_RATE", "0.05"))
+SENTRY_TRACES_SAMPLE_RATE = float(os.getenv("SENTRY_TRACES_SAMPLE_RATE", "0.1"))
+SENTRY_PROFILES_SAMPLE_RATE = float(os.getenv("SENTRY_PROFILES_SAMPLE_RATE", "0.0"))
+# Endpointy technicznie odpytywane (healthchecki, Prometheus) nie są śledzone
+SENTRY_IGNORED_PATHS = ("/status", "/metrics", "/api/events")
+
+
+def sentry_traces_sampler(sampling_context):
+    """Dobiera częstość próbkowania osobno dla zapytań API i cykli sprawdzania"""
+    if sampling_context.get("parent_sampled") is not None:
+        return sampling_context["parent_sampled"]
+
+    environ = sampling_context.get("wsgi_environ")
+    if environ is not None:
+        if environ.get("PATH_INFO", "") in SENTRY_IGNORED_PATHS:
+            return 0.0
+        return SENTRY_API_TRACES_SAMPLE_RATE
+
+    transaction_context = sampling_context.get("transaction_context") or {}
+    if transaction_context.get("op") == "check_cycle":
+        return SENTRY_CHECK_TRACES_SAMPLE_RATE
+    return SENTRY_TRACES_SAMPLE_RATE
+
+
+# Bez SENTRY_DSN pomijamy init - automatyczne integracje importują m.in. aiohttp
+if os.getenv("SENTRY_DSN"):
+    sentry_sdk.init(
+        dsn=os.getenv("SENTRY_DSN"),
+        traces_sampler=sentry_traces_sampler,
+        profiles_sample_rate=SENTRY_PROFILES_SAMPLE_RATE,
+    )
 
 app = Flask(__name__)
 
@@ -33,25 +94,127 @@ app = Flask(__name__)
 USE_TEST_TIME = False
 TEST_TIME = None
 mongo_uri = os.getenv("MONGO_URI")
-client = MongoClient(mongo_uri)
-db = client.Lesson
+client = None
+db = None
+db_lock = threading.Lock()
+
+# Tryb serwowania API:
+# - "embedded" - serwer deweloperski Flask w wątku procesu sprawdzającego (domyślnie)
+# - "wsgi"     - main.py uruchamia gunicorn (osobne procesy) i sam tylko sprawdza plany
+# - "checker"  - tylko sprawdzanie planów, API uruchamiane osobno (gunicorn wsgi:app)
+SERVER_MODES = ("embedded", "wsgi", "checker")
+SERVER_MODE = os.getenv("SERVER_MODE", "embedded").lower()
+
+# Odpowiedzi API są ważne do końca bieżącego przedziału czasu (ETag/Cache-Control)
+API_CACHE_SECONDS = int(os.getenv("API_CACHE_SECONDS", "60"))
+# Izolacja przetwarzania planów: "none" (w procesie sprawdzającym) lub "process"
+PLAN_ISOLATION = os.getenv("PLAN_ISOLATION", "none").lower()
+# Plan obsługiwany przez /api/whatnow/<numer grupy>
+WHATNOW_PLAN_ID = "informatyka2"
+
+
+def get_db():
+    """Baza Lesson; połączenie z MongoDB jest tworzone przy pierwszym użyciu"""
+    global client, db
+    if db is None:
+        with db_lock:
+            if db is None:
+                from pymongo import MongoClient
+
+                client = MongoClient(mongo_uri)
+                db = client.Lesson
+    return db
+
+
+# plans.json w pamięci, przeładowywany po zmianie pliku (API przy zapytaniach, checker między cyklami)
+plans_config = PlansConfig()
+timetables = None
+exports = None
+stores_lock = threading.Lock()
+group_lessons = GroupLessonsCache()
+plan_histories = {}
+
+# Strumień /api/events: komentarz co SSE_KEEPALIVE_SECONDS utrzymuje połączenie przez proxy
+SSE_KEEPALIVE_SECONDS = int(os.getenv("SSE_KEEPALIVE_SECONDS", "15"))
+SSE_RETRY_MILLISECONDS = int(os.getenv("SSE_RETRY_MILLISECONDS", "10000"))
+# Każdy strumień zajmuje wątek workera gthread do końca połączenia - limit strumieni
+# na proces zostawia SSE_RESERVED_THREADS wątków dla zwykłych zapytań (/api/whatnow, /status)
+SSE_RESERVED_THREADS = int(os.getenv("SSE_RESERVED_THREADS", "8"))
+SSE_MAX_STREAMS = int(
+    os.getenv("SSE_MAX_STREAMS", str(max(int(os.getenv("API_THREADS", "32")) - SSE_RESERVED_THREADS, 1)))
+)
+sse_stream_slots = threading.BoundedSemaphore(SSE_MAX_STREAMS)
+event_watcher = None
+event_watcher_lock = threading.Lock()
+# Eksporty zmieniają się tylko z nową wersją planu
+EXPORT_CACHE_SECONDS = int(os.getenv("EXPORT_CACHE_SECONDS", "3600"))
+
+
+def get_timetables():
+    global timetables
+    if timetables is None:
+        with stores_lock:
+            if timetables is None:
+                timetables = TimetableStore(get_db(), plans_config)
+    return timetables
+
+
+def forget_plan_caches(added, removed, changed):
+    """Po przeładowaniu plans.json usuwa z pamięci dane usuniętych i zmienionych planów"""
+    for plan_id in removed | changed:
+        plan_histories.pop(plan_id, None)
+        if timetables is not None:
+            timetables.forget(plan_id)
+
+
+plans_config.on_change(forget_plan_caches)
+
+
+def get_exports():
+    global exports
+    if exports is None:
+        timetable_store = get_timetables()
+        with stores_lock:
+            if exports is None:
+                exports = ExportStore(get_db(), plans_config, timetable_store)
+    return exports
 
 
 class StatusChecker:
-    def __init__(self):
+    def __init__(self, shared=False):
         self.last_activity = time.time()
+        # W trybach wieloprocesowych stan sprawdzania trzymamy w MongoDB,
+        # aby /status w procesach API widział aktywność procesu sprawdzającego
+        self.shared = shared
 
     def update_activity(self):
         self.last_activity = time.time()
+        if self.shared:
+            try:
+                get_db().checker_status.update_one(
+                    {"_id": "checker"},
+                    {"$set": {"last_activity": self.last_activity}},
+                    upsert=True,
+                )
+            except Exception as e:
+                print(f"Error saving checker status: {str(e)}")
 
     def is_active(self):
         return True
 
     def get_last_activity_datetime(self):
-        return datetime.fromtimestamp(self.last_activity).isoformat()
+        last_activity = self.last_activity
+        if self.shared:
+            try:
+                status_doc = get_db().checker_status.find_one({"_id": "checker"})
+                if status_doc:
+                    last_activity = status_doc["last_activity"]
+            except Exception as e:
+                print(f"Error reading checker status: {str(e)}")
+        return datetime.fromtimestamp(last_activity).isoformat()
 
 
-status_checker = StatusChecker()
+status_checker = StatusChecker(shared=SERVER_MODE != "embedded")
 
 
 @app.route("/status")
@@ -64,10 +227,76 @@ def status():
         return jsonify({"status": "inactive", "last_check": last_check}), 503
 
 
+@app.route("/metrics")
+def metrics():
+    data, content_type = render_metrics()
+    return Response(data, content_type=content_type)
+
+
+# Strumienie i endpointy techniczne nie są profilowane
+PROFILE_IGNORED_PATHS = ("/status", "/metrics", "/api/events", "/api/profile")
+
+
+@app.before_request
+def reload_plans_config():
+    plans_config.reload_if_changed()
+
+
+@app.before_request
+def start_request_profile():
+    if request.path not in PROFILE_IGNORED_PATHS and profiling.claim_request():
+        g.profile_session = ProfileSession(
+            f"api_{request.endpoint or 'unknown'}", thread_ids=[threading.get_ident()]
+        ).start()
+
+
+@app.teardown_request
+def stop_request_profile(exception=None):
+    session = g.pop("profile_session", None)
+    if session is not None:
+        session.stop()
+
+
+@app.after_request
+def count_api_errors(response):
+    if response.status_code >= 400:
+        API_ERRORS.labels(
+            endpoint=request.url_rule.rule if request.url_rule else "unknown",
+            status=str(response.status_code),
+        ).inc()
+    return response
+
+
 def run_flask_app():
     app.run(host="0.0.0.0", port=80)
 
 
+def start_wsgi_server():
+    """Uruchamia API pod gunicornem jako osobne procesy (konfiguracja w gunicorn.conf.py)"""
+    command = [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "wsgi:app"]
+    print(f"Starting WSGI server: {' '.join(command)}")
+    return subprocess.Popen(command)
+
+
+def start_api_server():
+    """Uruchamia API zgodnie z SERVER_MODE, zwraca proces gunicorna (tryb wsgi) lub None"""
+    if SERVER_MODE not in SERVER_MODES:
+        raise ValueError(
+            f"Invalid SERVER_MODE: {SERVER_MODE} (expected one of: {', '.join(SERVER_MODES)})"
+        )
+
+    if SERVER_MODE == "embedded":
+        flask_thread = threading.Thread(target=run_flask_app)
+        flask_thread.daemon = True
+        flask_thread.start()
+        return None
+    if SERVER_MODE == "wsgi":
+        return start_wsgi_server()
+
+    print("SERVER_MODE=checker - API is served by a separate process")
+    return None
+
+
 class LessonPlanManager:
     def __init__(
         self,
@@ -82,35 +311,26 @@ class LessonPlanManager:
         self.plan_name = lesson_plan.plan_config["name"]
         self.check_interval = check_interval
         self.working_directory = working_directory
-        self.initial_file_structure = set()
         self.discord_webhook_url = discord_webhook_url
         self.status_checker = status_checker
         self.cached_plans = {}
-
-    def get_file_structure(self):
-        file_structure = set()
-        for root, dirs, files in os.walk(self.working_directory):
-            if "__pycache__" in dirs:
-                dirs.remove("__pycache__")
-            for file in files:
-                file_structure.add(os.path.join(root, file))
-        return file_structure
+        self.history_prepared = False
+        # PLAN_ISOLATION=process: skoroszyt przetwarza proces roboczy z limitem pamięci i czasu
+        self.plan_worker = PlanWorker(self.plan_name) if PLAN_ISOLATION == "process" else None
+
+    def close(self):
+        """Zwalnia proces roboczy i połączenia planu (zamknięcie lub zmiana w plans.json)"""
+        if self.plan_worker is not None:
+            self.plan_worker.terminate()
+        mongo_client = getattr(self.lesson_plan, "mongo_client", None)
+        if mongo_client is not None:
+            mongo_client.close()
+        if self.lesson_plan_comparator is not None:
+            self.lesson_plan_comparator.client.close()
 
     def clean_new_files(self):
-        current_structure = self.get_file_structure()
-        new_files = current_structure - self.initial_file_structure
-        for file in new_files:
-            if (
-                file.endswith(".xlsx")
-                and not file.startswith(".git")
-                and not file.endswith(".py")
-                and not file.endswith(".env")
-            ):
-                try:
-                    os.remove(file)
-                    print(f"Usunięto plik: {file}")
-                except Exception as e:
-                    print(f"Błąd podczas usuwania pliku {file}: {str(e)}")
+        """Usuwa pliki tymczasowe ostatniego przebiegu planu"""
+        self.lesson_plan.cleanup_run()
 
     def should_send_webhook(self):
         """Sprawdza czy należy wysyłać powiadomienia webhook dla tego planu"""
@@ -118,18 +338,18 @@ class LessonPlanManager:
         # Domyślnie notify i compare są False
         return plan_config.get('notify', False) or plan_config.get('compare', False)
     
-    def send_discord_webhook(self, message, force_send=False):
+    def build_webhook_payload(self, message, force_send=False):
         """
-        Wysyła webhook jeśli jest skonfigurowany i dozwolony.
+        Treść webhooka albo None, jeśli webhook nie jest skonfigurowany lub dozwolony.
         force_send wymusza wysłanie niezależnie od ustawień notify/compare
         """
         if not self.discord_webhook_url:
-            return
+            return None
 
         if not force_send and not self.should_send_webhook():
-            return
+            return None
 
-        payload = {
+        return {
             "embeds": [
                 {
                     "title": "Aktualizacja Planu Lekcji",
@@ -139,6 +359,14 @@ class LessonPlanManager:
                 }
             ]
         }
+
+    def send_discord_webhook(self, message, force_send=False):
+        """Wysyła webhook jeśli jest skonfigurowany i dozwolony; zwraca True/False, None gdy pominięty"""
+        import requests
+
+        payload = self.build_webhook_payload(message, force_send)
+        if payload is None:
+            return None
         try:
             response = requests.post(
                 self.discord_webhook_url,
@@ -147,9 +375,24 @@ class LessonPlanManager:
             )
             response.raise_for_status()
             print("Webhook Discord wysłany pomyślnie")
+            return True
         except requests.exceptions.RequestException as e:
             print(f"Błąd podczas wysyłania webhooka Discord: {str(e)}")
+            return False
 
+    async def send_discord_webhook_async(self, http, message, force_send=False):
+        """Jak send_discord_webhook, przez współdzieloną sesję aiohttp"""
+        import aiohttp
+
+        payload = self.build_webhook_payload(message, force_send)
+        if payload is None:
+            return
+        try:
+            async with http.post(self.discord_webhook_url, json=payload) as response:
+                response.raise_for_status()
+            print("Webhook Discord wysłany pomyślnie")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"Błąd podczas wysyłania webhooka Discord: {str(e)}")
 
     def update_cached_plans(self):
         latest_plan = get_latest_lesson_plan()
@@ -158,74 +401,155 @@ class LessonPlanManager:
                 self.cached_plans[group] = parse_html_to_dataframe(html_content)
         print("Zaktualizowano pamięć podręczną planów lekcji.")
 
-    def check_once(self):
+    def check_once(self, download_cache=None):
         """Wykonuje pojedynczy cykl sprawdzania planu"""
+        with profile_check(f"check_{slugify(self.plan_name)}"), sentry_sdk.start_transaction(
+            op="check_cycle", name=f"check_once {self.plan_name}"
+        ):
+            self._check_once(download_cache)
+
+    def is_night_time(self):
         current_time = datetime.now()
         current_hour = current_time.hour
 
         # Skip checks between 21:00 and 06:00
         if os.getenv("DEV", "false").lower() == "true":
             print("Dev mode is enabled. Skipping time check.")
-            is_night_time = False
-        else:
-            is_night_time = current_hour >= 21 or current_hour < 6
-        if is_night_time:
+            return False
+        if current_hour >= 21 or current_hour < 6:
             print(
                 f"Skipping check at {current_time.strftime('%Y-%m-%d %H:%M:%S')} - night hours (21:00-06:00)"
             )
+            return True
+        return False
+
+    def prepare_history(self):
+        """Migracja i kompaktowanie historii planu - tylko w procesie sprawdzającym, nie w odczytach API"""
+        if self.history_prepared or not self.lesson_plan.save_to_mongodb:
+            return
+        try:
+            PlanHistory(
+                self.lesson_plan.db, get_plan_collection_name(self.lesson_plan.plan_config)
+            ).prepare()
+            self.history_prepared = True
+        except Exception as e:
+            print(f"Błąd podczas przygotowania historii planu {self.plan_name}: {str(e)}")
+
+    def process_plan(self, download_cache=None):
+        """Pobiera i zapisuje plan; zwraca sumę kontrolną nowej wersji, False bez zmian, None przy błędzie"""
+        print(
+            f"\n--- Starting new check for {self.plan_name} at {datetime.now()} ---"
+        )
+        self.status_checker.update_activity()
+        # Przed pierwszym sprawdzeniem - przy PLAN_LEASES tylko replika z dzierżawą planu
+        self.prepare_history()
+        if self.plan_worker is not None:
+            new_checksum = self.plan_worker.run(self.lesson_plan, mongo_uri, download_cache)
+        else:
+            try:
+                new_checksum = self.lesson_plan.process_and_save_plan(download_cache)
+            except MemoryError:
+                print(f"Za mało pamięci podczas przetwarzania planu {self.plan_name}")
+                new_checksum = None
+
+        if new_checksum is None:
+            print("Wystąpił błąd podczas sprawdzania planu.")
+        elif new_checksum:
+            print("Plan został zaktualizowany")
+            CHANGES_DETECTED.labels(plan=self.plan_name).inc()
+        else:
+            print("Nie wykryto zmian w planie.")
+        return new_checksum
+
+    def should_compare(self):
+        # Check if plan has comparison enabled and comparator is available
+        return self.lesson_plan.plan_config.get('compare', False) and self.lesson_plan_comparator is not None
+
+    def get_comparison_collection_name(self):
+        return self.plan_name.lower().replace(" ", "_").replace("-", "_")
+
+    def _check_once(self, download_cache=None):
+        if self.is_night_time():
             return
 
         try:
-            print(
-                f"\n--- Starting new check for {self.plan_name} at {datetime.now()} ---"
-            )
-            self.status_checker.update_activity()
-            new_checksum = self.lesson_plan.process_and_save_plan()
+            new_checksum = self.process_plan(download_cache)
+            if new_checksum:
+                if self.should_compare():
+                    try:
+                        print("Comparing plans...")
+                        comparison_result = self.lesson_plan_comparator.compare_plans(
+                            self.get_comparison_collection_name()
+                        )
+                        if comparison_result:
+                            webhook_message = f"Zmiany w planie dla: {self.plan_name}\n\n{comparison_result}"
+                            self.send_discord_webhook(webhook_message, force_send=True)
+                            print("Wykryto i zapisano zmiany w planie.")
+                    except Exception as e:
+                        print(f"Error during plan comparison: {e}")
+                        # Fall back to simple notification if comparison fails
+                        if self.lesson_plan.plan_config.get('notify', False):
+                            webhook_message = f"Plan zajęć został zaktualizowany dla: {self.plan_name}"
+                            self.send_discord_webhook(webhook_message)
+                elif self.lesson_plan.plan_config.get('notify', False):
+                    # If not comparing but notify is true
+                    webhook_message = f"Plan zajęć został zaktualizowany dla: {self.plan_name}"
+                    self.send_discord_webhook(webhook_message)
+                    print("Wykryto i zapisano zmiany w planie.")
+                self.update_cached_plans()
+                print("Zaktualizowano pamięć podręczną planów.")
 
-            if new_checksum is None:
-                print("Wystąpił błąd podczas sprawdzania planu.")
-            else:
-                if new_checksum:
-                    print("Plan został zaktualizowany")
-                    
-                    # Sprawdź czy plan ma włączone porównywanie
-                    # Check if plan has comparison enabled and comparator is available
-                    should_compare = self.lesson_plan.plan_config.get('compare', False) and self.lesson_plan_comparator is not None
+        except Exception as e:
+            print(f"\nWystąpił błąd podczas sprawdzania {self.plan_name}: {str(e)}")
+            raise
+        finally:
+            self.clean_new_files()
 
-                    if should_compare:
+    async def check_once_async(self, http, executor, download_cache=None):
+        """Cykl sprawdzania w trybie CHECK_MODE=async: przetwarzanie pliku w executorze,
+        porównanie grup i webhook przez współdzieloną sesję aiohttp"""
+        # Profil obejmuje pętlę zdarzeń i wątki executora (check_*)
+        with profile_check(
+            f"check_{slugify(self.plan_name)}", thread_prefix="check"
+        ), sentry_sdk.start_transaction(
+            op="check_cycle", name=f"check_once {self.plan_name}"
+        ):
+            if self.is_night_time():
+                return
+
+            loop = asyncio.get_running_loop()
+            try:
+                new_checksum = await loop.run_in_executor(
+                    executor, self.process_plan, download_cache
+                )
+                if new_checksum:
+                    if self.should_compare():
                         try:
                             print("Comparing plans...")
-                            collection_name = (
-                                self.plan_name.lower().replace(" ", "_").replace("-", "_")
-                            )
-                            comparison_result = self.lesson_plan_comparator.compare_plans(
-                                collection_name
+                            comparison_result = await self.lesson_plan_comparator.compare_plans_async(
+                                http, self.get_comparison_collection_name()
                             )
                             if comparison_result:
                                 webhook_message = f"Zmiany w planie dla: {self.plan_name}\n\n{comparison_result}"
-                                self.send_discord_webhook(webhook_message, force_send=True)
+                                await self.send_discord_webhook_async(http, webhook_message, force_send=True)
                                 print("Wykryto i zapisano zmiany w planie.")
                         except Exception as e:
                             print(f"Error during plan comparison: {e}")
-                            # Fall back to simple notification if comparison fails
                             if self.lesson_plan.plan_config.get('notify', False):
                                 webhook_message = f"Plan zajęć został zaktualizowany dla: {self.plan_name}"
-                                self.send_discord_webhook(webhook_message)
+                                await self.send_discord_webhook_async(http, webhook_message)
                     elif self.lesson_plan.plan_config.get('notify', False):
-                        # If not comparing but notify is true
                         webhook_message = f"Plan zajęć został zaktualizowany dla: {self.plan_name}"
-                        self.send_discord_webhook(webhook_message)
+                        await self.send_discord_webhook_async(http, webhook_message)
                         print("Wykryto i zapisano zmiany w planie.")
-                    self.update_cached_plans()
+                    await loop.run_in_executor(executor, self.update_cached_plans)
                     print("Zaktualizowano pamięć podręczną planów.")
-                else:
-                    print("Nie wykryto zmian w planie.")
 
-            self.clean_new_files()
-
-        except Exception as e:
-            print(f"\nWystąpił błąd podczas sprawdzania {self.plan_name}: {str(e)}")
-            raise
+            except Exception as e:
+                print(f"\nWystąpił błąd podczas sprawdzania {self.plan_name}: {str(e)}")
+                raise
+            finally:
+                self.clean_new_files()
 
     def start(self):
         """Deprecated - use check_once() instead"""
@@ -237,23 +561,9 @@ lesson_plan_manager = None
 lesson_plan = None
 
 
-def get_group_key(group_number):
-    # Wczytaj konfigurację grup z plans.json
-    with open("plans.json", "r", encoding="utf-8") as f:
-        plans_config = json.load(f)
-
-    # Pobierz grupy dla informatyka2
-    groups = plans_config["informatyka2"]["groups"]
-    group_keys = list(groups.keys())
-
-    if 0 <= group_number < len(group_keys):
-        return group_keys[group_number]
-    return None
-
-
 def get_latest_lesson_plan():
     try:
-        return db.plans.find_one(sort=[("timestamp", -1)])
+        return get_db().plans.find_one(sort=[("timestamp", -1)])
     except Exception as e:
         print(f"Error fetching the latest lesson plan: {str(e)}")
         return None
@@ -291,6 +601,9 @@ def format_time_to_next_lesson(minutes):
 
 
 def parse_html_to_dataframe(html_content):
+    import pandas as pd
+    from bs4 import BeautifulSoup
+
     soup = BeautifulSoup(html_content, "html.parser")
     table = soup.find("table")
     if not table:
@@ -304,110 +617,84 @@ def parse_html_to_dataframe(html_content):
     return pd.DataFrame(data, columns=headers)
 
 
-@app.route("/api/whatnow/<int:group_number>")
-def whatnow(group_number):
-    global USE_TEST_TIME, TEST_TIME
-
+def get_current_time():
+    """Aktualny czas w strefie Europe/Warsaw (lub czas testowy z /api/set_test_time)"""
     poland_tz = pytz.timezone("Europe/Warsaw")
 
     if USE_TEST_TIME and TEST_TIME:
         if isinstance(TEST_TIME, str):
-            now = datetime.strptime(TEST_TIME, "%Y-%m-%d %H:%M:%S").replace(
+            return datetime.strptime(TEST_TIME, "%Y-%m-%d %H:%M:%S").replace(
                 tzinfo=poland_tz
             )
-        else:
-            now = TEST_TIME.replace(tzinfo=poland_tz)
-    else:
-        now = datetime.now(poland_tz)
+        return TEST_TIME.replace(tzinfo=poland_tz)
+    return datetime.now(poland_tz)
+
+
+def make_etag(*parts):
+    etag_source = ":".join(str(part) for part in parts)
+    return hashlib.md5(etag_source.encode("utf-8"), usedforsecurity=False).hexdigest()
+
+
+def time_bucket_etag(checksum, resource, now):
+    """ETag z sumy kontrolnej planu, zasobu i przedziału czasu; zwraca (etag, max_age)"""
+    bucket, elapsed = divmod(int(now.timestamp()), API_CACHE_SECONDS)
+    return make_etag(checksum, resource, bucket), API_CACHE_SECONDS - elapsed
 
-    # Pobierz najnowszy plan z odpowiedniej kolekcji
-    collection = db["plans_informatyka___studia_i_stopnia_st_2"]
-    latest_plan = collection.find_one(sort=[("timestamp", -1)])
 
-    if not latest_plan:
+def set_cache_headers(response, etag, max_age):
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = f"public, max-age={max_age}"
+    return response
+
+
+def conditional_response(etag, max_age, build_response):
+    """Zwraca 304, jeśli klient ma już wersję `etag`, w przeciwnym razie wynik build_response()"""
+    if request.if_none_match.contains(etag):
+        CACHE_HITS.labels(cache="http_etag").inc()
+        return set_cache_headers(Response(status=304), etag, max_age)
+
+    response = app.make_response(build_response())
+    if response.status_code == 200:
+        set_cache_headers(response, etag, max_age)
+    return response
+
+
+@app.route("/api/whatnow/<int:group_number>")
+def whatnow(group_number):
+    now = get_current_time()
+
+    # Do wyznaczenia ETag wystarczy suma kontrolna najnowszego planu
+    latest_version = get_timetables().get_latest_version(WHATNOW_PLAN_ID)
+    if not latest_version:
+        return jsonify({"message": "Brak dostępnego planu lekcji"}), 404
+
+    etag, max_age = time_bucket_etag(
+        latest_version.get("checksum"), f"whatnow:{group_number}", now
+    )
+    return conditional_response(
+        etag, max_age, lambda: build_whatnow_response(latest_version, group_number, now)
+    )
+
+
+def build_whatnow_response(latest_version, group_number, now):
+    timetable = get_timetables().get(WHATNOW_PLAN_ID, latest_version)
+    if not timetable:
         return jsonify({"message": "Brak dostępnego planu lekcji"}), 404
 
-    group_key = get_group_key(group_number)
+    group_key = timetable.group_index.get(str(group_number))
     if group_key is None:
         return jsonify({"message": "Nieprawidłowy numer grupy"}), 400
 
-    if group_key not in latest_plan["groups"]:
+    if group_key not in timetable.groups:
         return jsonify({"message": f"Brak planu dla grupy {group_key}"}), 404
 
-    # Konwertuj HTML na DataFrame
-    html_content = latest_plan["groups"][group_key]
-    from io import StringIO
-
-    df_group = pd.read_html(StringIO(html_content))[0]
-    if df_group is None or df_group.empty:
-        return jsonify({"message": "Brak planu lekcji dla tej grupy"}), 404
-
-    day_names = [
-        "Poniedziałek",
-        "Wtorek",
-        "Środa",
-        "Czwartek",
-        "Piątek",
-        "Sobota",
-        "Niedziela",
-    ]
-    current_day = now.weekday()
-
-    current_lesson = None
-    next_lesson = None
-    days_ahead = 0
-
-    # Sprawdź lekcje na najbliższe 7 dni
-    for day_offset in range(7):
-        check_day = (current_day + day_offset) % 7
-        check_date = now.date() + timedelta(days=day_offset)
-        day_name = day_names[check_day]
-
-        for _, row in df_group.iterrows():
-            if (
-                day_name in row
-                and pd.notna(row[day_name])
-                and str(row[day_name]).strip()
-            ):  # Sprawdź, czy jest lekcja w danym dniu
-                time_range = row["Godziny"].split("-")
-                start_time = datetime.strptime(
-                    parse_custom_time(time_range[0].strip()), "%H:%M"
-                ).replace(
-                    year=check_date.year,
-                    month=check_date.month,
-                    day=check_date.day,
-                    tzinfo=poland_tz,
-                )
-                end_time = datetime.strptime(
-                    parse_custom_time(time_range[1].strip()), "%H:%M"
-                ).replace(
-                    year=check_date.year,
-                    month=check_date.month,
-                    day=check_date.day,
-                    tzinfo=poland_tz,
-                )
-
-                if day_offset == 0 and start_time <= now < end_time:
-                    current_lesson = {
-                        "subject": format_subject(row[day_name]),
-                        "start": start_time.strftime("%H:%M"),
-                        "end": end_time.strftime("%H:%M"),
-                        "time_left": int((end_time - now).total_seconds() // 60),
-                    }
-                elif now < start_time and not next_lesson:
-                    next_lesson = {
-                        "subject": format_subject(row[day_name]),
-                        "start": start_time.strftime("%H:%M"),
-                        "end": end_time.strftime("%H:%M"),
-                        "time_to_start": int((start_time - now).total_seconds() // 60),
-                        "day": day_name,
-                    }
-                    days_ahead = day_offset
-                    break
+    current_lesson, next_lesson, days_ahead = timetable.whatnow(group_key, now)
+    message = format_whatnow_message(group_key, current_lesson, next_lesson, days_ahead)
+    json_response = json.dumps({"message": message}, ensure_ascii=False, indent=2)
+    return Response(json_response, content_type="application/json; charset=utf-8")
 
-        if next_lesson:
-            break
 
+def format_whatnow_message(group_key, current_lesson, next_lesson, days_ahead):
     message = f"Grupa: {group_key}\n\n"
 
     if current_lesson:
@@ -432,11 +719,394 @@ def whatnow(group_number):
         message += "Brak zaplanowanych lekcji w ciągu najbliższych 7 dni.\n"
 
     # Usuń ewentualne podwójne nowe linie i końcowe białe znaki
-    message = "\n".join(line for line in message.split("\n") if line.strip())
-    json_response = json.dumps({"message": message}, ensure_ascii=False, indent=2)
+    return "\n".join(line for line in message.split("\n") if line.strip())
+
+
+def get_list_arg(name):
+    """Lista wartości parametru zapytania podanego jako ?name=a,b lub ?name=a&name=b"""
+    values = []
+    for value in request.args.getlist(name):
+        values.extend(item.strip() for item in value.split(",") if item.strip())
+    return values
+
+
+@app.route("/api/whatnow")
+def whatnow_batch():
+    """Aktualna/następna lekcja dla wielu planów i grup w jednym zapytaniu"""
+    now = get_current_time()
+    plan_ids = get_list_arg("plans") or list(plans_config)
+    unknown_plans = [plan_id for plan_id in plan_ids if plan_id not in plans_config]
+    if unknown_plans:
+        return jsonify({"message": f"Nieznane plany: {', '.join(unknown_plans)}"}), 400
+    group_refs = [ref for ref in get_list_arg("groups") if ref != "all"]
+
+    latest_versions = {
+        plan_id: get_timetables().get_latest_version(plan_id) for plan_id in plan_ids
+    }
+    checksums = ",".join(
+        f"{plan_id}={(version or {}).get('checksum')}"
+        for plan_id, version in latest_versions.items()
+    )
+    etag, max_age = time_bucket_etag(
+        checksums, f"whatnow:{','.join(group_refs)}", now
+    )
+    return conditional_response(
+        etag,
+        max_age,
+        lambda: build_whatnow_batch_response(latest_versions, group_refs, now),
+    )
+
+
+def parse_group_ref(group_ref):
+    """'plan_id:grupa' -> (plan_id, 'grupa'); samo 'grupa' -> (None, 'grupa')"""
+    ref_plan_id, separator, ref_group = group_ref.partition(":")
+    if separator and ref_plan_id in plans_config:
+        return ref_plan_id, ref_group
+    return None, group_ref
+
+
+def select_groups(timetable, group_refs, matched_refs):
+    """Grupy planu wskazane przez group_refs ('grupa' albo 'plan_id:grupa'); wszystkie, gdy brak"""
+    if not group_refs:
+        return list(timetable.groups)
+
+    selected = []
+    for group_ref in group_refs:
+        ref_plan_id, ref_group = parse_group_ref(group_ref)
+        if ref_plan_id is not None and ref_plan_id != timetable.plan_id:
+            continue
+        group_name = timetable.resolve_group(ref_group)
+        if group_name in timetable.groups and group_name not in selected:
+            selected.append(group_name)
+            matched_refs.add(group_ref)
+    return selected
+
+
+def build_whatnow_batch_response(latest_versions, group_refs, now):
+    plans = {}
+    matched_refs = set()
+    for plan_id, latest_version in latest_versions.items():
+        timetable = get_timetables().get(plan_id, latest_version) if latest_version else None
+        if not timetable:
+            if not group_refs:
+                plans[plan_id] = {
+                    "name": plans_config[plan_id]["name"],
+                    "message": "Brak dostępnego planu lekcji",
+                    "groups": {},
+                }
+            continue
+
+        groups = {}
+        for group_name in select_groups(timetable, group_refs, matched_refs):
+            current_lesson, next_lesson, days_ahead = timetable.whatnow(group_name, now)
+            groups[group_name] = {
+                "slug": slugify(group_name),
+                "current": current_lesson,
+                "next": next_lesson,
+                "message": format_whatnow_message(
+                    group_name, current_lesson, next_lesson, days_ahead
+                ),
+            }
+        if groups or not group_refs:
+            plans[plan_id] = {
+                "name": timetable.plan_name,
+                "checksum": timetable.checksum,
+                "groups": groups,
+            }
+
+    if group_refs and not matched_refs:
+        return jsonify({"message": "Nie znaleziono żadnej z podanych grup"}), 404
+
+    result = {"time": now.strftime("%Y-%m-%d %H:%M:%S"), "plans": plans}
+    unknown_groups = [ref for ref in group_refs if ref not in matched_refs]
+    if unknown_groups:
+        result["unknown_groups"] = unknown_groups
+    json_response = json.dumps(result, ensure_ascii=False, indent=2)
+    return Response(json_response, content_type="application/json; charset=utf-8")
+
+
+@app.route("/api/plans/<plan_id>/groups/<group_ref>/week")
+def group_week(plan_id, group_ref):
+    """Tygodniowy plan grupy jako JSON"""
+    return serve_export(plan_id, group_ref, "week")
+
+
+@app.route("/api/plans/<plan_id>/groups/<group_ref>/week.ics")
+def group_week_ics(plan_id, group_ref):
+    """Tygodniowy plan grupy jako kalendarz iCalendar"""
+    return serve_export(plan_id, group_ref, "ics")
+
+
+def serve_export(plan_id, group_ref, export_format):
+    if plan_id not in plans_config:
+        return jsonify({"message": f"Nieznany plan: {plan_id}"}), 404
+    group_name = get_exports().resolve_group(plan_id, group_ref)
+    if group_name is None:
+        return jsonify({"message": f"Nieznana grupa: {group_ref}"}), 404
+
+    latest_version = get_timetables().get_latest_version(plan_id)
+    if not latest_version:
+        return jsonify({"message": "Brak dostępnego planu lekcji"}), 404
+
+    etag = make_etag(latest_version.get("checksum"), plan_id, group_name, export_format)
+    return conditional_response(
+        etag,
+        EXPORT_CACHE_SECONDS,
+        lambda: build_export_response(plan_id, latest_version, group_name, export_format),
+    )
+
+
+def build_export_response(plan_id, latest_version, group_name, export_format):
+    export = get_exports().get(plan_id, latest_version, group_name)
+    if not export:
+        return jsonify({"message": f"Brak planu dla grupy {group_name}"}), 404
+
+    if export_format == "ics":
+        response = Response(export["ics"], content_type="text/calendar; charset=utf-8")
+        response.headers["Content-Disposition"] = (
+            f'inline; filename="{slugify(group_name)}.ics"'
+        )
+        return response
+    json_response = json.dumps(export["week"], ensure_ascii=False, indent=2)
     return Response(json_response, content_type="application/json; charset=utf-8")
 
 
+def get_plan_history(plan_id):
+    if plan_id not in plan_histories:
+        plan_histories[plan_id] = PlanHistory(get_db(), get_plan_collection_name(plans_config[plan_id]))
+    return plan_histories[plan_id]
+
+
+def parse_query_time(value, now):
+    """Czas z parametru zapytania (RRRR-MM-DD lub RRRR-MM-DDTGG:MM[:SS]) jako czas lokalny bez strefy"""
+    if not value:
+        return now.replace(tzinfo=None)
+    query_time = datetime.fromisoformat(value)
+    if query_time.tzinfo is not None:
+        query_time = query_time.astimezone(pytz.timezone("Europe/Warsaw")).replace(tzinfo=None)
+    return query_time
+
+
+@app.route("/api/plans/<plan_id>/groups/<group_ref>/at")
+def group_at(plan_id, group_ref):
+    """Plan grupy w wersji obowiązującej w podanej chwili (?time=...&day=...)"""
+    if plan_id not in plans_config:
+        return jsonify({"message": f"Nieznany plan: {plan_id}"}), 404
+    now = get_current_time()
+    try:
+        at = parse_query_time(request.args.get("time"), now)
+    except ValueError:
+        return jsonify({"error": "Invalid time format. Use YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS"}), 400
+    day_index = None
+    if request.args.get("day"):
+        day_index = resolve_day(request.args["day"])
+        if day_index is None:
+            return jsonify({"message": f"Nieznany dzień: {request.args['day']}"}), 400
+
+    history = get_plan_history(plan_id)
+    timeline_entry = history.find_effective_version(at)
+    if not timeline_entry:
+        return jsonify({"message": f"Brak wersji planu obowiązującej {at}"}), 404
+
+    group_fingerprints = {
+        group["group"]: group["fingerprint"] for group in timeline_entry["groups"]
+    }
+    group_index = build_group_index(get_group_names(plans_config[plan_id]))
+    group_name = resolve_group(group_index, group_ref) or resolve_group(
+        build_group_index(list(group_fingerprints)), group_ref
+    )
+    if group_name not in group_fingerprints:
+        return jsonify({"message": f"Brak planu dla grupy {group_ref} w tej wersji"}), 404
+
+    # Wersja obowiązująca w przeszłości już się nie zmieni
+    max_age = EXPORT_CACHE_SECONDS if at < now.replace(tzinfo=None) else API_CACHE_SECONDS
+    etag = make_etag(group_fingerprints[group_name], timeline_entry["version"], group_name, day_index)
+    return conditional_response(
+        etag,
+        max_age,
+        lambda: build_group_at_response(
+            history, timeline_entry, group_name, group_fingerprints[group_name], at, day_index
+        ),
+    )
+
+
+def build_group_at_response(history, timeline_entry, group_name, fingerprint, at, day_index):
+    lessons = group_lessons.get(
+        fingerprint,
+        lambda: history.get_by_id(timeline_entry["_id"])["groups"][group_name],
+    )
+    result = {
+        "plan": timeline_entry["plan_name"],
+        "group": group_name,
+        "slug": slugify(group_name),
+        "time": at.strftime("%Y-%m-%d %H:%M:%S"),
+        "version": {
+            "version": timeline_entry["version"],
+            "timestamp": timeline_entry["timestamp"],
+            "checksum": timeline_entry["checksum"],
+        },
+        "days": build_days(lessons, day_index),
+    }
+    json_response = json.dumps(result, ensure_ascii=False, indent=2)
+    return Response(json_response, content_type="application/json; charset=utf-8")
+
+
+def ensure_event_watcher():
+    """W trybach wieloprocesowych zdarzenia z procesu sprawdzającego czytamy z MongoDB"""
+    global event_watcher
+    if SERVER_MODE == "embedded":
+        return
+    with event_watcher_lock:
+        if event_watcher is None:
+            event_watcher = MongoEventWatcher(get_db(), plan_event_broker)
+            event_watcher.start()
+
+
+def resolve_event_filter(plan_ids, group_refs):
+    """{plan_id: zbiór nazw grup lub None (wszystkie)} dla subskrypcji zdarzeń"""
+    wanted_groups = {}
+    for plan_id in plan_ids:
+        if not group_refs:
+            wanted_groups[plan_id] = None
+            continue
+        group_index = build_group_index(get_group_names(plans_config[plan_id]))
+        group_names = set()
+        for group_ref in group_refs:
+            ref_plan_id, ref_group = parse_group_ref(group_ref)
+            if ref_plan_id is not None and ref_plan_id != plan_id:
+                continue
+            group_name = resolve_group(group_index, ref_group)
+            if group_name:
+                group_names.add(group_name)
+        if group_names:
+            wanted_groups[plan_id] = group_names
+    return wanted_groups
+
+
+def format_plan_event(event, wanted_groups):
+    """Wiadomości SSE (po jednej na zmienioną grupę) dla zdarzenia pasującego do subskrypcji"""
+    plan_id = plans_config.plan_ids_by_name.get(event["plan_name"])
+    if plan_id not in wanted_groups:
+        return ""
+    messages = []
+    for group_name in event["changed_groups"]:
+        if wanted_groups[plan_id] is not None and group_name not in wanted_groups[plan_id]:
+            continue
+        data = {
+            "plan_id": plan_id,
+            "plan_name": event["plan_name"],
+            "group": group_name,
+            "slug": slugify(group_name),
+            "version": event["version"],
+            "checksum": event["checksum"],
+            "timestamp": event["timestamp"],
+        }
+        messages.append(
+            f"id: {event['id']}\nevent: plan_update\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+        )
+    return "".join(messages)
+
+
+@app.route("/api/events")
+def plan_events():
+    """Strumień SSE ze zdarzeniem plan_update dla każdej zmienionej grupy nowej wersji planu"""
+    plan_ids = get_list_arg("plans") or list(plans_config)
+    unknown_plans = [plan_id for plan_id in plan_ids if plan_id not in plans_config]
+    if unknown_plans:
+        return jsonify({"message": f"Nieznane plany: {', '.join(unknown_plans)}"}), 400
+    group_refs = [ref for ref in get_list_arg("groups") if ref != "all"]
+    wanted_groups = resolve_event_filter(plan_ids, group_refs)
+    if not wanted_groups:
+        return jsonify({"message": "Nie znaleziono żadnej z podanych grup"}), 404
+
+    if not sse_stream_slots.acquire(blocking=False):
+        response = jsonify({"message": "Za dużo otwartych strumieni zdarzeń, spróbuj ponownie później"})
+        response.status_code = 503
+        response.headers["Retry-After"] = str(max(SSE_RETRY_MILLISECONDS // 1000, 1))
+        return response
+
+    try:
+        ensure_event_watcher()
+        # Subskrypcja przed odczytem zaległych zdarzeń, aby nic nie zginęło pomiędzy
+        subscription = plan_event_broker.subscribe()
+    except Exception:
+        sse_stream_slots.release()
+        raise
+    missed_events = []
+    last_event_id = request.headers.get("Last-Event-ID") or request.args.get("last_event_id")
+    if last_event_id:
+        try:
+            missed_events = get_events_after(get_db(), ObjectId(last_event_id))
+        except InvalidId:
+            pass
+
+    def stream():
+        SSE_CONNECTIONS.inc()
+        try:
+            yield f"retry: {SSE_RETRY_MILLISECONDS}\n\n"
+            sent_event_ids = set()
+            for event in missed_events:
+                sent_event_ids.add(event["id"])
+                yield format_plan_event(event, wanted_groups)
+            while True:
+                try:
+                    event = subscription.get(timeout=SSE_KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                if event["id"] not in sent_event_ids:
+                    yield format_plan_event(event, wanted_groups)
+        finally:
+            SSE_CONNECTIONS.dec()
+
+    def close_stream():
+        # Wywoływane przy zamknięciu odpowiedzi, także gdy generator nie zdążył wystartować
+        plan_event_broker.unsubscribe(subscription)
+        sse_stream_slots.release()
+
+    response = Response(stream(), mimetype="text/event-stream")
+    response.call_on_close(close_stream)
+    response.headers["Cache-Control"] = "no-cache"
+    # Wyłącza buforowanie odpowiedzi w nginx
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+
+@app.route("/api/profile", methods=["POST"])
+def request_profile():
+    """Zleca profilowanie kolejnych sprawdzeń planów (checks) i zapytań API tego procesu (requests)"""
+    profile_token = os.getenv("PROFILE_TOKEN")
+    if not profile_token:
+        return jsonify({"error": "Profiling endpoint is disabled (PROFILE_TOKEN not set)"}), 404
+    if request.headers.get("Authorization") != f"Bearer {profile_token}":
+        return jsonify({"error": "Unauthorized"}), 401
+
+    data = request.get_json(silent=True) or {}
+    try:
+        checks = int(data.get("checks", 0))
+        requests_count = int(data.get("requests", 0))
+    except (TypeError, ValueError):
+        return jsonify({"error": "checks and requests must be integers"}), 400
+    if checks < 0 or requests_count < 0:
+        return jsonify({"error": "checks and requests must not be negative"}), 400
+
+    if checks:
+        # Proces sprawdzający może działać osobno - zlecenie odczyta na początku cyklu
+        get_db()[PROFILING_COLLECTION].update_one(
+            {"_id": "checker"}, {"$inc": {"checks": checks}}, upsert=True
+        )
+    if requests_count:
+        profiling.request(requests=requests_count)
+    return jsonify(
+        {
+            "message": "Profiling requested",
+            "checks": checks,
+            "requests": requests_count,
+            "pid": os.getpid(),
+        }
+    )
+
+
 @app.route("/api/set_test_time", methods=["POST"])
 def set_test_time():
     global USE_TEST_TIME, TEST_TIME
@@ -460,7 +1130,67 @@ def set_test_time():
     )
 
 
+def check_moodle_course(course, openrouter_api_key, mongo_uri):
+    """Pobiera stronę kursu Moodle i zapisuje jej nowe aktywności w kolekcji kursu"""
+    from ActivityDownloader import WebpageDownloader
+    from MoodleParserComponent import MoodleFileParser
+
+    with sentry_sdk.start_transaction(op="check_cycle", name=f"moodle {course.key}"):
+        try:
+            saved_file = WebpageDownloader().save_webpage(course.url, course.html_filename)
+            if not saved_file:
+                return
+            try:
+                parser = MoodleFileParser(
+                    saved_file,
+                    api_key=openrouter_api_key,
+                    mongodb_uri=mongo_uri,
+                    collection_name=course.collection_name,
+                )
+                try:
+                    # Parsuj i zapisz aktywności
+                    with track_stage(f"moodle_{course.key}", "moodle_parse"):
+                        fingerprint = activities_fingerprint(parser.parse_activities())
+                        if course_unchanged(parser.db, course, fingerprint):
+                            print(f"Kurs Moodle {course.key} bez zmian")
+                        elif parser.save_to_mongodb():
+                            save_course_fingerprint(parser.db, course, fingerprint)
+                finally:
+                    parser.mongo_client.close()
+            finally:
+                # Usuń pobrany plik
+                try:
+                    os.remove(saved_file)
+                    print(f"Usunięto plik tymczasowy: {saved_file}")
+                except Exception as e:
+                    print(f"Błąd podczas usuwania pliku {saved_file}: {str(e)}")
+
+        except Exception as e:
+            print(f"Błąd podczas przetwarzania aktywności Moodle ({course.key}): {str(e)}")
+
+
+def check_moodle_activities(openrouter_api_key, mongo_uri):
+    """Sprawdza strony kursów Moodle równolegle, najwyżej MOODLE_WORKERS naraz"""
+    courses = get_moodle_courses()
+    if not courses:
+        print("Błąd podczas przetwarzania aktywności Moodle: MOODLE_URL/MOODLE_URLS not set in environment variables")
+        return
+
+    print(f"\nSprawdzanie aktywności Moodle ({len(courses)} kursów)...")
+    with ThreadPoolExecutor(
+        max_workers=min(MOODLE_WORKERS, len(courses)), thread_name_prefix="moodle"
+    ) as executor:
+        for course in courses:
+            executor.submit(check_moodle_course, course, openrouter_api_key, mongo_uri)
+
+
 def main():
+    from LessonPlan import LessonPlan
+    from comparer import LessonPlanComparator
+    from DownloadCache import DownloadCache
+    from AsyncCheckCycle import run_check_cycle_async
+    from RateLimiter import openrouter_limiter
+
     print("Starting main.py")
     check_interval = 600
 
@@ -476,17 +1206,10 @@ def main():
         openrouter_api_key = os.getenv("OPENROUTER_API_KEY")
         selected_model = os.getenv("SELECTED_MODEL")
         discord_webhook_url = os.getenv("DISCORD_WEBHOOK_URL")
-        # Load plans configuration
-        with open("plans.json", "r", encoding="utf-8") as f:
-            plans_config = json.load(f)
-
-        lesson_plans = {}
-        lesson_plan_comparators = {}
-        lesson_plan_managers = {}
 
-        for plan_id, plan_config in plans_config.items():
+        def create_manager(plan_config):
             print(f"Initializing LessonPlan for {plan_config['name']}")
-            lesson_plans[plan_id] = LessonPlan(
+            lesson_plan = LessonPlan(
                 username=username,
                 password=password,
                 mongo_uri=mongo_uri,
@@ -495,7 +1218,7 @@ def main():
             print(f"LessonPlan for {plan_config['name']} initialized successfully")
 
             comparator = None
-            
+
             # Debug info about plan settings
             compare_enabled = plan_config.get('compare', False)
             notify_enabled = plan_config.get('notify', False)
@@ -511,7 +1234,6 @@ def main():
                         openrouter_api_key=openrouter_api_key,
                         selected_model=selected_model,
                     )
-                    lesson_plan_comparators[plan_id] = comparator
                     print(f"LessonPlanComparator for {plan_config['name']} initialized successfully")
                 except Exception as e:
                     print(f"Failed to initialize comparator for {plan_config['name']}: {e}")
@@ -525,8 +1247,8 @@ def main():
                     print(f"Skipping LessonPlanComparator initialization for {plan_config['name']} (compare not enabled in plans.json)")
 
             print(f"Initializing LessonPlanManager for {plan_config['name']}")
-            lesson_plan_managers[plan_id] = LessonPlanManager(
-                lesson_plans[plan_id],
+            manager = LessonPlanManager(
+                lesson_plan,
                 comparator,
                 working_directory=".",
                 discord_webhook_url=discord_webhook_url,
@@ -534,60 +1256,145 @@ def main():
             print(
                 f"LessonPlanManager for {plan_config['name']} initialized successfully"
             )
+            return manager
 
-        flask_thread = threading.Thread(target=run_flask_app)
-        flask_thread.daemon = True
-        flask_thread.start()
+        lesson_plan_managers = {}
 
-        # Run managers sequentially in the main thread
-        try:
-            while True:
-                for plan_id, manager in lesson_plan_managers.items():
-                    print(f"\nStarting check cycle for {plans_config[plan_id]['name']}")
+        def sync_plan_managers():
+            """Tworzy managery nowych planów i odtwarza zmienione; niezmienione zostają bez zmian.
+            Zwraca True, gdy zmienił się zbiór managerów"""
+            changed = False
+            for plan_id in list(lesson_plan_managers):
+                if plan_config_changed(plan_id):
+                    print(f"Plan {plan_id} removed or changed in plans.json - closing its manager")
+                    lesson_plan_managers.pop(plan_id).close()
+                    changed = True
+            for plan_id, plan_config in plans_config.items():
+                if plan_id not in lesson_plan_managers:
                     try:
-                        manager.check_once()
+                        lesson_plan_managers[plan_id] = create_manager(plan_config)
+                        changed = True
                     except Exception as e:
-                        print(
-                            f"Error in manager for {plans_config[plan_id]['name']}: {str(e)}"
-                        )
+                        print(f"Failed to initialize plan {plan_id}: {e}")
+            return changed
 
-                # Po sprawdzeniu wszystkich planów, sprawdź aktywności Moodle
-                try:
-                    print("\nSprawdzanie aktywności Moodle...")
-                    downloader = WebpageDownloader()
-                    moodle_url = os.getenv("MOODLE_URL")
-                    if not moodle_url:
-                        raise ValueError("MOODLE_URL not set in environment variables")
-                    
-                    saved_file = downloader.save_webpage(moodle_url)
-                    if saved_file:
-                        parser = MoodleFileParser(
-                            saved_file, 
-                            api_key=openrouter_api_key,
-                            mongodb_uri=mongo_uri
+        def apply_plans_config():
+            # Zmianę pliku mógł już wczytać wątek API (SERVER_MODE=embedded) - managery
+            # porównujemy z bieżącą konfiguracją niezależnie od wyniku reload_if_changed
+            plans_config.reload_if_changed()
+            if sync_plan_managers() and plan_leases is not None:
+                plan_leases.set_resources([*lesson_plan_managers, "moodle"])
+
+        def plan_config_changed(plan_id):
+            return (
+                plan_id not in plans_config
+                or lesson_plan_managers[plan_id].lesson_plan.plan_config != plans_config[plan_id]
+            )
+
+        sync_plan_managers()
+
+        api_process = start_api_server()
+
+        # CHECK_MODE=async: zapytania HTTP cyklu idą równolegle przez jedną sesję aiohttp
+        # CHECK_MODE=queue: etapy sprawdzania są zadaniami trwałej kolejki w MongoDB
+        check_mode = os.getenv("CHECK_MODE", "sync").lower()
+        print(f"Check mode: {check_mode}")
+
+        job_queue = None
+        job_workers = []
+        if check_mode == "queue":
+            from CheckJobs import create_job_handlers, schedule_check_jobs
+            from JobQueue import JobQueue, parse_concurrency, start_job_workers
+
+            job_queue = JobQueue(get_db())
+            handlers = create_job_handlers(lesson_plan_managers, job_queue, username, password)
+            # JOB_STAGES ogranicza etapy obsługiwane przez ten proces (np. tylko compare)
+            job_stages = os.getenv("JOB_STAGES")
+            if job_stages:
+                stages = {stage.strip() for stage in job_stages.split(",")}
+                handlers = {stage: handler for stage, handler in handlers.items() if stage in stages}
+            job_workers = start_job_workers(
+                job_queue, handlers, parse_concurrency(os.getenv("JOB_CONCURRENCY"))
+            )
+        schedule_jobs = os.getenv("JOB_SCHEDULE", "true").lower() == "true"
+
+        # PLAN_LEASES=true: repliki dzielą plany (i sprawdzanie Moodle) dzierżawami w MongoDB
+        plan_leases = None
+        if os.getenv("PLAN_LEASES", "false").lower() == "true":
+            from PlanLeases import PlanLeases
+
+            plan_leases = PlanLeases(get_db(), [*lesson_plan_managers, "moodle"]).start()
+
+        try:
+            while True:
+                profiling.load_requests(get_db())
+                openrouter_limiter.start_cycle()
+                apply_plans_config()
+                lease_resource_ids = [*lesson_plan_managers, "moodle"]
+                with plan_leases.hold(lease_resource_ids) if plan_leases else nullcontext(
+                    lease_resource_ids
+                ) as held_ids:
+                    managers = {
+                        plan_id: manager
+                        for plan_id, manager in lesson_plan_managers.items()
+                        if plan_id in held_ids
+                    }
+                    check_moodle = "moodle" in held_ids
+                    if check_mode == "queue":
+                        if schedule_jobs:
+                            schedule_check_jobs(job_queue, managers)
+                            if check_moodle:
+                                check_moodle_activities(openrouter_api_key, mongo_uri)
+                    elif check_mode == "async":
+                        asyncio.run(
+                            run_check_cycle_async(
+                                managers.values(),
+                                username,
+                                password,
+                                openrouter_api_key,
+                                mongo_uri,
+                                check_moodle=check_moodle,
+                            )
                         )
-                        
-                        # Parsuj i zapisz aktywności
-                        parser.parse_activities()
-                        parser.save_to_mongodb()
-                        
-                        # Usuń pobrany plik
-                        try:
-                            os.remove(saved_file)
-                            print(f"Usunięto plik tymczasowy: {saved_file}")
-                        except Exception as e:
-                            print(f"Błąd podczas usuwania pliku {saved_file}: {str(e)}")
-                            
-                except Exception as e:
-                    print(f"Błąd podczas przetwarzania aktywności Moodle: {str(e)}")
+                    else:
+                        # Run managers sequentially in the main thread
+                        # Plany z tym samym download_url pobierają skoroszyt raz na cykl
+                        download_cache = DownloadCache(username, password)
+                        for plan_id, manager in managers.items():
+                            print(f"\nStarting check cycle for {manager.plan_name}")
+                            try:
+                                manager.check_once(download_cache)
+                            except Exception as e:
+                                print(
+                                    f"Error in manager for {manager.plan_name}: {str(e)}"
+                                )
+                        download_cache.close()
+
+                        # Po sprawdzeniu wszystkich planów, sprawdź aktywności Moodle
+                        if check_moodle:
+                            check_moodle_activities(openrouter_api_key, mongo_uri)
 
                 print(f"\nWszystkie zadania zakończone. Oczekiwanie {check_interval} sekund przed następnym cyklem...")
-                time.sleep(check_interval)
+                # Zmiany plans.json są stosowane w trakcie oczekiwania, nowe plany sprawdza następny cykl
+                next_cycle = time.monotonic() + check_interval
+                while time.monotonic() < next_cycle:
+                    time.sleep(min(plans_config.reload_interval or 1, max(next_cycle - time.monotonic(), 0)))
+                    apply_plans_config()
 
         except KeyboardInterrupt:
             print("\nShutting down gracefully...")
         except Exception as e:
             print(f"Fatal error: {str(e)}")
+        finally:
+            for worker in job_workers:
+                worker.stop()
+            if plan_leases is not None:
+                plan_leases.stop()
+            for manager in lesson_plan_managers.values():
+                manager.close()
+            if api_process is not None:
+                api_process.terminate()
+                api_process.wait(timeout=30)
 
         print("Initializing LessonPlanComparator")
         lesson_plan_comparator = LessonPlanComparator(
@@ -0,0 +1,111 @@
+"""Metryki Prometheus dla etapów przetwarzania planów i API.
+
+Przy wielu procesach (SERVER_MODE=wsgi/checker) należy ustawić
+PROMETHEUS_MULTIPROC_DIR na wspólny, pusty przy starcie katalog - wtedy
+/metrics w dowolnym workerze zwraca metryki zagregowane ze wszystkich procesów,
+łącznie z procesem sprawdzającym plany.
+"""
+import os
+import time
+from contextlib import contextmanager
+
+import sentry_sdk
+from Profiling import record_stage
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+# Etapy potoku: download, unmerge, clean, column_discovery, group_extraction,
+# html_render, mongo_write, export_render, llm_compare, moodle_parse
+STAGE_DURATION = Histogram(
+    "lesson_plan_stage_duration_seconds",
+    "Czas trwania etapu przetwarzania planu",
+    ["plan", "stage"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+)
+
+CHANGES_DETECTED = Counter(
+    "lesson_plan_changes_detected_total",
+    "Liczba wykrytych zmian planu",
+    ["plan"],
+)
+
+CACHE_HITS = Counter(
+    "lesson_plan_cache_hits_total",
+    "Liczba trafień w pamięci podręcznej",
+    ["cache"],
+)
+
+API_ERRORS = Counter(
+    "lesson_plan_api_errors_total",
+    "Liczba odpowiedzi API z błędem",
+    ["endpoint", "status"],
+)
+
+PLAN_WORKER_FAILURES = Counter(
+    "lesson_plan_worker_failures_total",
+    "Liczba przebiegów planu przerwanych w procesie roboczym",
+    ["plan", "reason"],
+)
+
+JOBS_PROCESSED = Counter(
+    "lesson_plan_jobs_total",
+    "Liczba wykonanych zadań kolejki według typu i wyniku",
+    ["type", "status"],
+)
+
+# Oczekiwanie na miejsce w limicie OpenRouter (RateLimiter) według priorytetu
+OPENROUTER_WAIT = Histogram(
+    "lesson_plan_openrouter_wait_seconds",
+    "Czas oczekiwania zapytania na limit OpenRouter",
+    ["priority"],
+    buckets=(0.01, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120),
+)
+
+OPENROUTER_BUDGET_EXCEEDED = Counter(
+    "lesson_plan_openrouter_budget_exceeded_total",
+    "Liczba zapytań OpenRouter odrzuconych po wyczerpaniu budżetu cyklu",
+    ["priority"],
+)
+
+# Dzierżawy planów trzymane przez replikę (PLAN_LEASES=true)
+PLAN_LEASES_HELD = Gauge(
+    "lesson_plan_leases_held",
+    "Liczba planów, których dzierżawę trzyma proces sprawdzający",
+    multiprocess_mode="livesum",
+)
+
+# Otwarte strumienie /api/events (suma z żyjących procesów API)
+SSE_CONNECTIONS = Gauge(
+    "lesson_plan_sse_connections",
+    "Liczba otwartych połączeń strumienia zdarzeń",
+    multiprocess_mode="livesum",
+)
+
+
+@contextmanager
+def track_stage(plan, stage):
+    """Mierzy czas wykonania bloku jako etap `stage` planu `plan` (metryka i span Sentry)"""
+    start = time.perf_counter()
+    try:
+        with sentry_sdk.start_span(op=f"pipeline.{stage}", name=f"{stage} {plan}"):
+            yield
+    finally:
+        duration = time.perf_counter() - start
+        STAGE_DURATION.labels(plan=plan, stage=stage).observe(duration)
+        record_stage(plan, stage, duration)
+
+
+def render_metrics():
+    """Zwraca (treść, content_type) metryk w formacie tekstowym Prometheusa"""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
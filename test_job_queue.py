@@ -0,0 +1,129 @@
+from datetime import datetime, timedelta
+
+import mongomock
+import pytest
+
+from JobQueue import (
+    STATUS_DONE,
+    STATUS_FAILED,
+    STATUS_LOST,
+    STATUS_PENDING,
+    STATUS_RUNNING,
+    JobQueue,
+    parse_concurrency,
+)
+
+
+@pytest.fixture
+def db():
+    return mongomock.MongoClient().db
+
+
+@pytest.fixture
+def job_queue(db):
+    return JobQueue(db)
+
+
+def expire_lease(db, job):
+    db.jobs.update_one({"_id": job["_id"]}, {"$set": {"locked_until": datetime.utcnow() - timedelta(seconds=1)}})
+
+
+def test_parse_concurrency():
+    assert parse_concurrency("process=2, compare=4") == {"process": 2, "compare": 4}
+    assert parse_concurrency(None) == {}
+
+
+def test_claim_and_complete(db, job_queue):
+    job_id = job_queue.enqueue("process", "plan", {"url": "U"})
+
+    job = job_queue.claim(["process"], "worker-1")
+    assert job["_id"] == job_id
+    assert (job["status"], job["attempts"], job["worker"]) == (STATUS_RUNNING, 1, "worker-1")
+    assert job_queue.claim(["process"], "worker-2") is None
+
+    assert job_queue.complete(job)
+    stored = db.jobs.find_one({"_id": job_id})
+    assert stored["status"] == STATUS_DONE
+    assert "payload" not in stored and "locked_until" not in stored
+
+
+def test_dedupe_key_skips_active_job(job_queue):
+    assert job_queue.enqueue("refresh_cache", "plan", dedupe_key="refresh_cache:plan") is not None
+    assert job_queue.enqueue("refresh_cache", "plan", dedupe_key="refresh_cache:plan") is None
+    job = job_queue.claim(["refresh_cache"], "worker")
+    assert job_queue.enqueue("refresh_cache", "plan", dedupe_key="refresh_cache:plan") is None
+    job_queue.complete(job)
+    assert job_queue.enqueue("refresh_cache", "plan", dedupe_key="refresh_cache:plan") is not None
+
+
+def test_fail_retries_with_backoff_then_fails(db, job_queue):
+    job_id = job_queue.enqueue("compare", "plan", max_attempts=2)
+
+    job = job_queue.claim(["compare"], "worker")
+    assert job_queue.fail(job, "RuntimeError: 1") == STATUS_PENDING
+    stored = db.jobs.find_one({"_id": job_id})
+    assert stored["run_at"] > datetime.utcnow()
+    # Zadanie czeka na swój termin ponowienia
+    assert job_queue.claim(["compare"], "worker") is None
+
+    db.jobs.update_one({"_id": job_id}, {"$set": {"run_at": datetime.utcnow()}})
+    job = job_queue.claim(["compare"], "worker")
+    assert job_queue.is_last_attempt(job)
+    assert job_queue.fail(job, "RuntimeError: 2") == STATUS_FAILED
+    stored = db.jobs.find_one({"_id": job_id})
+    assert (stored["status"], stored["last_error"]) == (STATUS_FAILED, "RuntimeError: 2")
+    assert "finished_at" in stored
+
+
+def test_expired_lease_is_reclaimed_and_stale_worker_is_ignored(db, job_queue):
+    job_id = job_queue.enqueue("process", "plan")
+    stale_job = job_queue.claim(["process"], "worker-1")
+    expire_lease(db, stale_job)
+
+    job = job_queue.claim(["process"], "worker-2")
+    assert (job["_id"], job["attempts"]) == (job_id, 2)
+
+    assert not job_queue.renew(stale_job)
+    assert not job_queue.complete(stale_job)
+    assert job_queue.fail(stale_job, "late error") == STATUS_LOST
+    assert db.jobs.find_one({"_id": job_id})["worker"] == "worker-2"
+
+    assert job_queue.renew(job)
+    assert job_queue.complete(job)
+    assert db.jobs.find_one({"_id": job_id})["status"] == STATUS_DONE
+
+
+def test_renew_extends_lease(db, job_queue):
+    job_queue.enqueue("process", "plan")
+    job = job_queue.claim(["process"], "worker")
+    expire_lease(db, job)
+
+    assert job_queue.renew(job)
+    assert job_queue.claim(["process"], "other") is None
+
+
+def test_enqueue_merged_adds_plans_to_pending_job(db, job_queue):
+    first = job_queue.enqueue_merged(
+        "download", "p1", {"url": "U", "plan_ids": ["p1"]}, "download:U", "plan_ids"
+    )
+    second = job_queue.enqueue_merged(
+        "download", "p2", {"url": "U", "plan_ids": ["p2", "p1"]}, "download:U", "plan_ids"
+    )
+    assert first is not None and second is None
+    job = job_queue.claim(["download"], "worker")
+    assert job["payload"] == {"url": "U", "plan_ids": ["p1", "p2"]}
+
+    # Zadanie w toku nie przyjmuje planów - powstaje nowe oczekujące
+    assert job_queue.enqueue_merged(
+        "download", "p3", {"url": "U", "plan_ids": ["p3"]}, "download:U", "plan_ids"
+    ) is not None
+    assert job_queue.count_active(["download"]) == 2
+
+
+def test_blobs_are_stored_once(db, job_queue):
+    blob_id = job_queue.put_blob("U", b"workbook")
+    assert job_queue.put_blob("U", b"workbook") == blob_id
+    assert job_queue.put_blob("U", b"newer workbook") != blob_id
+    assert db.job_blobs.count_documents({}) == 2
+    assert job_queue.get_blob(blob_id) == b"workbook"
+    assert job_queue.get_blob("U:missing") is None
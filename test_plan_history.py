@@ -0,0 +1,173 @@
+from datetime import datetime
+
+import mongomock
+import pytest
+
+from PlanHistory import (
+    STORAGE_DELTA,
+    STORAGE_FULL,
+    PlanHistory,
+    apply_delta,
+    build_delta,
+)
+
+COLLECTION = "plans_test"
+
+
+def make_html(rows):
+    return "\n".join(["<table>"] + [f"<tr><td>{row}</td></tr>" for row in rows] + ["</table>"])
+
+
+def make_versions(count):
+    """Kolejne wersje planu: zmienione linie, dodane i usunięte grupy (także z kropką w nazwie)"""
+    versions = []
+    for index in range(count):
+        groups = {
+            "Grupa 1": make_html([f"lekcja {row}" for row in range(40)] + [f"zmiana {index}"]),
+            "Gr. 2.a": make_html([f"lekcja {row}" for row in range(20)]),
+        }
+        if index % 3 == 0:
+            groups["Grupa 3"] = make_html([f"dodana w {index}"])
+        if index >= 5:
+            del groups["Gr. 2.a"]
+        versions.append(
+            {
+                "timestamp": f"2026-01-{index + 1:02d} 08:00:00",
+                "checksum": f"checksum-{index}",
+                "plan_name": "Test",
+                "category": "st",
+                "groups": groups,
+            }
+        )
+    return versions
+
+
+@pytest.fixture
+def db():
+    return mongomock.MongoClient().db
+
+
+def test_build_and_apply_delta_round_trip():
+    base = {"A": make_html(range(30)), "B.1": make_html(["x"]), "C": make_html(["usunięta"])}
+    target = {"A": make_html(list(range(29)) + ["nowa"]), "B.1": make_html(["y"]), "D": make_html(["nowa"])}
+
+    delta = build_delta(base, target)
+
+    assert apply_delta(base, delta) == target
+    assert delta["removed"] == ["C"]
+    # Mała zmiana w dużej grupie zapisana jako linie, nie cały HTML
+    assert "lines" in next(change for change in delta["groups"] if change["group"] == "A")
+
+
+def test_versions_round_trip_across_snapshots(db):
+    history = PlanHistory(db, COLLECTION, snapshot_interval=3)
+    versions = make_versions(8)
+    for version in versions:
+        history.save_version(dict(version, groups=dict(version["groups"])))
+
+    for number, original in enumerate(versions, start=1):
+        assert history.get_version(number)["groups"] == original["groups"]
+
+    storage = {
+        document["version"]: document["storage"]
+        for document in db[COLLECTION].find(projection={"version": 1, "storage": 1})
+    }
+    # Snapshoty co 3 wersje i najnowsza w całości, pozostałe jako delty
+    assert storage == {
+        1: STORAGE_FULL,
+        2: STORAGE_DELTA,
+        3: STORAGE_DELTA,
+        4: STORAGE_FULL,
+        5: STORAGE_DELTA,
+        6: STORAGE_DELTA,
+        7: STORAGE_FULL,
+        8: STORAGE_FULL,
+    }
+
+
+def test_latest_versions_and_version_pair(db):
+    history = PlanHistory(db, COLLECTION, snapshot_interval=3)
+    versions = make_versions(5)
+    for version in versions:
+        history.save_version(dict(version, groups=dict(version["groups"])))
+
+    latest = history.get_latest_versions(3)
+    assert [document["version"] for document in latest] == [5, 4, 3]
+    assert [document["groups"] for document in latest] == [
+        versions[4]["groups"],
+        versions[3]["groups"],
+        versions[2]["groups"],
+    ]
+
+    newer, older = history.get_version_and_previous("checksum-2")
+    assert (newer["version"], older["version"]) == (3, 2)
+    assert newer["groups"] == versions[2]["groups"]
+    assert older["groups"] == versions[1]["groups"]
+    assert history.get_version_and_previous("checksum-0") == (None, None)
+
+
+def test_legacy_versions_are_numbered_and_compacted(db):
+    versions = make_versions(6)
+    # Kolejność zapisu inna niż kolejność czasu - numeracja idzie po timestamp
+    for version in reversed(versions):
+        db[COLLECTION].insert_one(dict(version))
+
+    history = PlanHistory(db, COLLECTION, snapshot_interval=3)
+    history.prepare()
+
+    documents = {document["version"]: document for document in db[COLLECTION].find()}
+    assert [documents[number]["checksum"] for number in range(1, 7)] == [
+        version["checksum"] for version in versions
+    ]
+    assert [documents[number]["storage"] for number in range(1, 7)] == [
+        STORAGE_FULL,
+        STORAGE_DELTA,
+        STORAGE_DELTA,
+        STORAGE_FULL,
+        STORAGE_DELTA,
+        STORAGE_FULL,
+    ]
+    for number, original in enumerate(versions, start=1):
+        assert history.get_version(number)["groups"] == original["groups"]
+    assert db["plan_timeline"].count_documents({"collection": COLLECTION}) == 6
+
+
+def test_legacy_versions_after_numbered_ones(db):
+    history = PlanHistory(db, COLLECTION, snapshot_interval=3)
+    versions = make_versions(4)
+    for version in versions[:2]:
+        history.save_version(dict(version, groups=dict(version["groups"])))
+    for version in versions[2:]:
+        db[COLLECTION].insert_one(dict(version))
+
+    PlanHistory(db, COLLECTION, snapshot_interval=3).prepare()
+
+    numbered = sorted(db[COLLECTION].find(), key=lambda document: document["version"])
+    assert [document["checksum"] for document in numbered] == [
+        version["checksum"] for version in versions
+    ]
+
+
+def test_reads_do_not_migrate(db):
+    for version in make_versions(3):
+        db[COLLECTION].insert_one(dict(version))
+
+    history = PlanHistory(db, COLLECTION, snapshot_interval=3)
+    history.get_latest_versions(2)
+    history.list_versions()
+
+    assert db[COLLECTION].count_documents({"version": {"$exists": True}}) == 0
+    assert db["plan_timeline"].count_documents({}) == 0
+
+
+def test_timeline_effective_version_and_changed_groups(db):
+    history = PlanHistory(db, COLLECTION, snapshot_interval=3)
+    versions = make_versions(4)
+    for version in versions:
+        history.save_version(dict(version, groups=dict(version["groups"])))
+
+    entry = history.find_effective_version(datetime(2026, 1, 3, 12, 0))
+    assert entry["version"] == 3
+    assert history.find_effective_version(datetime(2025, 12, 31)) is None
+    # Wersja 4 zmienia "Grupa 1" i dodaje "Grupa 3"
+    assert sorted(history.get_changed_groups(4)) == ["Grupa 1", "Grupa 3"]
@@ -0,0 +1,95 @@
+from datetime import datetime, timedelta
+
+import mongomock
+import pytest
+
+from PlanLeases import PlanLeases, rendezvous_owner
+
+RESOURCES = [f"plan-{index}" for index in range(12)] + ["moodle"]
+
+
+@pytest.fixture
+def db():
+    return mongomock.MongoClient().db
+
+
+def test_rendezvous_owner_moves_only_some_resources():
+    owners = {resource_id: rendezvous_owner(resource_id, ["a", "b"]) for resource_id in RESOURCES}
+    assert set(owners.values()) == {"a", "b"}
+
+    new_owners = {resource_id: rendezvous_owner(resource_id, ["a", "b", "c"]) for resource_id in RESOURCES}
+    # Po dodaniu repliki zasób przenosi się tylko do nowej repliki
+    for resource_id, owner in new_owners.items():
+        assert owner in (owners[resource_id], "c")
+
+
+def test_replicas_split_resources(db):
+    first = PlanLeases(db, RESOURCES, "replica-a")
+    second = PlanLeases(db, RESOURCES, "replica-b")
+    first.heartbeat()
+    second.heartbeat()
+    # Pierwsza replika oddaje nadmiarowe dzierżawy, druga przejmuje je przy kolejnym heartbeat
+    first.heartbeat()
+    second.heartbeat()
+
+    assert first.owned.isdisjoint(second.owned)
+    assert first.owned | second.owned == set(RESOURCES)
+
+
+def test_lease_of_other_live_replica_is_not_taken(db):
+    first = PlanLeases(db, ["plan-1"], "replica-a")
+    first.heartbeat()
+    second = PlanLeases(db, ["plan-1"], "replica-b")
+
+    assert not second.acquire("plan-1", datetime.utcnow())
+    assert db.plan_leases.find_one({"_id": "plan-1"})["owner"] == "replica-a"
+
+
+def test_expired_lease_is_taken_over(db):
+    first = PlanLeases(db, ["plan-1"], "replica-a")
+    first.heartbeat()
+    db.plan_leases.update_one({"_id": "plan-1"}, {"$set": {"expires_at": datetime.utcnow() - timedelta(seconds=1)}})
+    db.checker_replicas.delete_one({"_id": "replica-a"})
+
+    second = PlanLeases(db, ["plan-1"], "replica-b")
+    assert second.heartbeat() == {"plan-1"}
+    assert db.plan_leases.find_one({"_id": "plan-1"})["owner"] == "replica-b"
+
+
+def test_hold_drops_leases_that_expired_without_renewal(db):
+    leases = PlanLeases(db, ["plan-1", "plan-2"], "replica-a")
+    leases.heartbeat()
+    leases.expires_at["plan-1"] = datetime.utcnow() - timedelta(seconds=1)
+
+    with leases.hold(["plan-1", "plan-2"]) as held:
+        assert held == ["plan-2"]
+        assert leases.busy == {"plan-2"}
+    assert leases.busy == set()
+    assert leases.owned == {"plan-2"}
+
+
+def test_busy_lease_is_kept_until_check_ends(db):
+    first = PlanLeases(db, RESOURCES, "replica-a")
+    first.heartbeat()
+    assert first.owned == set(RESOURCES)
+
+    second = PlanLeases(db, RESOURCES, "replica-b")
+    second.heartbeat()
+    with first.hold(RESOURCES) as held:
+        first.heartbeat()
+        # W trakcie sprawdzania replika nie oddaje żadnego zasobu
+        assert first.owned == set(held)
+    first.heartbeat()
+    second.heartbeat()
+    assert first.owned.isdisjoint(second.owned)
+    assert first.owned | second.owned == set(RESOURCES)
+
+
+def test_stop_releases_leases(db):
+    leases = PlanLeases(db, ["plan-1"], "replica-a")
+    leases.heartbeat()
+    leases.stop()
+
+    assert leases.owned == set()
+    assert db.plan_leases.count_documents({}) == 0
+    assert db.checker_replicas.count_documents({}) == 0
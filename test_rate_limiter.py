@@ -0,0 +1,90 @@
+import pytest
+
+import RateLimiter
+from RateLimiter import (
+    PRIORITY_COMPARE,
+    PRIORITY_FORMAT,
+    BudgetExceeded,
+    RateLimiter as Limiter,
+    TokenBucket,
+    estimate_tokens,
+    usage_tokens,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake_clock = FakeClock()
+    monkeypatch.setattr(RateLimiter.time, "monotonic", fake_clock)
+    return fake_clock
+
+
+def test_estimate_and_usage_tokens():
+    data = {"messages": [{"content": "x" * 400}, {"content": "y" * 40}]}
+    assert estimate_tokens(data) == 110 + RateLimiter.OPENROUTER_COMPLETION_TOKENS
+    assert usage_tokens({"usage": {"total_tokens": "42"}}) == 42
+    assert usage_tokens({}) is None
+
+
+def test_token_bucket_refills_over_time(clock):
+    bucket = TokenBucket(60)
+    bucket.available = 0
+    assert bucket.wait_time(1) == pytest.approx(1.0)
+    clock.now += 30
+    bucket.refill(clock.now)
+    assert bucket.available == pytest.approx(30)
+    # Zapytanie większe niż kubełek czeka tylko na pełny kubełek
+    assert bucket.wait_time(1000) == pytest.approx(30)
+
+
+def test_requests_per_minute(clock):
+    limiter = Limiter(requests_per_minute=2, tokens_per_minute=0, cycle_budget=0)
+    assert limiter._try_acquire(10, PRIORITY_FORMAT) == 0
+    assert limiter._try_acquire(10, PRIORITY_FORMAT) == 0
+    assert limiter._try_acquire(10, PRIORITY_FORMAT) == pytest.approx(30)
+    clock.now += 30
+    assert limiter._try_acquire(10, PRIORITY_FORMAT) == 0
+
+
+def test_tokens_per_minute_and_usage_correction(clock):
+    limiter = Limiter(requests_per_minute=100, tokens_per_minute=1000, cycle_budget=0)
+    assert limiter._try_acquire(800, PRIORITY_FORMAT) == 0
+    assert limiter._try_acquire(800, PRIORITY_FORMAT) > 0
+    # Odpowiedź zużyła mniej, niż zakładał szacunek - różnica wraca do kubełka
+    limiter.record_usage(800, 100)
+    assert limiter._try_acquire(800, PRIORITY_FORMAT) == 0
+
+
+def test_cycle_budget(clock):
+    limiter = Limiter(requests_per_minute=100, tokens_per_minute=0, cycle_budget=1000)
+    limiter.acquire(600)
+    with pytest.raises(BudgetExceeded):
+        limiter.acquire(600)
+    limiter.start_cycle()
+    limiter.acquire(600)
+    assert limiter.waiting[PRIORITY_FORMAT] == 0
+
+
+def test_compare_goes_before_format(clock):
+    limiter = Limiter(requests_per_minute=100, tokens_per_minute=0, cycle_budget=0)
+    limiter.waiting[PRIORITY_COMPARE] += 1
+    assert limiter._try_acquire(10, PRIORITY_FORMAT) == RateLimiter.MAX_POLL_SECONDS
+    assert limiter._try_acquire(10, PRIORITY_COMPARE) == 0
+
+
+def test_rate_limited_response_pauses_requests(clock):
+    limiter = Limiter(requests_per_minute=100, tokens_per_minute=0, cycle_budget=0)
+    limiter.record_rate_limited("12")
+    assert limiter._try_acquire(10, PRIORITY_COMPARE) == pytest.approx(12)
+    clock.now += 12
+    assert limiter._try_acquire(10, PRIORITY_COMPARE) == 0
+    limiter.record_rate_limited("niepoprawne")
+    assert limiter._try_acquire(10, PRIORITY_COMPARE) == pytest.approx(60)
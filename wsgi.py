@@ -0,0 +1,11 @@
+"""Punkt wejścia WSGI dla API, np.: gunicorn -c gunicorn.conf.py wsgi:app"""
+import os
+
+# Gunicorn obsługuje API w osobnych procesach, także w kontenerze bez SERVER_MODE -
+# stan procesu sprawdzającego (/status) i zdarzenia planów czytamy wtedy z MongoDB
+if os.getenv("SERVER_MODE", "embedded").lower() == "embedded":
+    os.environ["SERVER_MODE"] = "wsgi"
+
+from main import app  # noqa: E402
+
+__all__ = ["app"]